@@ -0,0 +1,37 @@
+"""
+ASGI entry point, ie.: QCMS_ASYNC=1 uvicorn asgi:asgi_app --workers 2
+(pip install -r requirements.txt uvicorn)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from app import app
+
+# requests in flight at once per process; their threads only wait for the view running
+# on the event loop, blocking work is bounded by QCMS_IO_WORKERS (services/io_executor.py)
+ASGI_THREADS = int(os.getenv("QCMS_ASGI_THREADS", "64"))
+
+_requests = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='qcms-asgi')
+
+
+class _Instance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread (thread_sensitive=True), which
+    # serializes requests; here each gets a thread of its own and async views are awaited
+    # on the server's event loop, so the I/O pool sees concurrent calls
+    def _run(self, body):
+        return WsgiToAsgiInstance.run_wsgi_app.__wrapped__(self, body)
+
+    async def run_wsgi_app(self, body):
+        await SyncToAsync(self._run, thread_sensitive=False, executor=_requests)(body)
+
+
+class QcmsAsgi(WsgiToAsgi):
+    """ WsgiToAsgi that doesn't serialize requests; bodies are still read on the event loop """
+
+    async def __call__(self, scope, receive, send):
+        await _Instance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+asgi_app = QcmsAsgi(app)
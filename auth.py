@@ -7,6 +7,12 @@ Created on Sat Oct 18 23:19:16 2025
 """
 # auth.py
 import os
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from flask import request, Response
 from werkzeug.security import check_password_hash
@@ -16,6 +22,16 @@ ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 # >>> from werkzeug.security import generate_password_hash
 # >>> generate_password_hash("yourStrongPassword")
 ADMIN_PASS_HASH = os.getenv("ADMIN_PASS_HASH", "pbkdf2:sha256:260000$...")
+# already verified credentials are remembered (in process memory only) for TTL seconds,
+# so pbkdf2 runs once per session instead of on every admin request; 0 disables it
+ADMIN_AUTH_CACHE_TTL = float(os.getenv("ADMIN_AUTH_CACHE_TTL", "300"))
+ADMIN_AUTH_CACHE_SIZE = int(os.getenv("ADMIN_AUTH_CACHE_SIZE", "32"))
+
+# random key of this process - cache keys are HMACs, never the header itself
+_cache_key = secrets.token_bytes(32)
+# digest -> expiry (monotonic time); the digest covers ADMIN_PASS_HASH, a new hash never matches old entries
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
 
 def _auth_failed():
     return Response(
@@ -24,13 +40,39 @@ def _auth_failed():
         {"WWW-Authenticate": 'Basic realm="Restricted"'}
     )
 
+def _credentials_digest(header: str) -> bytes:
+    msg = ADMIN_PASS_HASH.encode() + b'\0' + header.encode()
+    return hmac.new(_cache_key, msg, hashlib.sha256).digest()
+
+def _check_password(password: str) -> bool:
+    """ check_password_hash with a short-living cache of already verified Authorization headers """
+    if ADMIN_AUTH_CACHE_TTL <= 0:
+        return check_password_hash(ADMIN_PASS_HASH, password)
+    digest = _credentials_digest(request.headers.get('Authorization', ''))
+    now = time.monotonic()
+    with _verified_lock:
+        expires = _verified.get(digest)
+        if expires is not None:
+            if expires > now:
+                _verified.move_to_end(digest)
+                return True
+            del _verified[digest]
+    if not check_password_hash(ADMIN_PASS_HASH, password):
+        return False
+    with _verified_lock:
+        _verified[digest] = now + ADMIN_AUTH_CACHE_TTL
+        _verified.move_to_end(digest)
+        while len(_verified) > ADMIN_AUTH_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return True
+
 def requires_basic_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         auth = request.authorization
         if not auth or auth.username != ADMIN_USER:
             return _auth_failed()
-        if not check_password_hash(ADMIN_PASS_HASH, auth.password):
+        if not _check_password(auth.password):
             return _auth_failed()
         return f(*args, **kwargs)
     return wrapper
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# run.py - latency / throughput / SQL statements per request of every route
+#
+#   python -m benchmarks.run --out bench.json
+#   python -m benchmarks.run --baseline bench.json      # exit code 1 on regression
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.seed import MEDIA_DIR, page_name, seed
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_PASSWORD = 'bench'
+
+
+class StatementCounter:
+    """ Counts SQL statements run by the benchmark thread (set_trace_callback on every connection) """
+
+    def __init__(self):
+        self.count = 0
+        self.thread_id = threading.get_ident()
+
+    def attach(self, conn: sqlite3.Connection) -> None:
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, sql: str) -> None:
+        # statements run by triggers are reported with the text of the outer statement and counted;
+        # "-- ..." are FTS5's own shadow table statements (vary with index merges), not counted
+        if threading.get_ident() == self.thread_id and not sql.startswith('--'):
+            self.count += 1
+
+
+class Scenario:
+    """ One route driven with `requests` calls; before() runs untimed ahead of every call """
+
+    def __init__(self, name: str, rule: str, method: str, call: Callable, before: Optional[Callable] = None,
+                 setup: Optional[Callable] = None):
+        self.name = name
+        self.rule = rule
+        self.method = method
+        self.call = call
+        self.before = before
+        self.setup = setup
+
+
+class Env:
+    """ Test client, admin auth header and seeded data the scenarios pick from """
+
+    def __init__(self, client, pages: int, media: int):
+        self.client = client
+        self.auth = {'Authorization': 'Basic ' + base64.b64encode(f'admin:{ADMIN_PASSWORD}'.encode()).decode()}
+        self.pages = [page_name(i) for i in range(max(pages, 1))]
+        self.media = [f'{MEDIA_DIR}/{i:05d}.png' for i in range(media)]
+        self.blocks = []     # (id, page, position) of seeded blocks
+        self.media_sha = {}  # rel_path -> sha256 of seeded media
+        self.scratch = []  # ids / names created by setup() for the delete scenarios
+
+    def page(self, i: int) -> str:
+        return self.pages[i % len(self.pages)]
+
+
+def _scenarios(env: Env, requests: int) -> List[Scenario]:
+    from models.database import notify_write
+    from models.media_model import MediaModel
+    from models.page_model import PageModel
+
+    def media_etag(i):
+        rel_path = env.media[i % len(env.media)]
+        return env.client.get(f'/media/{rel_path}', headers={'If-None-Match': f'"{env.media_sha[rel_path]}"'})
+
+    def scratch_blocks():
+        model = PageModel()
+        env.scratch = [model.add('bench-scratch', 'en', i + 1, 9999, f'<p>scratch {i}</p>')
+                       for i in range(requests)]
+
+    def scratch_pages():
+        model = PageModel()
+        env.scratch = [f'bench-del-{i}' for i in range(requests)]
+        for name in env.scratch:
+            model.add(name, 'en', 1, 9999, f'<p>{name}</p>')
+
+    def scratch_media():
+        media_model = MediaModel()
+        env.scratch = []
+        for i in range(requests):
+            rel_path = f'{MEDIA_DIR}/scratch-{i:05d}.png'
+            path = os.path.join('static', rel_path)
+            with open(path, 'wb') as f:
+                f.write(b'scratch %d' % i)
+            media_model.insert(f'scratch-{i}', rel_path, 'image/png')
+            env.scratch.append(rel_path)
+
+    def reorder_blocks():
+        env.scratch = [{'id': b['id'], 'content': b['content']} for b in PageModel().get_blocks_for_page('home', 'en')]
+
+    def reorder(i):
+        blocks = env.scratch if i % 2 else env.scratch[::-1]  # whole page reversed and back
+        return env.client.put('/admin/page/home/blocks', headers=env.auth, json={'locale': 'en', 'blocks': blocks})
+
+    def upload(i):
+        data = {'file': (io.BytesIO(b'\x89PNG bench upload %d %f' % (i, time.time())), f'bench{i}.png')}
+        return env.client.post('/upload_media', data=data, headers=env.auth, content_type='multipart/form-data')
+
+    def save_block(i):
+        block_id, page, position = env.blocks[i % len(env.blocks)]
+        return env.client.post(f'/admin/block/{block_id}/save', headers=env.auth, data={
+            'page': page, 'locale': 'en', 'position': str(position), 'content': f'<p>saved {i}</p>'})
+
+    def drop_page_cache(i):
+        # page cache and all fragments: full render
+        for table in ('pages', 'comments', 'params'):
+            notify_write(table)
+
+    new_comment = lambda i: notify_write('comments')  # only the comments fragment is rendered again
+
+    return [
+        # reads - public pages are served from the page cache after the first hit
+        Scenario('home', '/', 'GET', lambda i: env.client.get('/')),
+        Scenario('page', '/page/<page>', 'GET', lambda i: env.client.get(f'/page/{env.page(i)}')),
+        Scenario('page_gzip', '/page/<page>', 'GET',
+                 lambda i: env.client.get(f'/page/{env.page(i)}', headers={'Accept-Encoding': 'gzip'})),
+        Scenario('page_uncached', '/page/<page>', 'GET', lambda i: env.client.get(f'/page/{env.page(i)}'),
+                 before=drop_page_cache),
+        Scenario('page_after_comment', '/page/<page>', 'GET',
+                 lambda i: env.client.get(f'/page/{env.page(i)}'), before=new_comment),
+        Scenario('pages_list', '/pages_list', 'GET', lambda i: env.client.get('/pages_list')),
+        Scenario('get_comments', '/get_comments', 'GET', lambda i: env.client.get('/get_comments')),
+        Scenario('get_comments_page', '/get_comments', 'GET',
+                 lambda i: env.client.get(f'/get_comments?page={env.page(i)}&limit=20')),
+        Scenario('get_comments_ndjson', '/get_comments', 'GET',
+                 lambda i: env.client.get('/get_comments?format=ndjson')),
+        Scenario('search', '/search', 'GET', lambda i: env.client.get('/search?q=dolor+magna')),
+        Scenario('media', '/media/<path:rel_path>', 'GET',
+                 lambda i: env.client.get(f'/media/{env.media[i % len(env.media)]}')),
+        Scenario('media_not_modified', '/media/<path:rel_path>', 'GET', media_etag),
+        Scenario('media_by_hash', '/media/sha256/<sha256>', 'GET',
+                 lambda i: env.client.get(f'/media/sha256/{env.media_sha[env.media[i % len(env.media)]]}')),
+        Scenario('static', '/static/<path:filename>', 'GET', lambda i: env.client.get('/static/style.css')),
+        Scenario('static_gzip', '/static/<path:filename>', 'GET',
+                 lambda i: env.client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})),
+        # admin
+        Scenario('admin', '/admin', 'GET', lambda i: env.client.get('/admin', headers=env.auth)),
+        Scenario('media_library', '/admin/media', 'GET',
+                 lambda i: env.client.get(f'/admin/media?limit=50&before={len(env.media) - i % 50}',
+                                          headers=env.auth)),
+        Scenario('admin_metrics', '/admin/metrics', 'GET',
+                 lambda i: env.client.get('/admin/metrics', headers=env.auth)),
+        Scenario('add_page_form', '/add_page', 'GET', lambda i: env.client.get('/add_page', headers=env.auth)),
+        Scenario('edit_page', '/edit/<page>', 'GET',
+                 lambda i: env.client.get(f'/edit/{env.page(i)}', headers=env.auth)),
+        # writes
+        Scenario('add_comment', '/add_comment', 'POST', lambda i: env.client.post('/add_comment', data={
+            'user': f'bench{i}', 'comment': f'benchmark comment {i}', 'page': env.page(i), 'locale': 'en'})),
+        # one client over its limit: 429 without touching the database
+        Scenario('add_comment_flood', '/add_comment', 'POST', lambda i: env.client.post('/add_comment', data={
+            'user': 'flood', 'comment': f'flood {i}', 'page': env.page(0), 'locale': 'en'},
+            environ_overrides={'REMOTE_ADDR': '10.255.255.254'})),
+        Scenario('block_save', '/admin/block/<int:block_id>/save', 'POST', save_block),
+        Scenario('blocks_get', '/admin/page/<page>/blocks', 'GET',
+                 lambda i: env.client.get(f'/admin/page/{env.page(i)}/blocks', headers=env.auth)),
+        Scenario('blocks_reorder', '/admin/page/<page>/blocks', 'PUT', reorder, setup=reorder_blocks),
+        Scenario('add_block', '/add_page', 'POST', lambda i: env.client.post('/add_page', headers=env.auth, data={
+            'page': 'bench-new', 'position': str(i + 1), 'page_order': '9999', 'content': f'<p>new {i}</p>'})),
+        Scenario('upload_media', '/upload_media', 'POST', upload),
+        Scenario('block_delete', '/admin/block/<int:block_id>/delete', 'POST',
+                 lambda i: env.client.post(f'/admin/block/{env.scratch[i]}/delete', headers=env.auth,
+                                           data={'page': 'bench-scratch', 'locale': 'en'}),
+                 setup=scratch_blocks),
+        Scenario('del_page', '/del_page/<page_id>', 'GET',
+                 lambda i: env.client.get(f'/del_page/{env.scratch[i]}', headers=env.auth), setup=scratch_blocks),
+        Scenario('delete_page', '/delete/<page>', 'GET',
+                 lambda i: env.client.get(f'/delete/{env.scratch[i]}', headers=env.auth), setup=scratch_pages),
+        Scenario('delete_media', '/delete_media/<path:rel_path>', 'GET',
+                 lambda i: env.client.get(f'/delete_media/{env.scratch[i]}', headers=env.auth),
+                 setup=scratch_media),
+    ]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """ Nearest-rank percentile """
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _client_address(i: int) -> str:
+    return f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+
+
+def run_scenario(scenario: Scenario, counter: StatementCounter, requests: int, warmup: int,
+                 client=None) -> Dict:
+    """ Every call comes from its own client address (rate limits are per address) """
+    if scenario.setup:
+        scenario.setup()
+    # delete scenarios consume their scratch rows, so they run without warmup
+    warmup = 0 if scenario.setup else warmup
+    for i in range(warmup):
+        if client is not None:
+            client.environ_base['REMOTE_ADDR'] = _client_address(i)
+        if scenario.before:
+            scenario.before(i)
+        scenario.call(i).close()
+    timings, statements, statuses = [], 0, {}
+    total = 0.0
+    for i in range(warmup, warmup + requests):  # calls get unique indexes (positions, file names)
+        if client is not None:
+            client.environ_base['REMOTE_ADDR'] = _client_address(i)
+        if scenario.before:
+            scenario.before(i)
+        counter.count = 0
+        start = time.perf_counter()
+        response = scenario.call(i)
+        response.get_data()  # streamed bodies are produced here
+        elapsed = time.perf_counter() - start
+        response.close()
+        statements += counter.count
+        total += elapsed
+        timings.append(elapsed * 1000)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    timings.sort()
+    return {
+        'rule': scenario.rule,
+        'method': scenario.method,
+        'requests': requests,
+        'p50_ms': round(_percentile(timings, 50), 3),
+        'p95_ms': round(_percentile(timings, 95), 3),
+        'p99_ms': round(_percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3) if timings else 0.0,
+        'throughput_rps': round(requests / total, 1) if total else 0.0,
+        'statements_per_request': round(statements / requests, 2) if requests else 0.0,
+        'status': statuses,
+    }
+
+
+def compare(result: Dict, baseline: Dict, latency_tolerance: float) -> List[str]:
+    """
+    Regressions of result against baseline: p95 latency worse by more than latency_tolerance
+    (0.25 = 25 %), or at least half a SQL statement per request more (statement counts are
+    deterministic except the params staleness check that runs at most once per QCMS_PARAMS_RECHECK).
+    """
+    problems = []
+    for name, old in baseline.get('routes', {}).items():
+        new = result['routes'].get(name)
+        if new is None:
+            problems.append(f'{name}: missing in this run')
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + latency_tolerance):
+            problems.append(f"{name}: p95 {old['p95_ms']} -> {new['p95_ms']} ms")
+        if new['statements_per_request'] >= old['statements_per_request'] + 0.5:
+            problems.append(f"{name}: statements/request {old['statements_per_request']} -> "
+                            f"{new['statements_per_request']}")
+    return problems
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks every route of the app on a seeded database.')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--blocks', type=int, default=10, help='blocks per page')
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--media', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per scenario')
+    parser.add_argument('--only', action='append', help='run only this scenario (repeatable)')
+    parser.add_argument('--workdir', help='directory for qcms.db and static/ (default: new temp dir)')
+    parser.add_argument('--out', help='write JSON result here (default: stdout)')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown vs baseline')
+    args = parser.parse_args(argv)
+
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix='qcms-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # the app keeps qcms.db and static/uploads in the working directory
+    sys.path.insert(0, REPO_ROOT)
+
+    from werkzeug.security import generate_password_hash
+    os.environ['ADMIN_PASS_HASH'] = generate_password_hash(ADMIN_PASSWORD)
+    # uploaded bench files aren't real images, don't start the variant workers
+    os.environ.setdefault('QCMS_DERIVATIVE_WORKERS', '0')
+
+    from models.database import on_connect
+    counter = StatementCounter()
+    on_connect(counter.attach)  # before anything opens a connection
+
+    scale = seed(pages=args.pages, blocks=args.blocks, comments=args.comments, media=args.media,
+                 rng_seed=args.seed)
+    from app import app
+    env = Env(app.test_client(), args.pages, args.media)
+    from models.database import get_connection
+    conn = get_connection()
+    env.blocks = conn.execute('SELECT id, page, position FROM pages ORDER BY id LIMIT 500').fetchall()
+    env.media_sha = dict(conn.execute('SELECT rel_path, sha256 FROM media').fetchall())
+
+    scenarios = _scenarios(env, args.requests)
+    covered = {s.rule for s in scenarios}
+    uncovered = sorted(r.rule for r in app.url_map.iter_rules() if r.rule not in covered)
+    if args.only:
+        scenarios = [s for s in scenarios if s.name in args.only]
+
+    routes = {}
+    for scenario in scenarios:
+        routes[scenario.name] = run_scenario(scenario, counter, args.requests, args.warmup, env.client)
+        r = routes[scenario.name]
+        print(f"{scenario.name:22} p50 {r['p50_ms']:8.3f}  p95 {r['p95_ms']:8.3f}  p99 {r['p99_ms']:8.3f} ms"
+              f"  {r['throughput_rps']:8.1f} req/s  {r['statements_per_request']:6.2f} stmt  {r['status']}",
+              file=sys.stderr)
+    if uncovered:
+        print(f'routes without a scenario: {", ".join(uncovered)}', file=sys.stderr)
+
+    result = {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'scale': scale,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'env': {k: v for k, v in os.environ.items() if k.startswith('QCMS_')},
+        },
+        'routes': routes,
+        'uncovered_routes': uncovered,
+    }
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if out:
+        with open(out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if baseline:
+        with open(baseline) as f:
+            base = json.load(f)
+        if args.only:
+            base['routes'] = {k: v for k, v in base.get('routes', {}).items() if k in args.only}
+        problems = compare(result, base, args.tolerance)
+        for problem in problems:
+            print(f'REGRESSION {problem}', file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
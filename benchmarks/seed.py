@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# seed.py - deterministic test data for benchmarks
+import argparse
+import hashlib
+import random
+from pathlib import Path
+from typing import Dict
+
+from models.database import get_connection
+from models.home_model import HomeModel
+from models.migrations import migrate
+from models.page_model import fill_media_refs, fill_search_index
+
+STATIC_ROOT = 'static'
+MEDIA_DIR = 'uploads/bench'
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt "
+          "labore dolore magna aliqua enim minim veniam quis nostrud exercitation ullamco laboris "
+          "nisi aliquip commodo consequat duis aute irure reprehenderit voluptate velit esse cillum "
+          "fugiat nulla pariatur excepteur sint occaecat cupidatat proident sunt culpa officia").split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+
+def page_name(i: int) -> str:
+    return 'home' if i == 0 else f'page-{i:04d}'
+
+
+def seed(db_name: str = 'qcms.db', pages: int = 20, blocks: int = 10, comments: int = 2000,
+         media: int = 100, locale: str = 'en', rng_seed: int = 42) -> Dict:
+    """
+    Fills db_name (schema created by the migrations, like the app does) with generated data.
+    Same arguments -> same content. Media rows get small files under static/uploads/bench.
+    Returns number of rows written per table.
+    """
+    rng = random.Random(rng_seed)
+    migrate(db_name)
+    home = HomeModel(db_name)
+    home.set_param('title', 'Benchmark')
+    home.set_param('domain', 'bench.local')
+
+    media_rows = []
+    media_dir = Path(STATIC_ROOT) / MEDIA_DIR
+    media_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(media):
+        data = f'bench-media-{rng_seed}-{i}'.encode() * 64
+        rel_path = f'{MEDIA_DIR}/{i:05d}.png'
+        (Path(STATIC_ROOT) / rel_path).write_bytes(data)
+        media_rows.append((hashlib.sha256(data).hexdigest(), rel_path, 'image/png'))
+
+    block_rows = []
+    for p in range(pages):
+        for b in range(blocks):
+            content = f'<h2>{_text(rng, 4)}</h2><p>{_text(rng, rng.randint(40, 120))}</p>'
+            if media_rows and b % 5 == 0:
+                content += f'[[image:{rng.choice(media_rows)[1]}|{_text(rng, 3)}]]'
+            block_rows.append((page_name(p), p, locale, content, b + 1))
+
+    comment_rows = []
+    for i in range(comments):
+        comment_rows.append((f'10.0.{i // 256 % 256}.{i % 256}', f'user{rng.randrange(500)}',
+                             _text(rng, rng.randint(5, 40)), page_name(rng.randrange(max(pages, 1))),
+                             locale, comments - i))
+
+    conn = get_connection(db_name)
+    with conn:
+        conn.executemany('INSERT INTO media(sha256, rel_path, mime) VALUES(?, ?, ?) '
+                         'ON CONFLICT(sha256) DO NOTHING', media_rows)
+        conn.executemany('INSERT INTO pages(page, page_order, locale, content, position) '
+                         'VALUES(?, ?, ?, ?, ?)', block_rows)
+        conn.executemany("INSERT INTO comments(ip, user, comment, page, locale, creation_date) "
+                         "VALUES(?, ?, ?, ?, ?, datetime('now', '-' || ? || ' minutes'))", comment_rows)
+        fill_media_refs(conn)  # blocks were inserted without PageModel
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='pages_fts'").fetchone():
+            fill_search_index(conn)
+    conn.execute('PRAGMA optimize')
+    return {'pages': pages, 'blocks': len(block_rows), 'comments': len(comment_rows), 'media': len(media_rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seeds qcms.db in the current directory with test data.')
+    parser.add_argument('--db', default='qcms.db')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--blocks', type=int, default=10, help='blocks per page')
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--media', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(seed(args.db, args.pages, args.blocks, args.comments, args.media, rng_seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,21 @@ Created on Fri Oct 17 16:52:51 2025
 
 @author: mariusz
 """
-from flask import  request, jsonify, redirect, url_for
-from services.comment_service import CommentService
-from services.home_service import HomeService
-from services.page_service import PageService
-from services.media_service import MediaService
+import json
+import mimetypes
+import os
+import click
+from flask import  request, jsonify, redirect, url_for, Response, stream_with_context
+from services.media_service import GC_BATCH, GC_MIN_AGE_HOURS, MAX_UPLOAD_BYTES
+from services.metrics import Metrics, METRICS
+from services.compression import Compression, GZIP, compressible, precompress_file
+from services.rate_limiter import RATE_LIMIT, RateLimiter
+from services.registry import get_registry
+from services import template_cache
+from services.transfer_service import TransferService
+from services.static_export_service import StaticExportService
+from services.io_executor import ASYNC_MODE, asgiref, offload
+from models.migrations import migrate
 from auth import requires_basic_auth
 
 class AppController:
@@ -17,86 +27,282 @@ class AppController:
     
     def __init__(self, app):
         self.app = app
-        self.comment_service = CommentService()
-        self.home_service = HomeService()
-        self.page_service = PageService()
-        self.media_service = MediaService()
+        if ASYNC_MODE and asgiref is None:
+            raise RuntimeError('QCMS_ASYNC=1 needs async support in Flask: pip install -r requirements.txt')
+        # oversized request bodies are refused before werkzeug spools them (room for form fields);
+        # Flask's default config has MAX_CONTENT_LENGTH = None, so setdefault would keep no limit
+        if self.app.config.get('MAX_CONTENT_LENGTH') is None:
+            self.app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+        registry = get_registry()  # runs pending schema migrations once per process
+        self.comment_service = registry.comment_service
+        self.home_service = registry.home_service
+        self.page_service = registry.page_service
+        self.media_service = registry.media_service
+        # request/SQL timing only when enabled, otherwise nothing is hooked in
+        self.metrics = Metrics() if METRICS else None
+        if self.metrics:
+            self.metrics.install(self.app)
+        # write routes: token bucket per client address (QCMS_RATE_LIMIT=0 = no limits)
+        self.rate_limiter = RateLimiter(None if RATE_LIMIT else {})
+        # gzip by Accept-Encoding (QCMS_GZIP=0 = left to the web server)
+        self.compression = Compression() if GZIP else None
+        template_cache.install(self.app)
         self.setup_routes()
+        self.setup_commands()
+        if self.compression:
+            self.compression.install(self.app)  # after the routes: wraps the static view
+        # compiled templates and URL map ready before the first request (QCMS_WARMUP=0 skips it)
+        if template_cache.WARMUP:
+            template_cache.warm_up(self.app)
 
     def setup_routes(self):
-        """ Routes """
+        """ Routes (with QCMS_ASYNC=1 @offload makes them async views running on the I/O pool) """
         @self.app.route('/')
+        @offload
         def home():
             """ Start point """
             return self.page_service.render_page('home')
  
         @self.app.route('/pages_list')
+        @offload
         def get_pages_list():
             return jsonify({'pages': self.page_service.get_pages_list()})
     
         @self.app.route('/page/<page>')
+        @offload
         def show_page(page):
             return self.page_service.render_page(page)
         
         @self.app.route('/add_page', methods=['GET', 'POST'])
+        @offload
+        @self.rate_limiter.limit(methods=('POST',))
         @requires_basic_auth
         def add_page():
             return self.page_service.add_page_response()
         
         @self.app.route('/del_page/<page_id>')
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def del_page(page_id: int):
             return self.page_service.delete(page_id)
         
         @self.app.route('/edit/<page>')
+        @offload
         @requires_basic_auth
         def edit_page(page):
             return self.page_service.render_edit_page(page)
         
         @self.app.route('/admin/block/<int:block_id>/save', methods=['POST'])
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def save_block(block_id):
             return self.page_service.save_block(block_id)
         
         @self.app.route('/admin/block/<int:block_id>/delete', methods=['POST'])
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def delete_block(block_id):
             return self.page_service.delete_block(block_id)
         
+        @self.app.route('/admin/page/<page>/blocks', methods=['GET', 'PUT'])
+        @offload
+        @self.rate_limiter.limit(methods=('PUT',))
+        @requires_basic_auth
+        def page_blocks(page: str):
+            """ GET: blocks of the page as JSON. PUT {"locale": "en", "blocks": [{"id": 3, "content": ...},
+            {"content": ...}]}: the page gets exactly these blocks in this order, in one transaction """
+            if request.method == 'GET':
+                locale = request.args.get('locale') or self.page_service.detect_locale()
+                return jsonify({'page': page, 'locale': locale, 'blocks': self.page_service.get_blocks(page, locale)})
+            data = request.get_json(silent=True) or {}
+            blocks = data.get('blocks')
+            if not isinstance(blocks, list) or not all(
+                    isinstance(b, dict) and isinstance(b.get('content'), str)
+                    and (b.get('id') is None or type(b.get('id')) is int) for b in blocks):
+                return jsonify({'error': 'BLOCKS_INVALID'}), 400
+            locale = data.get('locale') or self.page_service.detect_locale()
+            try:
+                result = self.page_service.replace_blocks(page, locale, blocks)
+            except ValueError:
+                return jsonify({'error': 'UNKNOWN_BLOCK'}), 400
+            return jsonify({'page': page, 'locale': locale, 'blocks': result})
+
         @self.app.route('/delete/<page>')
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def delete(page: str):
             locale= self.page_service.detect_locale()
             return self.page_service.delete_by_name(page, locale)
         
         @self.app.route('/add_comment', methods=['POST'])
+        @offload
+        @self.rate_limiter.limit()
         def add_comment():
             """ Adding new comment """
             comment = request.form.get('comment', '')
             user = request.form.get('user', '')
+            page = (request.form.get('page') or '').strip() or 'home'
+            locale = (request.form.get('locale') or '').strip() or self.page_service.detect_locale()
             ip = request.remote_addr
-            result, message = self.comment_service.add(ip, user, comment)
-            return redirect(url_for('home'))
+            result, message = self.comment_service.add(ip, user, comment, page, locale)
+            if page == 'home':
+                return redirect(url_for('home'))
+            return redirect(url_for('show_page', page=page, lang=locale))
         
         @self.app.route('/get_comments')
+        @offload
         def get_comments():
-            comments = self.comment_service.get_all()
-            return jsonify({ 'comments': comments })
+            """ Newest comments first: ?before=<id>&limit=<n>[&page=<page>&locale=<locale>],
+            or ?format=ndjson for a full export """
+            if request.args.get('format') == 'ndjson':
+                rows = (json.dumps(c) + '\n' for c in self.comment_service.iter_all())
+                return Response(stream_with_context(rows), mimetype='application/x-ndjson')
+            before = request.args.get('before', type=int)
+            limit = request.args.get('limit', type=int)
+            page = request.args.get('page')
+            locale = request.args.get('locale') or self.page_service.detect_locale()
+            comments = self.comment_service.get_latest(limit, before, page, locale)
+            next_before = comments[-1]['id'] if comments else None
+            return jsonify({ 'comments': comments, 'next_before': next_before })
         
         @self.app.route('/upload_media', methods=['POST'])
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def upload_media():
             return self.page_service.media_upload_response()
         
+        @self.app.route('/media/<path:rel_path>')
+        @offload
+        def serve_media(rel_path: str):
+            return self.media_service.send(rel_path=rel_path)
+
+        @self.app.route('/media/sha256/<sha256>')
+        @offload
+        def serve_media_by_hash(sha256: str):
+            return self.media_service.send(sha256=sha256)
+
         @self.app.route('/delete_media/<path:rel_path>', methods=['GET'])
+        @offload
+        @self.rate_limiter.limit()
         @requires_basic_auth
         def delete_media(rel_path: str):
             return self.page_service.media_delete_response(rel_path, self.page_service.detect_locale())
         
+        @self.app.route('/admin/media')
+        @offload
+        @requires_basic_auth
+        def media_library():
+            """ Uploads newest first with number of blocks using them: ?before=<id>&limit=<n> """
+            before = request.args.get('before', type=int)
+            limit = request.args.get('limit', 25, type=int)
+            media = self.media_service.recent(limit, before)
+            next_before = media[-1]['id'] if media else None
+            return jsonify({'media': media, 'next_before': next_before})
+
         @self.app.route('/admin')
+        @offload
         @requires_basic_auth
         def admin_page():
             return self.page_service.render_page('admin')
 
+        @self.app.route('/admin/metrics')
+        @offload
+        @requires_basic_auth
+        def admin_metrics():
+            """ Per-route latency histograms and query counts (QCMS_METRICS=1), cache stats """
+            data = self.metrics.snapshot() if self.metrics else {'routes': {}, 'queries': []}
+            data.update({
+                'enabled': self.metrics is not None,
+                'page_cache': self.page_service.page_cache.stats(),
+                'fragment_cache': self.page_service.fragment_cache.stats(),
+                'comment_queue': self.comment_service.queue_depth(),
+                'gzip_cache': self.compression.stats() if self.compression else None,
+                'rate_limiter': self.rate_limiter.stats(),
+            })
+            return jsonify(data)
+
+        @self.app.route('/search')
+        @offload
+        def search():
+            return self.page_service.render_search()
+
+    def setup_commands(self):
+        """ CLI commands: flask --app app <command> """
+        @self.app.cli.command('migrate')
+        def migrate_db():
+            """ Applies pending schema migrations (also done on start) """
+            print(f"Schema version {migrate()}.")
+
+        @self.app.cli.command('export')
+        @click.argument('path')
+        @click.option('--files', 'files_path', help='also write static/uploads to this tar (.tar.gz = compressed)')
+        def export_site(path, files_path):
+            """ Exports params, pages, comments and media as NDJSON to PATH (- = stdout, .gz = gzip) """
+            counts = TransferService().export(path, files_path)
+            click.echo(f"Exported {counts}.", err=path == '-')
+
+        @self.app.cli.command('import')
+        @click.argument('path')
+        @click.option('--files', 'files_path', help='tar with uploads made by export --files')
+        @click.option('--replace', is_flag=True, help='delete current content first')
+        def import_site(path, files_path, replace):
+            """ Imports an NDJSON export (- = stdin) into this database in one transaction """
+            try:
+                counts = TransferService().import_(path, files_path, replace)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            click.echo(f"Imported {counts}.")
+
+        @self.app.cli.command('export-static')
+        @click.argument('out_dir')
+        @click.option('--full', is_flag=True, help='render all pages, not only the changed ones')
+        def export_static(out_dir, full):
+            """ Renders public pages (+ used uploads, static files) to OUT_DIR for a web server """
+            try:
+                counts = StaticExportService(self.app, self.page_service).export(out_dir, full)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            click.echo(f"Static export {counts}.")
+
+        @self.app.cli.command('media-gc')
+        @click.option('--batch', default=GC_BATCH, show_default=True, help='uploads deleted per transaction')
+        @click.option('--min-age-hours', default=GC_MIN_AGE_HOURS, show_default=True,
+                      help='keep files younger than this')
+        def media_gc(batch, min_age_hours):
+            """ Deletes uploads no block uses (rows, variants, files) and stray files in static/uploads """
+            counts = self.media_service.gc(batch, min_age_hours)
+            print(f"Removed {counts['rows']} uploads, {counts['files']} files ({counts['bytes']} bytes).")
+
+        @self.app.cli.command('compress-static')
+        def compress_static():
+            """ Writes <file>.gz next to every compressible file in static/ (outside uploads) """
+            count = 0
+            for dirpath, dirnames, filenames in os.walk(self.app.static_folder):
+                if dirpath == self.app.static_folder and 'uploads' in dirnames:
+                    dirnames.remove('uploads')
+                for name in filenames:
+                    if name.startswith('.') or not compressible(mimetypes.guess_type(name)[0]):
+                        continue
+                    count += precompress_file(os.path.join(dirpath, name)) is not None
+            print(f"{count} files precompressed.")
+
+        @self.app.cli.command('precompile-templates')
+        def precompile_templates():
+            """ Compiles all templates into the bytecode cache (QCMS_TEMPLATE_CACHE), ie. at build time """
+            names = template_cache.precompile(self.app)
+            where = template_cache.TEMPLATE_CACHE_DIR or 'memory only, QCMS_TEMPLATE_CACHE is empty'
+            print(f"Compiled {len(names)} templates ({where}).")
+
+        @self.app.cli.command('rebuild-search')
+        def rebuild_search():
+            """ Rebuilds full-text search index of all blocks """
+            count = self.page_service.rebuild_search_index()
+            print(f"Indexed {count} blocks.")
+
     
 
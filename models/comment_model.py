@@ -5,7 +5,15 @@ Created on Fri Oct 17 21:00:21 2025
 
 @author: mariusz
 """
-import sqlite3
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+from models.database import get_connection, notify_write
+
+# how many of the latest comments are shown in the right column
+COMMENTS_WINDOW = int(os.getenv("QCMS_COMMENTS_WINDOW", "50"))
+COMMENTS_MAX_LIMIT = 500
+
+_COLUMNS = "id, ip, user, comment, datetime(creation_date, 'localtime'), page, locale"
 
 
 class CommentModel:
@@ -13,27 +21,13 @@ class CommentModel:
 
     def __init__(self, db_name='qcms.db'):
         self.db_name = db_name
-        self.init_db()
 
-    def init_db(self):
-        """
-        Initialization of db and table
-        """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
-                      CREATE TABLE IF NOT EXISTS comments(
-                          id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          ip TEXT NOT NULL,
-                          creation_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                          user TEXT,
-                          comment TEXT NOT NULL
-                          )
-                      ''')
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def _to_dict(row) -> Dict:
+        return {'id': row[0], 'ip': row[1], 'user': row[2], 'comment': row[3], 'creation_date': row[4],
+                'page': row[5], 'locale': row[6]}
 
-    def add(self, ip, user, comment):
+    def add(self, ip, user, comment, page='home', locale='en'):
         """
         Parameters
         ----------
@@ -43,6 +37,10 @@ class CommentModel:
             the name or email provided by the user.
         comment : TYPE
             comment itself.
+        page : TYPE
+            name of the commented page.
+        locale : TYPE
+            locale of the commented page.
 
         Returns
         -------
@@ -51,21 +49,81 @@ class CommentModel:
         None: in case of unexpected problems
 
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO comments(ip, user, comment) VALUES(?, ?, ?)', (ip, user, comment,))
-        conn.commit()
-        comment_id = cursor.lastrowid
-        conn.close()
+        with get_connection(self.db_name) as conn:
+            cursor = conn.execute(
+                'INSERT INTO comments(ip, user, comment, page, locale) VALUES(?, ?, ?, ?, ?)',
+                (ip, user, comment, page, locale,))
+            comment_id = cursor.lastrowid
+        notify_write('comments')
         if comment_id:
             return comment_id
         return None
 
+    def add_many(self, comments: List[tuple]) -> int:
+        """
+        Inserts many comments (ip, user, comment, page, locale) in one transaction.
+        Returns number of inserted comments.
+        """
+        with get_connection(self.db_name) as conn:
+            conn.executemany(
+                'INSERT INTO comments(ip, user, comment, page, locale) VALUES(?, ?, ?, ?, ?)', comments)
+        notify_write('comments')
+        return len(comments)
+
     def get_all(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, ip, user, comment, datetime(creation_date, 'localtime') FROM comments")
+        conn = get_connection(self.db_name)
+        cursor = conn.execute(f"SELECT {_COLUMNS} FROM comments")
         comments = cursor.fetchall()
-        conn.close()
-        return [{'id': comment[0], 'ip': comment[1], 'user': comment[2], 'comment': comment[3], 'creation_date': comment[4]} for comment in comments]
+        return [self._to_dict(comment) for comment in comments]
+
+    def get_latest(self, limit: int = COMMENTS_WINDOW, before: Optional[int] = None,
+                   page: Optional[str] = None, locale: str = 'en') -> List[Dict]:
+        """
+        Newest comments first, at most `limit` of them.
+        `before` is id of the last comment of the previous page (keyset cursor); if that
+        comment was deleted meanwhile, comments with a lower id follow.
+        `page` limits the result to comments of one page/locale (None = whole site).
+        """
+        limit = max(1, min(int(limit), COMMENTS_MAX_LIMIT))
+        conn = get_connection(self.db_name)
+        cursor = '(creation_date, id) < (SELECT creation_date, id FROM comments WHERE id = ?)'
+        rows = self._latest(conn, limit, before, page, locale, cursor)
+        if not rows and before is not None and not conn.execute(
+                "SELECT 1 FROM comments WHERE id = ?", (int(before),)).fetchone():
+            rows = self._latest(conn, limit, before, page, locale, 'id < ?')
+        return [self._to_dict(comment) for comment in rows]
+
+    @staticmethod
+    def _latest(conn, limit: int, before: Optional[int], page: Optional[str], locale: str,
+                cursor: str) -> List[Tuple]:
+        where, args = [], []
+        if page is not None:
+            where.append('page = ? AND locale = ?')
+            args += [page, locale]
+        if before is not None:
+            where.append(cursor)
+            args.append(int(before))
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+        return conn.execute(f'''
+            SELECT {_COLUMNS} FROM comments
+            {where_sql}
+            ORDER BY creation_date DESC, id DESC
+            LIMIT ?
+        ''', (*args, limit)).fetchall()
+
+    def iter_all(self, batch_size: int = COMMENTS_MAX_LIMIT) -> Iterator[Dict]:
+        """All comments (oldest first), read in keyset batches so they never sit in memory at once."""
+        conn = get_connection(self.db_name)
+        last = ('', 0)
+        while True:
+            rows = conn.execute(f'''
+                SELECT {_COLUMNS}, creation_date FROM comments
+                WHERE (creation_date, id) > (?, ?)
+                ORDER BY creation_date ASC, id ASC
+                LIMIT ?
+            ''', (*last, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_dict(row)
+            last = (rows[-1][7], rows[-1][0])
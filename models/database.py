@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# database.py
+import html
+import os
+import re
+import sqlite3
+import threading
+
+from models.query_log import TimedConnection
+
+# Connection tuning, overridable from the environment like the admin credentials.
+# QCMS_DB_CACHE_SIZE follows sqlite semantics: negative value = size in KiB.
+DB_SYNCHRONOUS = os.getenv("QCMS_DB_SYNCHRONOUS", "NORMAL").upper()
+DB_CACHE_SIZE = int(os.getenv("QCMS_DB_CACHE_SIZE", "-16000"))
+DB_MMAP_SIZE = int(os.getenv("QCMS_DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = int(os.getenv("QCMS_DB_BUSY_TIMEOUT", "5000"))  # ms
+DB_STATEMENT_CACHE = int(os.getenv("QCMS_DB_STATEMENT_CACHE", "256"))
+# time every statement for the metrics (Server-Timing, /admin/metrics); off = plain sqlite3 objects
+DB_QUERY_LOG = os.getenv("QCMS_METRICS", "0") == "1"
+
+_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+_SCRIPT_STYLE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r'<[^>]*>')
+_IMAGE_SHORTCODE = re.compile(r'\[\[image:[^|\]]*\|?([^\]]*)\]\]')
+
+_local = threading.local()
+# pid -> {db_name: connection} only asked for PRAGMA data_version (see data_version)
+_watchers = {}
+_watchers_lock = threading.Lock()
+# connections inherited through fork() must never be closed by the child,
+# sqlite could checkpoint/unlink the WAL the parent is still using
+_inherited = []
+
+
+def get_connection(db_name: str = 'qcms.db') -> sqlite3.Connection:
+    """
+    Returns connection to db_name owned by the current thread.
+    Connection is opened (and tuned) on first use and then reused, so callers
+    must not close it; it is closed when the thread ends (its thread-local data goes).
+    `with get_connection(...) as conn:` still commits or rolls back the transaction
+    like a fresh connection would.
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _inherited.extend(getattr(_local, 'conns', {}).values())
+        _local.conns = {}
+        _local.pid = pid
+    conn = _local.conns.get(db_name)
+    if conn is None:
+        conn = _local.conns[db_name] = _open(db_name)
+    return conn
+
+
+def data_version(db_name: str = 'qcms.db') -> int:
+    """
+    PRAGMA data_version of a connection of its own (one per process): it changes whenever
+    any other connection - other thread or other worker process - committed to db_name.
+    Lets in-process caches notice writes they never saw through notify_write.
+    """
+    pid = os.getpid()
+    with _watchers_lock:
+        conns = _watchers.get(pid)
+        if conns is None:
+            # after fork() the parent's watchers stay open, like _inherited
+            conns = _watchers[pid] = {}
+        conn = conns.get(db_name)
+        if conn is None:
+            conn = conns[db_name] = sqlite3.connect(db_name, timeout=DB_BUSY_TIMEOUT / 1000,
+                                                    check_same_thread=False)
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+def _open(db_name: str) -> sqlite3.Connection:
+    synchronous = DB_SYNCHRONOUS if DB_SYNCHRONOUS in _SYNCHRONOUS_MODES else 'NORMAL'
+    conn = sqlite3.connect(
+        db_name,
+        timeout=DB_BUSY_TIMEOUT / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+        factory=TimedConnection if DB_QUERY_LOG else sqlite3.Connection,
+    )
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT)}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute(f"PRAGMA cache_size={int(DB_CACHE_SIZE)}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+    # only called by migration 5 (full-text index), later writes are indexed by PageModel
+    conn.create_function('strip_html', 1, strip_html, deterministic=True)
+    for hook in list(_connect_hooks):
+        hook(conn)
+    return conn
+
+
+def strip_html(content):
+    """Plain text of an HTML block (tags, scripts and styles removed, entities decoded)."""
+    if content is None:
+        return None
+    # called for every indexed block (bulk imports: millions), so regexes only run when needed
+    text = content
+    if '<' in text:
+        lowered = text.lower()
+        if '<script' in lowered or '<style' in lowered:
+            text = _SCRIPT_STYLE.sub(' ', text)
+        text = _TAG.sub(' ', text)
+    if '[[' in text:
+        text = _IMAGE_SHORTCODE.sub(r' \1 ', text)
+    if '&' in text:
+        text = html.unescape(text)
+    return ' '.join(text.split())
+
+
+_connect_hooks = []
+
+
+def on_connect(hook) -> None:
+    """Registers hook(conn) called for every newly opened connection (ie. statement tracing)."""
+    _connect_hooks.append(hook)
+
+
+_write_listeners = []
+
+
+def on_write(listener) -> None:
+    """Registers listener(table) called after a model committed a write to table."""
+    _write_listeners.append(listener)
+
+
+def notify_write(table: str) -> None:
+    """Tells the listeners (ie. caches) that table was changed."""
+    for listener in list(_write_listeners):
+        listener(table)
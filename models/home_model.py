@@ -6,62 +6,82 @@ Created on Fri Oct 17 20:48:47 2025
 @author: mariusz
 """
 
-import sqlite3
+import os
+import threading
+import time
+from typing import Dict
+from models.database import get_connection, notify_write
+
+# how often (seconds) the params snapshot checks if another connection/process changed the db
+PARAMS_RECHECK = float(os.getenv("QCMS_PARAMS_RECHECK", "1.0"))
+# stored in params('version') by the migration runner
+VERSION = '0.3.0'
 
 
 class HomeModel():
     """ Home data model """
 
+    # db_name -> {'params': {...}, 'checked_at': monotonic time of the last staleness check}
+    _snapshots = {}
+    _snapshot_lock = threading.Lock()
+    # per thread (so per connection): db_name -> (id(conn), PRAGMA data_version) seen last
+    _seen = threading.local()
+
     def __init__(self, db_name='qcms.db'):
         self.db_name = db_name
-        self.version='0.3.0'
-        self.init_db()
+        self.version = VERSION
+
+    @classmethod
+    def forget_snapshot(cls, db_name: str = 'qcms.db') -> None:
+        """Drops the params snapshot of db_name (params were written outside set_param)."""
+        cls._snapshots.pop(db_name, None)
 
-    def init_db(self):
+    def _params(self) -> Dict[str, str]:
         """
-        Initialization of db and table
+        In-memory snapshot of the whole params table.
+        Reloaded after set_param, and when PRAGMA data_version shows that some other
+        connection (ie. other worker process) committed - checked at most every
+        PARAMS_RECHECK seconds, so the hot path doesn't run any SQL.
         """
-        with sqlite3.connect(self.db_name) as conn:
-            # schema – always
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS params(
-                    id    INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name  TEXT NOT NULL UNIQUE,
-                    value TEXT
-                )
-            """)
-    
-            # default entries - only if they don't exists
-            conn.execute("""
-                INSERT OR IGNORE INTO params(name, value)
-                VALUES('creation_date', strftime('%d.%m.%Y %H:%M', 'now', 'localtime'))
-            """)
-            conn.execute("""
-                INSERT OR IGNORE INTO params(name, value)
-                VALUES('modification_date', strftime('%d.%m.%Y %H:%M', 'now', 'localtime'))
-            """)
-            
-            # UPSERT - set always the most current version
-            conn.execute("""
-                INSERT INTO params(name, value) VALUES('version', ?)
-                ON CONFLICT(name) DO UPDATE SET value=excluded.value
-            """, (self.version,))
+        snapshot = self._snapshots.get(self.db_name)
+        now = time.monotonic()
+        if snapshot is not None and now - snapshot['checked_at'] < PARAMS_RECHECK:
+            return snapshot['params']
+        conn = get_connection(self.db_name)
+        seen = getattr(self._seen, 'versions', None)
+        if seen is None:
+            seen = self._seen.versions = {}
+        version = (id(conn), conn.execute('PRAGMA data_version').fetchone()[0])
+        if snapshot is not None and seen.get(self.db_name) == version:
+            snapshot['checked_at'] = now
+            return snapshot['params']
+        seen[self.db_name] = version
+        return self._reload(conn)['params']
+
+    def _reload(self, conn) -> Dict:
+        with self._snapshot_lock:
+            params = dict(conn.execute('SELECT name, value FROM params').fetchall())
+            snapshot = {'params': params, 'checked_at': time.monotonic()}
+            self._snapshots[self.db_name] = snapshot
+            return snapshot
+
+    def get_params(self) -> Dict[str, str]:
+        """Copy of all params as dict name -> value."""
+        return dict(self._params())
 
     def get_param(self, name: str) -> str | None:
-        with sqlite3.connect(self.db_name) as conn:
-            cur = conn.cursor()
-            cur.execute('SELECT value FROM params WHERE name = ?', (name,))
-            row = cur.fetchone()
-            return row[0] if row else None
+        return self._params().get(name)
 
     def set_param(self, name: str, value: str) -> None:
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             cur = conn.cursor()
             cur.execute(
                 'INSERT INTO params(name, value) VALUES(?, ?) '
                 'ON CONFLICT(name) DO UPDATE SET value=excluded.value',
                 (name, value)
             )
+        self._reload(conn)
+        notify_write('params')
 
     def get_footer_data(self):
         """
@@ -70,11 +90,6 @@ class HomeModel():
         -------
         version
         """
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            footer_data = {}
-            for name in ('version', 'creation_date', 'modification_date'):
-                cursor.execute('SELECT value FROM params WHERE name = ?', (name,))
-                row = cursor.fetchone()
-                footer_data[name] = row[0] if row else None
-            return footer_data or None
+        params = self._params()
+        footer_data = {name: params.get(name) for name in ('version', 'creation_date', 'modification_date')}
+        return footer_data or None
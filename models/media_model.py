@@ -6,61 +6,182 @@ Created on Sat Oct 18 18:54:20 2025
 @author: mariusz
 """
 
-import sqlite3
-from typing import Optional, List, Dict
+from models.database import get_connection, notify_write
+from typing import Optional, List, Dict, Set, Tuple
+
+MEDIA_MAX_LIMIT = 200  # uploads per page of the media library
+# rel_paths of media row m and of its variants - a block linking only a variant uses the upload too
+_PATHS_OF = """(SELECT m.rel_path UNION ALL SELECT d.rel_path FROM media_derivatives d WHERE d.media_id = m.id)"""
+_UNUSED = f"NOT EXISTS (SELECT 1 FROM media_refs r WHERE r.rel_path IN {_PATHS_OF})"
 
 class MediaModel:
     def __init__(self, db_name: str = 'qcms.db'):
         self.db_name = db_name
-        self.init_db()
-
-    def init_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.executescript("""
-                CREATE TABLE IF NOT EXISTS media (
-                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sha256      TEXT NOT NULL UNIQUE,
-                    rel_path    TEXT NOT NULL UNIQUE,    -- np. uploads/2025/10/18/abcd1234_name.jpg
-                    mime        TEXT NOT NULL,
-                    uploaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
-                );
-                CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256);
-                CREATE INDEX IF NOT EXISTS idx_media_uploaded_at ON media(uploaded_at);
-            """)
 
     def get_by_hash(self, sha256: str) -> Optional[Dict]:
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             cur = conn.execute("SELECT id, sha256, rel_path, mime, uploaded_at FROM media WHERE sha256=?", (sha256,))
             row = cur.fetchone()
         if not row:
             return None
         return {"id": row[0], "sha256": row[1], "rel_path": row[2], "mime": row[3], "uploaded_at": row[4]}
 
-    def insert(self, sha256: str, rel_path: str, mime: str) -> int:
-        with sqlite3.connect(self.db_name) as conn:
+    def insert(self, sha256: str, rel_path: str, mime: str) -> Optional[int]:
+        """Returns id of the new row or None when a file with this sha256 is already stored."""
+        with get_connection(self.db_name) as conn:
             cur = conn.execute("""
                 INSERT INTO media(sha256, rel_path, mime) VALUES(?,?,?)
+                ON CONFLICT(sha256) DO NOTHING
             """, (sha256, rel_path, mime))
-            return cur.lastrowid
+            return cur.lastrowid if cur.rowcount else None
         
     def delete(self, rel_path: str) -> int:
-        with sqlite3.connect(self.db_name) as conn:
-            cur = conn.execute("""
-                              DELETE FROM media WHERE rel_path=?;
-            """, (rel_path,))
+        """Deletes the row of rel_path and its variants, unless a block uses it or a variant (then returns 0)."""
+        with get_connection(self.db_name) as conn:
+            row = conn.execute(f"SELECT id FROM media m WHERE rel_path=? AND {_UNUSED}", (rel_path,)).fetchone()
+            if row is None:
+                return 0
+            conn.execute("DELETE FROM media_derivatives WHERE media_id=?", (row[0],))
+            cur = conn.execute("DELETE FROM media WHERE id=?", (row[0],))
             return cur.rowcount
 
-    def recent(self) -> List[Dict]:
-        # rekordy z dzisiaj i wczoraj wg czasu lokalnego
-        with sqlite3.connect(self.db_name) as conn:
+    def used_by(self, rel_path: str) -> List[str]:
+        """Pages with a block using rel_path or one of its variants."""
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute(f"""
+                SELECT DISTINCT p.page
+                FROM media m JOIN media_refs r ON r.rel_path IN {_PATHS_OF}
+                JOIN pages p ON p.id = r.block_id
+                WHERE m.rel_path=?
+                ORDER BY p.page
+            """, (rel_path,))
+            return [r[0] for r in cur.fetchall()]
+
+    def orphans(self, after_id: int, limit: int, min_age_hours: float) -> List[int]:
+        """Ids (> after_id, ascending) of uploads older than min_age_hours that no block uses."""
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute(f"""
+                SELECT id FROM media m
+                WHERE id > ? AND uploaded_at < datetime('now', ?)
+                  AND {_UNUSED}
+                ORDER BY id
+                LIMIT ?
+            """, (int(after_id), f'-{float(min_age_hours)} hours', int(limit)))
+            return [r[0] for r in cur.fetchall()]
+
+    def delete_orphans(self, ids: List[int]) -> Tuple[int, List[str]]:
+        """
+        Deletes uploads of ids still unused (checked again under the write lock) with their
+        variants in one short transaction. Returns (deleted uploads, rel_paths of their files).
+        """
+        if not ids:
+            return 0, []
+        conn = get_connection(self.db_name)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            placeholders = ','.join('?' * len(ids))
+            rows = conn.execute(f"""
+                SELECT id, rel_path FROM media m
+                WHERE id IN ({placeholders})
+                  AND {_UNUSED}
+            """, ids).fetchall()
+            if not rows:
+                return 0, []
+            unused = [r[0] for r in rows]
+            placeholders = ','.join('?' * len(unused))
+            paths = [r[1] for r in rows] + [r[0] for r in conn.execute(
+                f"SELECT rel_path FROM media_derivatives WHERE media_id IN ({placeholders})", unused)]
+            conn.execute(f"DELETE FROM media_derivatives WHERE media_id IN ({placeholders})", unused)
+            conn.execute(f"DELETE FROM media WHERE id IN ({placeholders})", unused)
+        return len(unused), paths
+
+    def known_paths(self, rel_paths: List[str]) -> Set[str]:
+        """Those of rel_paths that belong to an upload or a variant."""
+        if not rel_paths:
+            return set()
+        placeholders = ','.join('?' * len(rel_paths))
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute(f"""
+                SELECT rel_path FROM media WHERE rel_path IN ({placeholders})
+                UNION ALL
+                SELECT rel_path FROM media_derivatives WHERE rel_path IN ({placeholders})
+            """, list(rel_paths) * 2)
+            return {r[0] for r in cur.fetchall()}
+
+    def get_by_path(self, rel_path: str) -> Optional[Dict]:
+        """Uploaded file or its variant by rel_path, with ETag derived from the content hash."""
+        with get_connection(self.db_name) as conn:
             cur = conn.execute("""
-                SELECT id, sha256, rel_path, mime, uploaded_at
-                FROM media
-                ORDER BY uploaded_at DESC
-                LIMIT 25
-            """)
-            rows = cur.fetchall()
-            print(rows)
-        return [{"id": r[0], "sha256": r[1], "rel_path": r[2], "mime": r[3], "uploaded_at": r[4]} for r in rows]
-    
+                SELECT rel_path, mime, sha256 FROM media WHERE rel_path=?
+                UNION ALL
+                SELECT rel_path, mime, source_sha256 || '-' || width || format
+                FROM media_derivatives WHERE rel_path=?
+                LIMIT 1
+            """, (rel_path, rel_path))
+            row = cur.fetchone()
+        if not row:
+            return None
+        return {"rel_path": row[0], "mime": row[1], "etag": row[2]}
+
+    def has_derivatives(self, sha256: str) -> bool:
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute("SELECT 1 FROM media_derivatives WHERE source_sha256=? LIMIT 1", (sha256,))
+            return cur.fetchone() is not None
+
+    def add_derivatives(self, media_id: int, sha256: str, derivatives: List[Dict]) -> None:
+        """Stores variants (width, format, rel_path, mime) of one source file."""
+        with get_connection(self.db_name) as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO media_derivatives(media_id, source_sha256, width, format, rel_path, mime)
+                VALUES(?,?,?,?,?,?)
+            """, [(media_id, sha256, d["width"], d["format"], d["rel_path"], d["mime"]) for d in derivatives])
+        notify_write('media_derivatives')
+
+    def get_derivatives(self, rel_paths: List[str]) -> Dict[str, List[Dict]]:
+        """Variants of the given source files: rel_path -> [{width, format, rel_path, mime}] by width."""
+        if not rel_paths:
+            return {}
+        placeholders = ','.join('?' * len(rel_paths))
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute(f"""
+                SELECT m.rel_path, d.width, d.format, d.rel_path, d.mime
+                FROM media m JOIN media_derivatives d ON d.media_id = m.id
+                WHERE m.rel_path IN ({placeholders})
+                ORDER BY d.width ASC
+            """, list(rel_paths))
+            result = {}
+            for r in cur.fetchall():
+                result.setdefault(r[0], []).append({"width": r[1], "format": r[2], "rel_path": r[3], "mime": r[4]})
+            return result
 
+    def derivative_paths(self, rel_path: str) -> List[str]:
+        """rel_paths of all variants of one source file."""
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute("""
+                SELECT d.rel_path FROM media m JOIN media_derivatives d ON d.media_id = m.id
+                WHERE m.rel_path=?
+            """, (rel_path,))
+            return [r[0] for r in cur.fetchall()]
+
+    def recent(self, limit: int = 25, before: Optional[int] = None) -> List[Dict]:
+        """
+        Newest uploads first, at most `limit` (1..MEDIA_MAX_LIMIT), with number of blocks using each.
+        `before` is id of the last upload of the previous page (keyset cursor).
+        """
+        limit = max(1, min(int(limit), MEDIA_MAX_LIMIT))
+        where, args = '', []
+        if before is not None:
+            where = 'WHERE (uploaded_at, id) < (SELECT uploaded_at, id FROM media WHERE id = ?)'
+            args.append(int(before))
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute(f"""
+                SELECT id, sha256, rel_path, mime, uploaded_at,
+                       (SELECT COUNT(DISTINCT r.block_id) FROM media_refs r WHERE r.rel_path IN {_PATHS_OF})
+                FROM media m
+                {where}
+                ORDER BY uploaded_at DESC, id DESC
+                LIMIT ?
+            """, (*args, limit))
+            rows = cur.fetchall()
+        return [{"id": r[0], "sha256": r[1], "rel_path": r[2], "mime": r[3], "uploaded_at": r[4], "refs": r[5]}
+                for r in rows]
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# migrations.py - numbered schema changes, applied once per database (PRAGMA user_version)
+#
+# Never edit a released migration, add a new one at the end of MIGRATIONS.
+# Statements use IF NOT EXISTS / column checks, because databases created before the runner
+# existed have user_version 0 but (some of) the tables already.
+import sqlite3
+import threading
+from typing import Callable, List, Tuple
+
+from models.database import get_connection
+from models.home_model import VERSION, HomeModel
+from models.page_model import fill_media_refs
+
+# rebuilds page_catalog row of one page from its blocks (cost ~ blocks of that page only)
+_CATALOG_REFRESH = """
+        INSERT OR REPLACE INTO page_catalog(page, page_order, locales, block_count, modified_at)
+        SELECT page, MIN(page_order), group_concat(DISTINCT locale), COUNT(*), CURRENT_TIMESTAMP
+        FROM pages WHERE page = {row}.page GROUP BY page;
+        DELETE FROM page_catalog
+        WHERE page = {row}.page AND NOT EXISTS (SELECT 1 FROM pages WHERE page = {row}.page);
+"""
+
+
+def _script(conn: sqlite3.Connection, script: str) -> None:
+    """
+    Runs statements of script one by one - executescript() would COMMIT the
+    migration transaction first. complete_statement() keeps trigger bodies together.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip().strip(';').strip():
+                conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _001_base(conn):
+    """ Tables of the first release """
+    _script(conn, """
+        CREATE TABLE IF NOT EXISTS params(
+            id    INTEGER PRIMARY KEY AUTOINCREMENT,
+            name  TEXT NOT NULL UNIQUE,
+            value TEXT
+        );
+        INSERT OR IGNORE INTO params(name, value)
+        VALUES('creation_date', strftime('%d.%m.%Y %H:%M', 'now', 'localtime'));
+        INSERT OR IGNORE INTO params(name, value)
+        VALUES('modification_date', strftime('%d.%m.%Y %H:%M', 'now', 'localtime'));
+
+        CREATE TABLE IF NOT EXISTS pages (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            page       TEXT    NOT NULL,
+            page_order INTEGER NOT NULL,
+            locale     TEXT    NOT NULL DEFAULT 'pl',
+            content    TEXT    NOT NULL,
+            position   INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(page, locale, position)
+        );
+
+        CREATE TABLE IF NOT EXISTS comments(
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip            TEXT NOT NULL,
+            creation_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            user          TEXT,
+            comment       TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS media (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            sha256      TEXT NOT NULL UNIQUE,
+            rel_path    TEXT NOT NULL UNIQUE,    -- np. uploads/2025/10/18/abcd1234_name.jpg
+            mime        TEXT NOT NULL,
+            uploaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256);
+        CREATE INDEX IF NOT EXISTS idx_media_uploaded_at ON media(uploaded_at);
+    """)
+
+
+def _002_comment_pages(conn):
+    """ Comments of one page/locale; legacy comments go to 'home', keyset pagination indexes """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(comments)')}
+    if 'page' not in columns:
+        conn.execute("ALTER TABLE comments ADD COLUMN page TEXT NOT NULL DEFAULT 'home'")
+    if 'locale' not in columns:
+        conn.execute("ALTER TABLE comments ADD COLUMN locale TEXT NOT NULL DEFAULT 'en'")
+    # newest first by (creation_date, id), site-wide and per page
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_comments_created ON comments(creation_date, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_comments_page ON comments(page, locale, creation_date, id)')
+
+
+def _003_page_catalog(conn):
+    """ One row per page for the menu, kept in sync with pages by triggers """
+    _script(conn, f"""
+        CREATE TABLE IF NOT EXISTS page_catalog (
+            page        TEXT    PRIMARY KEY,
+            page_order  INTEGER NOT NULL,
+            locales     TEXT    NOT NULL DEFAULT '',
+            block_count INTEGER NOT NULL DEFAULT 0,
+            modified_at TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_page_catalog_order ON page_catalog(page_order, page);
+
+        CREATE TRIGGER IF NOT EXISTS trg_pages_catalog_insert AFTER INSERT ON pages
+        BEGIN {_CATALOG_REFRESH.format(row='NEW')} END;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_catalog_update AFTER UPDATE ON pages
+        BEGIN {_CATALOG_REFRESH.format(row='OLD')} {_CATALOG_REFRESH.format(row='NEW')} END;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_catalog_delete AFTER DELETE ON pages
+        BEGIN {_CATALOG_REFRESH.format(row='OLD')} END;
+
+        INSERT INTO page_catalog(page, page_order, locales, block_count)
+        SELECT page, MIN(page_order), group_concat(DISTINCT locale), COUNT(*)
+        FROM pages
+        WHERE NOT EXISTS (SELECT 1 FROM page_catalog)
+        GROUP BY page;
+    """)
+
+
+def _004_media_derivatives(conn):
+    """ Resized/WebP variants of uploaded images, one set per source SHA-256 """
+    _script(conn, """
+        CREATE TABLE IF NOT EXISTS media_derivatives (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_id      INTEGER NOT NULL REFERENCES media(id),
+            source_sha256 TEXT NOT NULL,
+            width         INTEGER NOT NULL,
+            format        TEXT NOT NULL,           -- ie. webp, jpeg, png
+            rel_path      TEXT NOT NULL UNIQUE,
+            mime          TEXT NOT NULL,
+            UNIQUE(source_sha256, width, format)
+        );
+        CREATE INDEX IF NOT EXISTS idx_media_derivatives_media ON media_derivatives(media_id);
+    """)
+
+
+def _005_search(conn):
+    """ Full-text index of block content (HTML stripped), kept in sync by triggers """
+    options = {row[0] for row in conn.execute('PRAGMA compile_options')}
+    if 'ENABLE_FTS5' not in options:
+        return  # search returns no results on this sqlite build
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='pages_fts'").fetchone()
+    _script(conn, """
+        CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+            content, page UNINDEXED, locale UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_pages_fts_insert AFTER INSERT ON pages BEGIN
+            INSERT INTO pages_fts(rowid, content, page, locale)
+            VALUES (NEW.id, strip_html(NEW.content), NEW.page, NEW.locale);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_fts_delete AFTER DELETE ON pages BEGIN
+            DELETE FROM pages_fts WHERE rowid = OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_fts_update AFTER UPDATE OF content, page, locale ON pages BEGIN
+            DELETE FROM pages_fts WHERE rowid = OLD.id;
+            INSERT INTO pages_fts(rowid, content, page, locale)
+            VALUES (NEW.id, strip_html(NEW.content), NEW.page, NEW.locale);
+        END;
+    """)
+    if not exists:
+        conn.execute("""
+            INSERT INTO pages_fts(rowid, content, page, locale)
+            SELECT id, strip_html(content), page, locale FROM pages
+        """)
+
+
+def _006_catalog_touch(conn):
+    """ Position/content edits only touch modified_at, the full catalog refresh runs when a block
+    changes page, locale or page_order (reordering a page no longer re-aggregates it per row) """
+    _script(conn, f"""
+        DROP TRIGGER IF EXISTS trg_pages_catalog_update;
+        CREATE TRIGGER trg_pages_catalog_update AFTER UPDATE OF page, locale, page_order ON pages
+        BEGIN {_CATALOG_REFRESH.format(row='OLD')} {_CATALOG_REFRESH.format(row='NEW')} END;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_catalog_touch AFTER UPDATE OF position, content ON pages
+        BEGIN
+            UPDATE page_catalog SET modified_at = CURRENT_TIMESTAMP WHERE page = NEW.page;
+        END;
+    """)
+
+
+def _007_media_refs(conn):
+    """ Which block uses which upload (kept by PageModel, rows of a deleted block go by trigger) """
+    _script(conn, """
+        CREATE TABLE IF NOT EXISTS media_refs (
+            block_id INTEGER NOT NULL,
+            rel_path TEXT    NOT NULL,
+            PRIMARY KEY (block_id, rel_path)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_media_refs_path ON media_refs(rel_path);
+        CREATE TRIGGER IF NOT EXISTS trg_pages_media_refs_delete AFTER DELETE ON pages BEGIN
+            DELETE FROM media_refs WHERE block_id = OLD.id;
+        END;
+    """)
+    fill_media_refs(conn)
+
+
+def _008_search_without_udf(conn):
+    """ Blocks are indexed by PageModel (HTML stripped in Python): no trigger calls strip_html(),
+    so outside tools (sqlite3 CLI, backup/restore scripts) can write pages again """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='pages_fts'").fetchone():
+        return
+    _script(conn, """
+        DROP TRIGGER IF EXISTS trg_pages_fts_insert;
+        DROP TRIGGER IF EXISTS trg_pages_fts_update;
+        CREATE TRIGGER IF NOT EXISTS trg_pages_fts_move AFTER UPDATE OF page, locale ON pages BEGIN
+            UPDATE pages_fts SET page = NEW.page, locale = NEW.locale WHERE rowid = NEW.id;
+        END;
+    """)
+
+
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, _001_base),
+    (2, _002_comment_pages),
+    (3, _003_page_catalog),
+    (4, _004_media_derivatives),
+    (5, _005_search),
+    (6, _006_catalog_touch),
+    (7, _007_media_refs),
+    (8, _008_search_without_udf),
+]
+LATEST = MIGRATIONS[-1][0]
+
+_migrated = set()  # db names already checked by this process
+_migrate_lock = threading.Lock()
+
+
+def migrate(db_name: str = 'qcms.db') -> int:
+    """
+    Brings db_name to the LATEST schema version and stores the app version in params.
+    Once the schema is current this costs a single PRAGMA (and nothing on later calls in
+    the same process). Concurrent starts (ie. several workers) are serialized by
+    BEGIN IMMEDIATE - the one that waited sees the new user_version and does nothing.
+    Returns schema version of the database.
+    """
+    with _migrate_lock:
+        if db_name in _migrated:
+            return LATEST
+        conn = get_connection(db_name)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < LATEST:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                for number, migration in MIGRATIONS:
+                    if number > version:
+                        migration(conn)
+                        conn.execute(f'PRAGMA user_version = {int(number)}')
+                        version = number
+        row = conn.execute("SELECT value FROM params WHERE name='version'").fetchone()
+        if row is None or row[0] != VERSION:
+            with conn:
+                conn.execute("""
+                    INSERT INTO params(name, value) VALUES('version', ?)
+                    ON CONFLICT(name) DO UPDATE SET value=excluded.value
+                """, (VERSION,))
+            HomeModel.forget_snapshot(db_name)
+        _migrated.add(db_name)
+        return version
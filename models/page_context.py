@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# page_context.py
+from typing import Dict, Optional
+from models.comment_model import COMMENTS_WINDOW
+from models.database import get_connection
+from models.home_model import HomeModel
+
+
+class PageContext:
+    """ Loads everything a page template needs in one read transaction """
+
+    def __init__(self, db_name: str = 'qcms.db'):
+        self.db_name = db_name
+        self.home_model = HomeModel(db_name)
+
+    def load(self, page: Optional[str] = None, locale: str = 'en', editable: bool = False,
+             comments: bool = True, recent_media: bool = False, menu: bool = True,
+             blocks: bool = True) -> Dict:
+        """
+        Parameters
+        ----------
+        page : name of the page whose blocks should be loaded, None = no blocks
+        locale : locale of the blocks
+        editable : blocks as dicts (id, position, content) instead of content only
+        comments : load comments of the page (or of 'home' without page) for the right column
+        recent_media : load recent uploads (add/edit page forms)
+        menu : load the page list for the menu
+        blocks : load blocks of page (False = only its comments, ie. menu/blocks already rendered)
+
+        Returns
+        -------
+        dict with site_title, site_domain, footer_data, pages, blocks, comments
+        and recent_media (rows from media table)
+        """
+        # params come from HomeModel's in-memory snapshot, no SQL in the common case
+        params = self.home_model.get_params()
+        conn = get_connection(self.db_name)
+        with conn:
+            # one snapshot for all statements below
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            pages = []
+            if menu:
+                pages = [r[0] for r in conn.execute("""
+                    SELECT page
+                    FROM page_catalog
+                    ORDER BY page_order ASC, page ASC
+                """).fetchall()]
+
+            block_rows = []
+            if page is not None and blocks:
+                rows = conn.execute("""
+                    SELECT id, position, content
+                    FROM pages
+                    WHERE page=? AND locale=?
+                    ORDER BY position ASC, id ASC
+                """, (page, locale)).fetchall()
+                if editable:
+                    block_rows = [{"id": r[0], "position": r[1], "content": r[2]} for r in rows]
+                else:
+                    block_rows = [r[2] for r in rows]
+
+            comment_rows = []
+            if comments:
+                # only the latest window, shown oldest first like before
+                rows = conn.execute("""
+                    SELECT id, ip, user, comment, datetime(creation_date, 'localtime')
+                    FROM comments
+                    WHERE page = ? AND locale = ?
+                    ORDER BY creation_date DESC, id DESC
+                    LIMIT ?
+                """, (page or 'home', locale, COMMENTS_WINDOW)).fetchall()
+                comment_rows = [
+                    {'id': r[0], 'ip': r[1], 'user': r[2], 'comment': r[3], 'creation_date': r[4]}
+                    for r in reversed(rows)
+                ]
+
+            media_rows = []
+            if recent_media:
+                media_rows = [
+                    {"id": r[0], "sha256": r[1], "rel_path": r[2], "mime": r[3], "uploaded_at": r[4]}
+                    for r in conn.execute("""
+                        SELECT id, sha256, rel_path, mime, uploaded_at
+                        FROM media
+                        ORDER BY uploaded_at DESC
+                        LIMIT 25
+                    """).fetchall()
+                ]
+
+        return {
+            'site_title': params.get('title'),
+            'site_domain': params.get('domain'),
+            'footer_data': {name: params.get(name) for name in ('version', 'creation_date', 'modification_date')},
+            'pages': pages,
+            'blocks': block_rows,
+            'comments': comment_rows,
+            'recent_media': media_rows,
+        }
@@ -6,39 +6,153 @@ Created on Sat Oct 18 00:49:38 2025
 @author: mariusz
 """
 
-from typing import Dict, List
+import html
+import re
 import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+from markupsafe import Markup, escape
+from models.database import get_connection, notify_write, strip_html
+
+# snippet() highlight markers, replaced by <mark> after the text is escaped
+_HL_START, _HL_END = '\x02', '\x03'
+# uploads used by a block: [[image:<rel_path>|alt]] and links to /media/uploads/... or /static/uploads/...
+_MEDIA_REF = re.compile(r'\[\[image:([^|\]]+)|/(?:media|static)/(uploads/[^"\'\s,?#<>)]+)')
+
+
+def media_refs(content: str) -> Set[str]:
+    """rel_paths of the uploads content refers to."""
+    if '[[image:' not in content and 'uploads/' not in content:
+        return set()
+    return {html.unescape(m.group(1) or m.group(2)).strip() for m in _MEDIA_REF.finditer(content)}
+
+
+def save_media_refs(conn, blocks: Iterable[Tuple[int, str]], replace: bool = True) -> None:
+    """Stores refs of (block_id, content) in the caller's transaction; replace = drop old refs first."""
+    blocks = list(blocks)
+    if replace:
+        conn.executemany("DELETE FROM media_refs WHERE block_id=?", [(b[0],) for b in blocks])
+    conn.executemany("INSERT OR IGNORE INTO media_refs(block_id, rel_path) VALUES(?, ?)",
+                     [(block_id, path) for block_id, content in blocks for path in media_refs(content)])
+
+
+def fill_media_refs(conn) -> None:
+    """Rebuilds media_refs from all blocks in the caller's transaction."""
+    conn.execute("DELETE FROM media_refs")
+    cur = conn.execute("SELECT id, content FROM pages")
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+        save_media_refs(conn, rows, replace=False)
+
+
+def save_search_index(conn, blocks: Iterable[Tuple[int, str]], replace: bool = True) -> None:
+    """
+    Indexes (block_id, content) in the caller's transaction; replace = drop old entries first.
+    HTML is stripped here rather than by a trigger, so the schema needs no SQL function of ours.
+    No-op without pages_fts (no FTS5 in the sqlite build).
+    """
+    rows = [(block_id, strip_html(content), block_id) for block_id, content in blocks]
+    if not rows:
+        return
+    try:
+        if replace:
+            conn.executemany("DELETE FROM pages_fts WHERE rowid=?", [(r[0],) for r in rows])
+        conn.executemany("""
+            INSERT INTO pages_fts(rowid, content, page, locale)
+            SELECT ?, ?, page, locale FROM pages WHERE id=?
+        """, rows)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+
+
+def fill_search_index(conn) -> int:
+    """Rebuilds pages_fts from all blocks in the caller's transaction, returns number of blocks."""
+    conn.execute("DELETE FROM pages_fts")
+    # no incremental merging during the bulk insert, 'optimize' merges everything once at the end
+    conn.execute("INSERT INTO pages_fts(pages_fts, rank) VALUES('automerge', 0)")
+    count = 0
+    cur = conn.execute("SELECT id, content, page, locale FROM pages")
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+        conn.executemany("INSERT INTO pages_fts(rowid, content, page, locale) VALUES(?, ?, ?, ?)",
+                         [(r[0], strip_html(r[1]), r[2], r[3]) for r in rows])
+        count += len(rows)
+    conn.execute("INSERT INTO pages_fts(pages_fts) VALUES('optimize')")
+    conn.execute("INSERT INTO pages_fts(pages_fts, rank) VALUES('automerge', 4)")  # FTS5 default
+    return count
+
+
+def fill_page_catalog(conn) -> None:
+    """Rebuilds page_catalog from all blocks in the caller's transaction (triggers keep it up to date)."""
+    conn.execute("DELETE FROM page_catalog")
+    conn.execute("""
+        INSERT INTO page_catalog(page, page_order, locales, block_count)
+        SELECT page, MIN(page_order), group_concat(DISTINCT locale), COUNT(*)
+        FROM pages GROUP BY page
+    """)
+
 
 class PageModel:
     """ Micro CMS page model """
     def __init__(self, db_name = 'qcms.db'):
         self.db_name = db_name
-        self.init_db()
-        
-    def init_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                       CREATE TABLE IF NOT EXISTS pages (
-                           id            INTEGER PRIMARY KEY AUTOINCREMENT,
-                          page          TEXT    NOT NULL,
-                          page_order INTEGER NOT NULL,
-                          locale        TEXT    NOT NULL DEFAULT 'pl',
-                          content       TEXT    NOT NULL,
-                          position      INTEGER NOT NULL DEFAULT 0,
-                          UNIQUE(page, locale, position)
-                          )
-                       """)
+
+    def rebuild_search_index(self) -> int:
+        """(Re)indexes all blocks, ie. after rows were imported with an outside tool."""
+        with get_connection(self.db_name) as conn:
+            count = fill_search_index(conn)
+        return count
+
+    def search(self, query: str, locale: str, limit: int = 20) -> List[Dict]:
+        """
+        Pages matching all words of the query, best first.
+        Returns [{page, snippet (Markup with <mark>), score}], one entry per page.
+        """
+        words = query.split()
+        if not words:
+            return []
+        # every word as a quoted phrase -> no FTS syntax errors on user input; last one as prefix
+        match = ' '.join('"' + w.replace('"', '""') + '"' for w in words) + '*'
+        # best block per page (min rank, its rowid as bare column) grouped in SQL before LIMIT,
+        # so a page with many matching blocks can't push other pages out; snippets only for those
+        with get_connection(self.db_name) as conn:
+            try:
+                cur = conn.execute(f"""
+                    WITH best AS (
+                        SELECT page, rowid AS block_id, MIN(rank) AS score
+                        FROM pages_fts
+                        WHERE pages_fts MATCH :match AND locale = :locale
+                        GROUP BY page
+                        ORDER BY score
+                        LIMIT :limit
+                    )
+                    SELECT best.page, snippet(pages_fts, 0, '{_HL_START}', '{_HL_END}', '…', 16), best.score
+                    FROM best JOIN pages_fts ON pages_fts.rowid = best.block_id
+                    WHERE pages_fts MATCH :match
+                    ORDER BY best.score
+                """, {'match': match, 'locale': locale, 'limit': int(limit)})
+            except sqlite3.OperationalError:
+                # no FTS5 in this sqlite build
+                return []
+            results = []
+            for page, snippet, score in cur.fetchall():
+                text = str(escape(snippet)).replace(_HL_START, '<mark>').replace(_HL_END, '</mark>')
+                results.append({'page': page, 'snippet': Markup(text), 'score': score})
+            return results
 
     def _resolve_page_order(self, page: str) -> int:
          """Returns existing page_order for a given page or assigns a new one."""
-         with sqlite3.connect(self.db_name) as conn:
+         with get_connection(self.db_name) as conn:
             cur = conn.cursor()
-            cur.execute("SELECT MIN(page_order) FROM pages WHERE page=?", (page,))
+            cur.execute("SELECT page_order FROM page_catalog WHERE page=?", (page,))
             row = cur.fetchone()
             if row and row[0] is not None:
                 return int(row[0])
-            cur.execute("SELECT COALESCE(MAX(page_order), -1) + 1 FROM pages")
+            cur.execute("SELECT COALESCE(MAX(page_order), -1) + 1 FROM page_catalog")
             nxt = cur.fetchone()[0]
             return int(nxt)
 
@@ -47,16 +161,20 @@ class PageModel:
             po = self._resolve_page_order(page)
         else:
             po = page_order
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             cur = conn.cursor()
             cur.execute("""
                 INSERT INTO pages(page, page_order, locale, content, position)
                 VALUES(?, ?, ?, ?, ?)
             """, (page, po, locale, content, int(position)))
-            return cur.lastrowid
+            block_id = cur.lastrowid
+            save_media_refs(conn, [(block_id, content)], replace=False)
+            save_search_index(conn, [(block_id, content)], replace=False)
+        notify_write('pages')
+        return block_id
 
     def get(self, page: str, locale: str = 'en') -> list[str]:
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             cursor = conn.execute('''
                               SELECT content
                               FROM pages
@@ -66,34 +184,46 @@ class PageModel:
             return [line[0] for line in cursor.fetchall()]
     
     def delete(self, page_id: int) -> int:
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             conn.execute('DELETE FROM pages WHERE id=?', (page_id,))
+        notify_write('pages')
         return {'deleted_id': page_id}
     
     def delete_by_name(self, page_name: int) -> int:
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             conn.execute('DELETE FROM pages WHERE page=?', (page_name,))
+        notify_write('pages')
         return {'deleted': page_name}
     
     def edit(self, page: str):
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             conn.execute('DELETE FROM pages WHERE page=?', (page, ))
+        notify_write('pages')
         return
     
     def get_pages_list(self) -> list[str]:
-        with sqlite3.connect(self.db_name) as conn:
-            #cursor = conn.execute('SELECT DISTINCT page FROM pages ORDER BY page_order ASC')
+        with get_connection(self.db_name) as conn:
             cursor = conn.execute("""
-                                  SELECT page, MIN(page_order) AS ord
-                                  FROM pages
-                                  GROUP BY page
-                                  ORDER BY ord ASC
+                                  SELECT page
+                                  FROM page_catalog
+                                  ORDER BY page_order ASC, page ASC
                          """)
             return [page[0] for page in cursor.fetchall()]
+
+    def get_page_catalog(self) -> List[Dict]:
+        """Returns pages (name, order, locales, block count, last modification) in menu order."""
+        with get_connection(self.db_name) as conn:
+            cur = conn.execute("""
+                               SELECT page, page_order, locales, block_count, modified_at
+                               FROM page_catalog
+                               ORDER BY page_order ASC, page ASC
+                               """)
+            return [{"page": r[0], "page_order": r[1], "locales": r[2].split(',') if r[2] else [],
+                     "block_count": r[3], "modified_at": r[4]} for r in cur.fetchall()]
         
     def get_blocks_for_page(self, page: str, locale: str) -> List[Dict]:
         """Returns list of blocks (id, position, content) for a given page/locale."""
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             cur = conn.execute("""
                                SELECT id, position, content
                                FROM pages
@@ -105,14 +235,70 @@ class PageModel:
 
     def update_block(self, block_id: int, position: int, content: str) -> None:
         """Updates single block."""
-        with sqlite3.connect(self.db_name) as conn:
+        with get_connection(self.db_name) as conn:
             conn.execute("""
                          UPDATE pages
                          SET position=?, content=?
                          WHERE id=?
                          """, (int(position), content, int(block_id)))
+            save_media_refs(conn, [(int(block_id), content)])
+            save_search_index(conn, [(int(block_id), content)])
+        notify_write('pages')
 
     def delete_block_by_id(self, block_id: int) -> None:
-        """Deletes signle block by its id."""
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("DELETE FROM pages WHERE id=?", (int(block_id),))
\ No newline at end of file
+        """Deletes signle block by its id (its media_refs rows go by trigger)."""
+        with get_connection(self.db_name) as conn:
+            conn.execute("DELETE FROM pages WHERE id=?", (int(block_id),))
+        notify_write('pages')
+
+    def replace_blocks(self, page: str, locale: str, blocks: List[Dict]) -> List[Dict]:
+        """
+        Makes blocks of page/locale exactly the given ordered list, in one transaction.
+        blocks: [{"id": <existing block id> or None for a new block, "content": str}];
+        position = index in the list (1-based), blocks of the page missing from it are deleted.
+        Existing blocks are first moved to temporary negative positions, so no reordering can
+        hit UNIQUE(page, locale, position) halfway through. Raises ValueError for an id that
+        doesn't belong to page/locale (nothing is changed then).
+        Returns [{id, position}] in the new order.
+        """
+        conn = get_connection(self.db_name)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            current = dict(conn.execute(
+                "SELECT id, content FROM pages WHERE page=? AND locale=?", (page, locale)).fetchall())
+            wanted = [b.get("id") for b in blocks if b.get("id") is not None]
+            unknown = [i for i in wanted if i not in current]
+            if unknown or len(set(wanted)) != len(wanted):
+                raise ValueError(f"blocks {unknown or wanted} don't belong to {page}/{locale} or repeat")
+
+            removed = [(i,) for i in current.keys() - set(wanted)]
+            conn.executemany("DELETE FROM pages WHERE id=?", removed)
+            conn.execute("UPDATE pages SET position = -id WHERE page=? AND locale=?", (page, locale))
+
+            row = conn.execute("SELECT page_order FROM page_catalog WHERE page=?", (page,)).fetchone()
+            page_order = row[0] if row else conn.execute(
+                "SELECT COALESCE(MAX(page_order), -1) + 1 FROM page_catalog").fetchone()[0]
+            result = []
+            moved, edited, created = [], [], []
+            for position, block in enumerate(blocks, start=1):
+                block_id, content = block.get("id"), block["content"]
+                if block_id is None:
+                    block_id = conn.execute("""
+                        INSERT INTO pages(page, page_order, locale, content, position)
+                        VALUES(?, ?, ?, ?, ?)
+                    """, (page, page_order, locale, content, position)).lastrowid
+                    created.append((block_id, content))
+                else:
+                    moved.append((position, block_id))
+                    # only changed content is indexed again
+                    if content != current[block_id]:
+                        edited.append((content, block_id))
+                result.append({"id": block_id, "position": position})
+            conn.executemany("UPDATE pages SET position=? WHERE id=?", moved)
+            conn.executemany("UPDATE pages SET content=? WHERE id=?", edited)
+            save_media_refs(conn, created, replace=False)
+            save_media_refs(conn, [(block_id, content) for content, block_id in edited])
+            save_search_index(conn, created, replace=False)
+            save_search_index(conn, [(block_id, content) for content, block_id in edited])
+        notify_write('pages')
+        return result
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# query_log.py - per-request record of SQL statements (only used with QCMS_METRICS=1)
+import sqlite3
+from contextvars import ContextVar
+from time import perf_counter
+from typing import List, Optional
+
+# list of Query of the request being handled; None = nobody is collecting
+_queries: ContextVar[Optional[List['Query']]] = ContextVar('qcms_queries', default=None)
+
+
+class Query:
+    """ One statement: sql, seconds spent in execute + fetches, rows returned or changed """
+    __slots__ = ('sql', 'duration', 'rows')
+
+    def __init__(self, sql: str, duration: float, rows: int):
+        self.sql = sql
+        self.duration = duration
+        self.rows = rows
+
+
+def start() -> object:
+    """Starts collecting statements of the current context, returns token for stop()."""
+    return _queries.set([])
+
+
+def stop(token) -> List[Query]:
+    """Stops collecting and returns the statements collected since start()."""
+    queries = _queries.get() or []
+    _queries.reset(token)
+    return queries
+
+
+class TimedCursor(sqlite3.Cursor):
+    """ Cursor that times execute*() and fetch*() into the current query list """
+
+    _query = None
+
+    def _begin(self, sql: str):
+        queries = _queries.get()
+        if queries is None:
+            self._query = None
+            return None
+        self._query = Query(sql, 0.0, 0)
+        queries.append(self._query)
+        return perf_counter()
+
+    def _end(self, started) -> None:
+        if started is not None:
+            self._query.duration += perf_counter() - started
+            if self.rowcount > 0:  # INSERT/UPDATE/DELETE; -1 for SELECT
+                self._query.rows = self.rowcount
+
+    def execute(self, sql, parameters=()):
+        started = self._begin(sql)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._end(started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = self._begin(sql)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._end(started)
+
+    def executescript(self, sql_script):
+        started = self._begin(sql_script)
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._end(started)
+
+    def _fetched(self, started, rows: int) -> None:
+        if self._query is not None:
+            self._query.duration += perf_counter() - started
+            self._query.rows += rows
+
+    def fetchone(self):
+        started = perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = perf_counter()
+        row = super().__next__()
+        self._fetched(started, 1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    """ Connection whose cursors (also of conn.execute shortcuts) are TimedCursor """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
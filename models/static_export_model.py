@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# static_export_model.py - content hashes that decide which pages a static export renders again
+import hashlib
+from typing import Dict, Tuple
+
+from models.database import get_connection
+
+
+class StaticExportModel:
+    """ Hashes of what a rendered page is made of, read in one snapshot """
+
+    def __init__(self, db_name: str = 'qcms.db'):
+        self.db_name = db_name
+
+    def hashes(self, locale: str) -> Tuple[str, Dict[str, str]]:
+        """
+        Returns (site hash, {page: page hash}) for locale.
+        Site hash: things shown on every page - menu, params (title, footer), image variants.
+        Page hash: its blocks (position, id, content) and its comments (count, newest id).
+        """
+        conn = get_connection(self.db_name)
+        with conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            site = hashlib.sha256()
+            for row in conn.execute("SELECT page FROM page_catalog ORDER BY page_order, page"):
+                site.update(f'page\0{row[0]}\0'.encode())
+            for row in conn.execute("SELECT name, value FROM params ORDER BY name"):
+                site.update(f'param\0{row[0]}\0{row[1]}\0'.encode())
+            count, newest = conn.execute("SELECT COUNT(*), MAX(id) FROM media_derivatives").fetchone()
+            site.update(f'variants\0{count}\0{newest}\0'.encode())
+
+            pages = {}
+            page, digest = None, None
+            # blocks of all pages in one pass, in the order the page shows them
+            for name, position, block_id, content in conn.execute("""
+                SELECT page, position, id, content
+                FROM pages
+                WHERE locale = ?
+                ORDER BY page, position, id
+            """, (locale,)):
+                if name != page:
+                    page, digest = name, hashlib.sha256()
+                    pages[page] = digest
+                digest.update(f'{position}\0{block_id}\0{content}\0'.encode())
+
+            comments = {row[0]: row[1:] for row in conn.execute("""
+                SELECT page, COUNT(*), MAX(id) FROM comments WHERE locale = ? GROUP BY page
+            """, (locale,))}
+
+        result = {}
+        for name in set(pages) | set(comments):
+            digest = pages.get(name) or hashlib.sha256()
+            count, newest = comments.get(name, (0, None))
+            digest.update(f'comments\0{count}\0{newest}'.encode())
+            result[name] = digest.hexdigest()
+        return site.hexdigest(), result
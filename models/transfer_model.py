@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# transfer_model.py - site content as a stream of records (export / import)
+import os
+from typing import Dict, Iterable, Iterator
+
+from models.database import get_connection, notify_write
+from models.home_model import VERSION, HomeModel
+from models.migrations import LATEST
+from models.page_model import fill_media_refs, fill_page_catalog, fill_search_index
+
+EXPORT_FORMAT = 1
+IMPORT_BATCH = int(os.getenv("QCMS_IMPORT_BATCH", "10000"))  # rows per executemany
+
+# record type -> (table, columns); exported and imported in this order (media before its variants)
+TABLES = {
+    'param': ('params', ('name', 'value')),
+    'page': ('pages', ('id', 'page', 'page_order', 'locale', 'content', 'position')),
+    'comment': ('comments', ('id', 'ip', 'user', 'comment', 'creation_date', 'page', 'locale')),
+    'media': ('media', ('id', 'sha256', 'rel_path', 'mime', 'uploaded_at')),
+    'media_derivative': ('media_derivatives',
+                         ('id', 'media_id', 'source_sha256', 'width', 'format', 'rel_path', 'mime')),
+}
+
+
+class TransferModel:
+    """ Streams all content tables out as records and bulk-loads them back """
+
+    def __init__(self, db_name: str = 'qcms.db'):
+        self.db_name = db_name
+
+    def export_records(self) -> Iterator[Dict]:
+        """
+        Generator of {"type": ..., <columns>} records, one consistent snapshot (single read
+        transaction), rows are read from the cursor as they are written out.
+        First record: {"type": "meta", "format", "schema", "version"}.
+        """
+        yield {'type': 'meta', 'format': EXPORT_FORMAT, 'schema': LATEST, 'version': VERSION}
+        conn = get_connection(self.db_name)
+        with conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            for kind, (table, columns) in TABLES.items():
+                cur = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+                while True:
+                    rows = cur.fetchmany(1000)
+                    if not rows:
+                        break
+                    for row in rows:
+                        record = dict(zip(columns, row))
+                        record['type'] = kind
+                        yield record
+
+    def import_records(self, records: Iterable[Dict], replace: bool = False) -> Dict[str, int]:
+        """
+        Loads records (as made by export_records) in ONE transaction - a broken file changes nothing.
+        Triggers on pages are dropped for the load (and recreated from their own SQL),
+        page_catalog, media_refs and the search index are then rebuilt once instead of per row.
+        Ids are kept. Refuses a database with content unless replace=True (content is deleted first).
+        Returns number of imported rows per record type.
+        """
+        counts = {kind: 0 for kind in TABLES}
+        conn = get_connection(self.db_name)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='pages_fts'").fetchone()
+            triggers = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name='pages'").fetchall()
+            for name, _ in triggers:
+                conn.execute(f'DROP TRIGGER "{name}"')
+
+            content_tables = [table for kind, (table, _) in TABLES.items() if kind != 'param']
+            if replace:
+                for table in reversed(content_tables):
+                    conn.execute(f"DELETE FROM {table}")
+            elif any(conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in content_tables):
+                raise ValueError("database already has content (use replace to overwrite it)")
+
+            batch, kind = [], None
+            for line_no, record in enumerate(records, start=1):
+                record_kind = record.get('type')
+                if record_kind == 'meta':
+                    if record.get('format') != EXPORT_FORMAT:
+                        raise ValueError(f"unsupported export format {record.get('format')!r}")
+                    continue
+                if record_kind not in TABLES:
+                    raise ValueError(f"record {line_no}: unknown type {record_kind!r}")
+                if record_kind != kind or len(batch) >= IMPORT_BATCH:
+                    self._insert(conn, kind, batch)
+                    counts[kind or record_kind] += len(batch)
+                    batch, kind = [], record_kind
+                try:
+                    batch.append(tuple(record[c] for c in TABLES[kind][1]))
+                except KeyError as e:
+                    raise ValueError(f"record {line_no}: missing {e.args[0]!r}") from None
+            self._insert(conn, kind, batch)
+            if kind:
+                counts[kind] += len(batch)
+
+            fill_page_catalog(conn)
+            fill_media_refs(conn)
+            if has_fts:
+                fill_search_index(conn)
+            for _, sql in triggers:
+                conn.execute(sql)
+        HomeModel.forget_snapshot(self.db_name)
+        for table in ('params', 'pages', 'comments', 'media_derivatives'):
+            notify_write(table)
+        return counts
+
+    @staticmethod
+    def _insert(conn, kind, rows) -> None:
+        if not rows:
+            return
+        table, columns = TABLES[kind]
+        placeholders = ', '.join('?' * len(columns))
+        if kind == 'param':
+            conn.executemany(f"INSERT INTO params(name, value) VALUES({placeholders}) "
+                             "ON CONFLICT(name) DO UPDATE SET value=excluded.value", rows)
+        else:
+            conn.executemany(f"INSERT INTO {table}({', '.join(columns)}) VALUES({placeholders})", rows)
@@ -5,29 +5,71 @@ Created on Fri Oct 17 17:28:55 2025
 
 @author: mariusz
 """
-
+import os
+import threading
 from models.comment_model import CommentModel
+from services.comment_writer import CommentWriter
+
+# write-behind mode: comments are queued and inserted in batches by a background thread
+COMMENT_WRITE_BEHIND = os.getenv("QCMS_COMMENT_WRITE_BEHIND", "0") == "1"
+COMMENT_QUEUE_SIZE = int(os.getenv("QCMS_COMMENT_QUEUE_SIZE", "1000"))
+COMMENT_FLUSH_MS = int(os.getenv("QCMS_COMMENT_FLUSH_MS", "50"))
+COMMENT_FLUSH_BATCH = int(os.getenv("QCMS_COMMENT_FLUSH_BATCH", "100"))
 
 class CommentService:
     """ Comment service class """
-    def __init__(self):
+    def __init__(self, write_behind=COMMENT_WRITE_BEHIND):
         self.comment_model = CommentModel()
+        self.write_behind = write_behind
+        self.writer = None  # started with the first comment
+        self._writer_lock = threading.Lock()
         
-    def add(self, ip, user, comment):
-        """ Adds new comment """
+    def add(self, ip, user, comment, page='home', locale='en'):
+        """ Adds new comment to the page """
         if not user or not user.strip():
             return False, "USER_CANT_BE_EMPTY"
         if not ip or not ip.strip():
             return False, "IP_CANT_BE_EMPTY"
         if not comment or not comment.strip():
             return False, "COMMENT_CANT_BE_EMPTY"
-        comment_id = self.comment_model.add(ip, user, comment)
+        page = (page or '').strip() or 'home'
+        if self.write_behind and self._get_writer().put((ip, user, comment, page, locale or 'en')):
+            # queued, id is known only after the batch is written
+            return True, None
+        # direct mode, or queue full - write it now rather than lose it
+        comment_id = self.comment_model.add(ip, user, comment, page, locale or 'en')
         if not comment_id:
             return False, "UNKNOWN_ERROR"
         
         return True, comment_id
 
+    def _get_writer(self):
+        with self._writer_lock:
+            if self.writer is None:
+                self.writer = CommentWriter(self.comment_model, COMMENT_QUEUE_SIZE,
+                                            COMMENT_FLUSH_MS, COMMENT_FLUSH_BATCH)
+            return self.writer
+
+    def queue_depth(self):
+        """ Number of comments waiting in the write-behind queue """
+        return self.writer.depth() if self.writer is not None else 0
+
+    def close(self):
+        """ Writes queued comments (called on shutdown) """
+        if self.writer is not None:
+            self.writer.close()
+
     def get_all(self):
         """ Get all comments """
         return self.comment_model.get_all()
+
+    def get_latest(self, limit=None, before=None, page=None, locale='en'):
+        """ Newest comments first, `before` = id of the last comment already seen """
+        if limit is None:
+            return self.comment_model.get_latest(before=before, page=page, locale=locale)
+        return self.comment_model.get_latest(limit, before, page, locale)
+
+    def iter_all(self):
+        """ All comments as generator (for exports) """
+        return self.comment_model.iter_all()
     
\ No newline at end of file
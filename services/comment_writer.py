@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# comment_writer.py
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class CommentWriter:
+    """
+    Write-behind queue for comments: requests only enqueue validated comments,
+    a background thread inserts them with executemany, one transaction per batch
+    (every flush_ms milliseconds or batch_size comments, whichever comes first).
+    """
+
+    def __init__(self, comment_model, max_size: int = 1000, flush_ms: int = 50, batch_size: int = 100):
+        self.comment_model = comment_model
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='comment-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, comment: tuple) -> bool:
+        """Enqueues (ip, user, comment, page, locale); False when the queue is full or closed."""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(comment)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self) -> int:
+        """Number of comments waiting to be written."""
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 10) -> None:
+        """Stops accepting comments and waits until the queue is written to the db."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [c for c in batch if c is not _STOP]
+            self._flush(batch)
+        # whatever was enqueued after the stop marker
+        rest = []
+        while True:
+            try:
+                rest.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._flush([c for c in rest if c is not _STOP])
+
+    def _flush(self, batch: list) -> None:
+        if not batch:
+            return
+        try:
+            self.comment_model.add_many(batch)
+        except Exception:
+            logger.exception("Writing %d queued comments failed", len(batch))
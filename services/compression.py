@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# compression.py - gzip responses by Accept-Encoding, every body and static file compressed once
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+from typing import Optional
+
+from flask import request, send_file
+from werkzeug.security import safe_join
+
+from services.page_cache import PageCache
+
+# QCMS_GZIP=0 leaves compression to the web server in front of the app
+GZIP = os.getenv("QCMS_GZIP", "1") == "1"
+GZIP_LEVEL = int(os.getenv("QCMS_GZIP_LEVEL", "6"))
+GZIP_MIN_SIZE = int(os.getenv("QCMS_GZIP_MIN_SIZE", "1024"))  # bytes, smaller bodies go as they are
+GZIP_CACHE_SIZE = int(os.getenv("QCMS_GZIP_CACHE_SIZE", "256"))  # compressed bodies kept in memory
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+def gzip_bytes(data: bytes, level: int = GZIP_LEVEL) -> bytes:
+    """gzip without a timestamp - same input, same output (stable ETags, precompressed files)."""
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE)
+
+
+def precompress_file(path: str, level: int = GZIP_LEVEL, min_size: int = GZIP_MIN_SIZE) -> Optional[str]:
+    """
+    Writes path.gz (atomically) unless it is already newer than path.
+    Returns the .gz path, None for files too small to be worth it.
+    """
+    stat = os.stat(path)
+    if stat.st_size < min_size:
+        return None
+    gz_path = path + '.gz'
+    try:
+        if os.stat(gz_path).st_mtime >= stat.st_mtime:
+            return gz_path
+    except FileNotFoundError:
+        pass
+    with open(path, 'rb') as f:
+        data = gzip_bytes(f.read(), level)
+    # temp name of its own: concurrent first requests for the file don't write into one file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(gz_path) + '.',
+                               suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, stat.st_mode & 0o777)  # mkstemp makes it 0600, the web server has to read it
+        os.replace(tmp, gz_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return gz_path
+
+
+class Compression:
+    """
+    Gzips text responses for clients sending Accept-Encoding: gzip.
+    Rendered bodies are compressed once per content (LRU keyed by a digest of the body,
+    so cached pages are never compressed again); static files are served from a
+    stored <file>.gz made on first use or by `flask compress-static`.
+    """
+
+    def __init__(self, level: int = GZIP_LEVEL, min_size: int = GZIP_MIN_SIZE,
+                 cache_size: int = GZIP_CACHE_SIZE):
+        self.level = level
+        self.min_size = min_size
+        self.cache = PageCache(cache_size)
+
+    def install(self, app) -> None:
+        self.app = app
+        static_view = app.view_functions.get('static')
+        if static_view is not None:
+            app.view_functions['static'] = self._static(static_view)
+        app.after_request(self._compress)
+
+    @staticmethod
+    def _accepts_gzip() -> bool:
+        return request.accept_encodings['gzip'] > 0
+
+    def _static(self, static_view):
+        def static(filename):
+            path = safe_join(self.app.static_folder, filename)
+            if path is None or not self._accepts_gzip() or not os.path.isfile(path):
+                return static_view(filename=filename)
+            mimetype = mimetypes.guess_type(filename)[0]
+            try:
+                gz_path = precompress_file(path, self.level, self.min_size) if compressible(mimetype) else None
+            except OSError:
+                gz_path = None  # ie. read-only static folder, run `flask compress-static` at build time
+            if gz_path is None:
+                return static_view(filename=filename)
+            response = send_file(gz_path, mimetype=mimetype, conditional=True,
+                                 max_age=self.app.get_send_file_max_age(filename))
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+            return response
+        return static
+
+    def _compress(self, response):
+        if not compressible(response.mimetype):
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or not self._accepts_gzip()):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = gzip_bytes(data, self.level)
+            self.cache.put(key, compressed, self.cache.generation)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    def stats(self) -> dict:
+        return self.cache.stats()
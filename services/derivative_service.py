@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# derivative_service.py
+import atexit
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List
+from markupsafe import escape
+
+from models.media_model import MediaModel
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional - without it images are served as uploaded
+    Image = None
+
+STATIC_ROOT = 'static'
+MEDIA_URL = '/media/'
+DERIVATIVE_WIDTHS = tuple(int(w) for w in os.getenv("QCMS_DERIVATIVE_WIDTHS", "320,640,1280").split(','))
+DERIVATIVE_WORKERS = int(os.getenv("QCMS_DERIVATIVE_WORKERS", "2"))
+WEBP_QUALITY = 80
+
+# [[image:uploads/2025/10/18/abcd1234_name.jpg|alt text]] in block content
+IMAGE_SHORTCODE = re.compile(r'\[\[image:([^|\]]+)(?:\|([^\]]*))?\]\]')
+
+logger = logging.getLogger(__name__)
+# the pool starts from a request thread of a threaded server: fork() would copy locks held by
+# other threads (sqlite, logging) into the child, a fresh interpreter can't deadlock on them
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+_MIME = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+
+
+def render_derivatives(src_path: str, widths: tuple) -> List[Dict]:
+    """
+    Runs in a worker process: writes resized copies of src_path (in its own format and
+    as WebP) next to it, for every width smaller than the original.
+    Returns [{width, format, rel_path, mime}], rel_path relative to static/.
+    """
+    src = Path(src_path)
+    source_format = _FORMATS.get(src.suffix.lower())
+    if source_format is None:
+        return []
+    result = []
+    with Image.open(src) as img:
+        img.load()
+        for width in sorted(set(widths)):
+            if width >= img.width:
+                continue
+            height = max(1, round(img.height * width / img.width))
+            resized = img.resize((width, height), Image.LANCZOS)
+            for fmt in dict.fromkeys((source_format, 'WEBP')):
+                out = src.with_name(f"{src.stem}-{width}w.{fmt.lower()}")
+                tmp = out.with_name('.' + out.name + '.part')
+                frame = resized
+                if fmt == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                    frame = frame.convert('RGB')
+                frame.save(tmp, fmt, quality=WEBP_QUALITY if fmt == 'WEBP' else 85)
+                os.replace(tmp, out)
+                result.append({"width": width, "format": fmt.lower(),
+                               "rel_path": out.relative_to(STATIC_ROOT).as_posix(), "mime": _MIME[fmt]})
+    return result
+
+
+class DerivativeService:
+    """ Generates responsive variants of uploaded images in the background """
+
+    def __init__(self):
+        self.media_model = MediaModel()
+        self._executor = None
+        self._pending = set()  # source sha256 being processed
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and DERIVATIVE_WORKERS > 0
+
+    def schedule(self, media_id: int, sha256: str, rel_path: str) -> bool:
+        """Queues variants of the uploaded image, doesn't wait for them. False if nothing to do."""
+        if not self.enabled or Path(rel_path).suffix.lower() not in _FORMATS:
+            return False
+        with self._lock:
+            if sha256 in self._pending or self.media_model.has_derivatives(sha256):
+                return False
+            try:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS,
+                                                         mp_context=multiprocessing.get_context(_START_METHOD))
+                executor = self._executor
+                future = executor.submit(render_derivatives, str(Path(STATIC_ROOT) / rel_path), DERIVATIVE_WIDTHS)
+            except (BrokenProcessPool, RuntimeError, OSError):
+                # a worker died (OOM, kill) or the pool couldn't start - the upload is stored
+                # already, it only goes without variants; the next upload gets a new pool
+                logger.exception("Variants of %s not scheduled", rel_path)
+                self._drop_executor(self._executor)
+                return False
+            self._pending.add(sha256)
+        future.add_done_callback(lambda f: self._store(f, media_id, sha256, executor))
+        return True
+
+    def _drop_executor(self, executor) -> None:
+        """Forgets executor (caller holds _lock) if it is still the current one."""
+        if executor is not None and executor is self._executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _store(self, future, media_id: int, sha256: str, executor=None) -> None:
+        try:
+            try:
+                derivatives = future.result()
+            except BrokenProcessPool as e:
+                logger.warning("Variants of media %d not generated, worker pool broke: %r", media_id, e)
+                with self._lock:
+                    self._drop_executor(executor)
+                return
+            except Exception as e:
+                # broken/unsupported image - page keeps using the original file
+                logger.warning("Variants of media %d not generated: %r", media_id, e)
+                return
+            if derivatives:
+                self.media_model.add_derivatives(media_id, sha256, derivatives)
+        except Exception:
+            logger.exception("Storing variants of media %d failed", media_id)
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def expand_shortcodes(self, blocks: List[str]) -> List[str]:
+        """Replaces [[image:<rel_path>|alt]] in blocks with <picture> using the stored variants."""
+        paths = {m.group(1).strip() for block in blocks for m in IMAGE_SHORTCODE.finditer(block)}
+        if not paths:
+            return blocks
+        variants = self.media_model.get_derivatives(list(paths))
+        return [IMAGE_SHORTCODE.sub(lambda m: self._picture(m, variants), block) for block in blocks]
+
+    def _picture(self, match, variants: Dict[str, List[Dict]]) -> str:
+        rel_path = match.group(1).strip()
+        alt = escape(match.group(2) or '')
+        img = f'<img src="{MEDIA_URL}{escape(rel_path)}" alt="{alt}" loading="lazy"'
+        sets = {}
+        for v in variants.get(rel_path, []):
+            sets.setdefault(v["format"], []).append(f'{MEDIA_URL}{escape(v["rel_path"])} {v["width"]}w')
+        if not sets:
+            return img + '>'
+        sizes = f'(max-width: {max(DERIVATIVE_WIDTHS)}px) 100vw, {max(DERIVATIVE_WIDTHS)}px'
+        sources = ''
+        webp = sets.pop('webp', None)
+        if webp:
+            sources = f'<source type="image/webp" srcset="{", ".join(webp)}" sizes="{sizes}">'
+        own = next(iter(sets.values()), None)
+        if own:
+            img += f' srcset="{", ".join(own)}" sizes="{sizes}"'
+        return f'<picture>{sources}{img}></picture>'
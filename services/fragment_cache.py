@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# fragment_cache.py - rendered parts of a page (menu, blocks, comments, footer), each with its own key
+import os
+import threading
+from typing import Dict, Hashable, Optional, Tuple
+
+from services.page_cache import PageCache
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("QCMS_FRAGMENT_CACHE_SIZE", "1024"))
+
+# fragment -> tables whose writes change it
+FRAGMENT_TABLES = {
+    'menu': ('pages',),
+    'blocks': ('pages', 'media_derivatives'),
+    'comments': ('comments',),
+    'footer': ('params',),
+}
+
+
+class FragmentCache:
+    """
+    LRU of rendered fragments. Every key carries the current write version of the
+    fragment's tables, so a write only makes the fragments of its own table unreachable
+    (they age out of the LRU) - a comment leaves the menu and the blocks cached.
+    """
+
+    def __init__(self, max_size: int = FRAGMENT_CACHE_SIZE):
+        self._store = PageCache(max_size)
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def on_write(self, table: str) -> None:
+        """Write listener (models.database.on_write): bumps the version of table."""
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def invalidate(self) -> None:
+        """Bumps every table version and drops all fragments (ie. another process wrote)."""
+        with self._lock:
+            for table in {t for tables in FRAGMENT_TABLES.values() for t in tables}:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        self._store.clear()
+
+    def key(self, fragment: str, *parts: Hashable) -> Tuple:
+        """
+        Key of fragment for parts (ie. page, locale) at the current versions.
+        Take it BEFORE loading the data: a write during the render then leaves the
+        result under an old key, it is never served.
+        """
+        with self._lock:
+            versions = tuple(self._versions.get(t, 0) for t in FRAGMENT_TABLES[fragment])
+        return (fragment, parts, versions)
+
+    def get(self, key: Tuple) -> Optional[str]:
+        return self._store.get(key)
+
+    def put(self, key: Tuple, html: str) -> None:
+        self._store.put(key, html, self._store.generation)
+
+    def clear(self) -> None:
+        self._store.clear()
+
+    def stats(self) -> dict:
+        stats = self._store.stats()
+        with self._lock:
+            stats['versions'] = dict(self._versions)
+        return stats
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# io_executor.py - bounded thread pool for blocking SQLite / file work of async views
+import asyncio
+import atexit
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# QCMS_ASYNC=1 registers async views (needs asgiref, see requirements.txt)
+ASYNC_MODE = os.getenv("QCMS_ASYNC", "0") == "1"
+IO_WORKERS = int(os.getenv("QCMS_IO_WORKERS", "8"))
+
+try:
+    import asgiref  # noqa: F401 - Flask runs async views through asgiref
+except ImportError:
+    asgiref = None
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='qcms-io')
+            atexit.register(_executor.shutdown)
+        return _executor
+
+
+async def run_io(fn, *args, **kwargs):
+    """
+    Runs blocking fn on the shared pool and waits for it without blocking the event loop.
+    The call gets a copy of the current context, so Flask's request/app context
+    (kept in context variables) and the metrics query log work inside fn.
+    At most IO_WORKERS calls run at once, the rest wait in the pool's queue.
+    """
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+def offload(view):
+    """
+    Route decorator: in async mode turns the view into a coroutine that runs it on the
+    pool (auth check, SQLite and file I/O included); in sync mode returns it unchanged.
+    """
+    if not ASYNC_MODE:
+        return view
+
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        return await run_io(view, *args, **kwargs)
+    return wrapper
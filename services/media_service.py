@@ -6,53 +6,219 @@ Created on Sat Oct 18 18:55:54 2025
 @author: mariusz
 """
 import hashlib
-from typing import Optional, List, Dict
+import mimetypes
+import os
+import tempfile
+import time
+from typing import Optional, List, Dict, Tuple
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-from flask import redirect, url_for
+from flask import abort, send_file
 from urllib.parse import unquote
 from pathlib import Path
 
 from models.media_model import MediaModel
+from services.derivative_service import DerivativeService
+
+STATIC_ROOT = 'static'
+MEDIA_URL = '/media/'  # uploads are served by AppController's media route
+MEDIA_MAX_AGE = int(os.getenv("QCMS_MEDIA_MAX_AGE", str(365 * 24 * 3600)))
+MAX_UPLOAD_BYTES = int(os.getenv("QCMS_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+UPLOAD_BASE = 'uploads'
+GC_BATCH = int(os.getenv("QCMS_MEDIA_GC_BATCH", "200"))  # uploads deleted per transaction
+# uploads younger than this are kept (uploaded, but the block using it isn't saved yet)
+GC_MIN_AGE_HOURS = float(os.getenv("QCMS_MEDIA_GC_MIN_AGE_HOURS", "24"))
 
 class MediaService:
     
     def __init__(self):
         self.media_model = MediaModel()
+        self.derivatives = DerivativeService()
     
     def get_by_hash(self, sha256: str) -> Optional[Dict]:
         return self.media_model.get_by_hash(sha256)
     
-    def recent(self) -> List[Dict]:
-        return self.media_model.recent()
+    def recent(self, limit: int = 25, before: Optional[int] = None) -> List[Dict]:
+        """ Media library page: newest first, `before` = id of the last upload already seen """
+        return [dict(m, url=f"{MEDIA_URL}{m['rel_path']}") for m in self.media_model.recent(limit, before)]
     
     def _norm_filename(self, filename: str) -> str:
         fn = secure_filename(filename or '').lower()
         return fn.replace(' ', '-')
 
-    def _calc_sha256(self, file_storage) -> str:
-        h = hashlib.sha256()
-        for chunk in iter(lambda: file_storage.stream.read(8192), b''):
-            h.update(chunk)
-        file_storage.stream.seek(0)
-        return h.hexdigest()
-    
-    def insert(self, sha256: str, rel_path: str, mime: str) -> int:
+    def save_upload(self, file_storage, name: str, ext: str, rel_dir: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Stores uploaded file under static/<rel_dir> in one pass: the stream is hashed
+        while it's written to a temp file in the target directory, fsync-ed and atomically
+        renamed to <sha-prefix>_<name><ext>. Duplicates (by SHA-256) reuse the existing file.
+        (Werkzeug's multipart parser has already spooled the file - in memory up to 500 KiB,
+        else to a temp file - bounded by MAX_CONTENT_LENGTH; this is the one pass after it.)
+
+        Returns
+        -------
+        (media_result, None) on success, (None, error message) otherwise
+        """
+        abs_dir = Path(STATIC_ROOT) / rel_dir
+        abs_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=abs_dir, prefix='.upload-', suffix='.part')
+        try:
+            h = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        return None, "File too large."
+                    h.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            sha = h.hexdigest()
+
+            existing = self.get_by_hash(sha)
+            if existing:
+                # files uploaded before derivatives existed get them now
+                self.derivatives.schedule(existing['id'], sha, existing['rel_path'])
+                return self._media_result(existing['rel_path'], sha, existing['mime'], True), None
+
+            rel_path = f"{rel_dir}/{sha[:12]}_{name}{ext}"
+            os.replace(tmp_path, Path(STATIC_ROOT) / rel_path)
+            tmp_path = None
+            self._fsync_dir(abs_dir)
+
+            mime = mimetypes.types_map.get(ext, 'application/octet-stream')
+            media_id = self.insert(sha, rel_path, mime)
+            if media_id is None:
+                # the same content was stored by a concurrent upload in the meantime
+                existing = self.get_by_hash(sha)
+                if existing['rel_path'] != rel_path:
+                    (Path(STATIC_ROOT) / rel_path).unlink(missing_ok=True)
+                return self._media_result(existing['rel_path'], sha, existing['mime'], True), None
+            self.derivatives.schedule(media_id, sha, rel_path)
+            return self._media_result(rel_path, sha, mime, False), None
+        finally:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+
+    def _media_result(self, rel_path: str, sha256: str, mime: str, deduplicated: bool) -> Dict:
+        return {"url": f"{MEDIA_URL}{rel_path}", "rel_path": rel_path, "sha256": sha256, "mime": mime,
+                "deduplicated": deduplicated}
+
+    def _fsync_dir(self, path: Path) -> None:
+        # make the rename durable; not possible on every platform (ie. Windows)
+        try:
+            dir_fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def insert(self, sha256: str, rel_path: str, mime: str) -> Optional[int]:
         return self.media_model.insert(sha256, rel_path, mime)
-    
-    def delete(self, rel_path: str, locale: str) -> int:
-        STATIC_ROOT = 'static'
 
+    def send(self, rel_path: str = None, sha256: str = None):
+        """
+        Sends uploaded file (or its variant) found by rel_path or sha256.
+        Content never changes under a given path, so: strong ETag = SHA-256, 304 on If-None-Match,
+        byte ranges, and Cache-Control immutable. File body goes through wsgi.file_wrapper (sendfile).
+        """
+        if sha256 is not None:
+            media = self.get_by_hash(sha256)
+            if media:
+                media['etag'] = media['sha256']
+        else:
+            media = self.media_model.get_by_path(rel_path)
+        if not media:
+            abort(404)
+        path = safe_join(os.path.abspath(STATIC_ROOT), media['rel_path'])
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = send_file(path, mimetype=media['mime'], conditional=True,
+                             etag=media['etag'], max_age=MEDIA_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def expand_shortcodes(self, blocks: List[str]) -> List[str]:
+        """ [[image:<rel_path>|alt]] -> responsive <picture> with srcset """
+        return self.derivatives.expand_shortcodes(blocks)
+    
+    def delete(self, rel_path: str) -> Optional[str]:
+        """ Deletes upload and its variants; refused (error message returned) while a block uses it """
         rel_path = unquote(rel_path)
-        if rel_path.startswith('/static/'):
-            rel_path = rel_path[len('/static/'):]
-        elif rel_path.startswith('static/'):
-            rel_path = rel_path[len('static/'):]
-            
-        # delete file from disk
-        abs_path = Path(STATIC_ROOT) / rel_path
+        for prefix in ('/static/', 'static/', MEDIA_URL, MEDIA_URL.lstrip('/')):
+            if rel_path.startswith(prefix):
+                rel_path = rel_path[len(prefix):]
+                break
+
+        paths = [rel_path] + self.media_model.derivative_paths(rel_path)
+        if not self.media_model.delete(rel_path):
+            pages = self.media_model.used_by(rel_path)
+            if pages:
+                return f"{rel_path} is used by: {', '.join(pages)}"
+        # delete file and its variants from disk, rows are gone already
+        for path in paths:
+            (Path(STATIC_ROOT) / path).unlink(missing_ok=True)
+        return None
+
+    def gc(self, batch: int = GC_BATCH, min_age_hours: float = GC_MIN_AGE_HOURS) -> Dict[str, int]:
+        """
+        Removes uploads no block uses (rows, variants, files), `batch` per short write
+        transaction, then files under static/uploads that belong to no row at all.
+        Anything younger than min_age_hours is kept. Returns counts: rows, files, bytes.
+        """
+        counts = {'rows': 0, 'files': 0, 'bytes': 0}
+        last_id = 0
+        while True:
+            ids = self.media_model.orphans(last_id, batch, min_age_hours)
+            if not ids:
+                break
+            last_id = ids[-1]
+            deleted, paths = self.media_model.delete_orphans(ids)
+            counts['rows'] += deleted
+            for path in paths:
+                self._unlink(path, counts)
+
+        # stray files: interrupted uploads (.upload-*.part), rows deleted by hand, ...
+        cutoff = time.time() - min_age_hours * 3600
+        chunk = []
+        for dirpath, _, filenames in os.walk(Path(STATIC_ROOT) / UPLOAD_BASE):
+            for name in filenames:
+                full = Path(dirpath) / name
+                try:
+                    if full.stat().st_mtime > cutoff:
+                        continue  # in progress
+                except FileNotFoundError:
+                    continue  # renamed/removed meanwhile
+                rel_path = full.relative_to(STATIC_ROOT).as_posix()
+                if name.startswith('.'):
+                    if name.endswith('.part'):
+                        self._unlink(rel_path, counts)  # temp file of a crashed upload/resize, no row
+                    continue
+                chunk.append(rel_path)
+                if len(chunk) >= batch:
+                    self._remove_unknown(chunk, counts)
+                    chunk = []
+        self._remove_unknown(chunk, counts)
+        return counts
+
+    def _remove_unknown(self, rel_paths: List[str], counts: Dict[str, int]) -> None:
+        known = self.media_model.known_paths(rel_paths)
+        for path in rel_paths:
+            if path not in known:
+                self._unlink(path, counts)
+
+    def _unlink(self, rel_path: str, counts: Dict[str, int]) -> None:
+        path = Path(STATIC_ROOT) / rel_path
         try:
-            abs_path.unlink()
+            size = path.stat().st_size
+            path.unlink()
         except FileNotFoundError:
-            pass
-        self.media_model.delete(rel_path)
-        return redirect(url_for('admin_page', lang=locale))
\ No newline at end of file
+            return
+        counts['files'] += 1
+        counts['bytes'] += size
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# metrics.py
+import logging
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict
+
+from flask import before_render_template, g, request, template_rendered
+
+from models import query_log
+
+# QCMS_METRICS=1 turns on timing of requests, templates and every SQL statement
+METRICS = os.getenv("QCMS_METRICS", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("QCMS_SLOW_QUERY_MS", "50"))
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+MAX_TRACKED_QUERIES = 200  # distinct statements kept in the per-query totals
+
+slow_query_log = logging.getLogger('qcms.slow_query')
+
+
+class Metrics:
+    """ Per-request timing (Server-Timing header), per-route histograms and the slow-query log """
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._routes = {}   # "GET /page/<page>" -> totals + histogram
+        self._queries = {}  # sql -> [count, total seconds, rows]
+
+    def install(self, app) -> None:
+        app.before_request(self._request_started)
+        app.after_request(self._request_finished)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    def _request_started(self) -> None:
+        g.metrics_started = perf_counter()
+        g.metrics_template = 0.0
+        g.metrics_token = query_log.start()
+
+    def _template_started(self, sender, template, context, **extra) -> None:
+        # renders outside a dispatched request (warm-up, export-static) aren't timed
+        if g.get('metrics_token') is not None:
+            g.metrics_template_started = perf_counter()
+
+    def _template_finished(self, sender, template, context, **extra) -> None:
+        started = g.pop('metrics_template_started', None)
+        if started is not None and g.get('metrics_token') is not None:
+            g.metrics_template += perf_counter() - started
+
+    def _request_finished(self, response):
+        token = g.pop('metrics_token', None)
+        if token is None:
+            return response
+        queries = query_log.stop(token)
+        total = perf_counter() - g.metrics_started
+        db = sum(q.duration for q in queries)
+        template = g.metrics_template
+        # body of streamed responses (ie. ndjson export) is produced after this point
+        response.headers['Server-Timing'] = (
+            f'db;dur={db * 1000:.2f};desc="{len(queries)} queries", '
+            f'template;dur={template * 1000:.2f}, total;dur={total * 1000:.2f}')
+        route = f'{request.method} {request.url_rule.rule if request.url_rule else "<unmatched>"}'
+        self._record(route, total, db, template, queries)
+        return response
+
+    def _teardown(self, exc=None) -> None:
+        # after_request didn't run (unhandled error) - stop collecting anyway
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            query_log.stop(token)
+
+    def _record(self, route: str, total: float, db: float, template: float, queries) -> None:
+        total_ms = total * 1000
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0, 'template_ms': 0.0,
+                    'queries': 0, 'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['db_ms'] += db * 1000
+            stats['template_ms'] += template * 1000
+            stats['queries'] += len(queries)
+            stats['buckets'][bisect_left(LATENCY_BUCKETS_MS, total_ms)] += 1
+            for q in queries:
+                totals = self._queries.get(q.sql)
+                if totals is None:
+                    if len(self._queries) >= MAX_TRACKED_QUERIES:
+                        continue
+                    totals = self._queries[q.sql] = [0, 0.0, 0]
+                totals[0] += 1
+                totals[1] += q.duration
+                totals[2] += q.rows
+        for q in queries:
+            if q.duration * 1000 >= self.slow_query_ms:
+                slow_query_log.warning('%.1f ms, %d rows, %s: %s', q.duration * 1000, q.rows, route,
+                                       ' '.join(q.sql.split()))
+
+    def snapshot(self, top: int = 20) -> Dict:
+        """Per-route request counts, latency histogram (ms buckets) and time split, plus top queries."""
+        with self._lock:
+            routes = {}
+            for route, s in sorted(self._routes.items()):
+                count = s['count'] or 1
+                routes[route] = {
+                    'count': s['count'],
+                    'mean_ms': round(s['total_ms'] / count, 3),
+                    'max_ms': round(s['max_ms'], 3),
+                    'db_mean_ms': round(s['db_ms'] / count, 3),
+                    'template_mean_ms': round(s['template_ms'] / count, 3),
+                    'queries_per_request': round(s['queries'] / count, 2),
+                    'histogram_ms': {f'le_{b}': n for b, n in zip(LATENCY_BUCKETS_MS, s['buckets'])}
+                                    | {'inf': s['buckets'][-1]},
+                }
+            queries = sorted(self._queries.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            return {
+                'routes': routes,
+                'queries': [{'sql': ' '.join(sql.split()), 'count': n, 'total_ms': round(t * 1000, 3),
+                             'rows': rows} for sql, (n, t, rows) in queries],
+                'slow_query_ms': self.slow_query_ms,
+            }
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# page_cache.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+PAGE_CACHE_SIZE = int(os.getenv("QCMS_PAGE_CACHE_SIZE", "256"))
+# how often (seconds) cached pages check if another process wrote to the db
+PAGE_CACHE_RECHECK = float(os.getenv("QCMS_PAGE_CACHE_RECHECK", "1.0"))
+
+
+class PageCache:
+    """ Bounded LRU cache of rendered pages with hit/miss counters """
+
+    def __init__(self, max_size: int = PAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Changes on every clear(); pass it to put() to drop results rendered before a write."""
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key: Hashable, html: str, generation: int) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            # content changed while the page was rendered - don't cache stale html
+            if generation != self._generation:
+                return
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
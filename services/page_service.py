@@ -5,14 +5,18 @@ Created on Sat Oct 18 01:20:19 2025
 
 @author: mariusz
 """
-import os, mimetypes, datetime
-from pathlib import Path
+import os, datetime, threading, time
 from flask import request, render_template, redirect, url_for
+from markupsafe import Markup
 
+from models.database import data_version, on_write
+from models.page_context import PageContext
 from models.page_model import PageModel
 from services.comment_service import CommentService
 from services.home_service import HomeService
-from services.media_service import MediaService
+from services.media_service import MediaService, MEDIA_URL
+from services.fragment_cache import FragmentCache
+from services.page_cache import PAGE_CACHE_RECHECK, PageCache
 
 ALLOWED_EXT = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
 STATIC_ROOT = 'static'
@@ -20,11 +24,21 @@ UPLOAD_BASE = 'uploads'  # will be: static/uploads/YYYY/MM/DD/...
 
 class PageService:
     """ Service for pages in my Micro CMS """
-    def __init__(self):
+    def __init__(self, comment_service: CommentService, home_service: HomeService,
+                 media_service: MediaService):
+        # shared instances from services.registry, not copies of our own
         self.page_model = PageModel()
-        self.comment_service = CommentService()
-        self.home_service = HomeService()
-        self.media_service = MediaService()
+        self.comment_service = comment_service
+        self.home_service = home_service
+        self.media_service = media_service
+        self.page_context = PageContext()
+        self.page_cache = PageCache()
+        self.fragment_cache = FragmentCache()
+        on_write(self.fragment_cache.on_write)
+        on_write(self._invalidate_page_cache)
+        self._data_version = None
+        self._checked_at = 0.0
+        self._check_lock = threading.Lock()
 
     def add(self, page: str, locale: str, position: int, content: str):
         return self.page_model.add(page, locale, position, content)   
@@ -35,52 +49,91 @@ class PageService:
     def get_pages_list(self):
         return self.page_model.get_pages_list()
     
-    def _site_title(self) -> str | None:
-        return self.home_service.get_param('title')
-    
-    def _site_domain(self)->str | None:
-        return self.home_service.get_param('domain')
+    def _context(self, locale: str, **kwargs) -> dict:
+        """Template context (title, domain, footer, menu, comments, ...) loaded in one go."""
+        ctx = self.page_context.load(locale=locale, **kwargs)
+        ctx['recent_media'] = [
+            {"url": f"{MEDIA_URL}{m['rel_path']}", "rel_path": m['rel_path'], "mime": m["mime"],
+             "uploaded_at": m["uploaded_at"]}
+            for m in ctx['recent_media']
+        ]
+        return ctx
     
+    def _invalidate_page_cache(self, table: str) -> None:
+        # menu, comments and footer are on every page, so any of these writes drops all entries;
+        # new image variants change the <picture> markup of [[image:...]] blocks.
+        # The fragments of the tables that did not change stay in fragment_cache.
+        if table in ('pages', 'comments', 'params', 'media_derivatives'):
+            self.page_cache.clear()
+
+    def _check_other_writers(self) -> None:
+        """
+        Writes of other worker processes never reach our on_write listeners: at most every
+        PAGE_CACHE_RECHECK seconds PRAGMA data_version is compared with the last one seen
+        and on a change both caches are dropped (own writes change it too - one extra clear).
+        """
+        now = time.monotonic()
+        if now - self._checked_at < PAGE_CACHE_RECHECK:
+            return
+        with self._check_lock:
+            if now - self._checked_at < PAGE_CACHE_RECHECK:
+                return
+            version = data_version(self.page_model.db_name)
+            if self._data_version is not None and version != self._data_version:
+                self.page_cache.clear()
+                self.fragment_cache.invalidate()
+            self._data_version = version
+            self._checked_at = time.monotonic()
+
     def render_page(self, page: str):
         if page and page == 'admin':
             return self.render_admin_page(page)
+        self._check_other_writers()
         locale = self.detect_locale()
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-        if not site_title or not site_domain:
+        cache_key = (page, locale)
+        html = self.page_cache.get(cache_key)
+        if html is not None:
+            return html
+        generation = self.page_cache.generation
+        site_title = self.home_service.get_param('title')
+        if not site_title or not self.home_service.get_param('domain'):
             return redirect(url_for('add_page', lang=locale))
-        blocks = self.get(page, locale)
-        comments, footer_data = self.get_comments_and_footer()
-        pages = self.get_pages_list()
-        return render_template(
-                'page.html',
-                page=page,
-                locale=locale,
-                blocks=blocks,
-                site_title=site_title,
-                site_domain=site_domain,
-                comments=comments,
-                footer_data=footer_data,
-               pages = pages
-       )
-    
+        html = render_template('page.html', page=page, locale=locale, site_title=site_title,
+                               fragments=self._render_fragments(page, locale))
+        self.page_cache.put(cache_key, html, generation)
+        return html
+
+    def _render_fragments(self, page: str, locale: str) -> dict:
+        """
+        Menu, blocks, comments and footer of page as Markup - from fragment_cache, only the
+        missing ones are loaded and rendered (ie. after a comment just the comments).
+        """
+        footer_data = self.home_service.get_footer_data()
+        keys = {
+            'menu': self.fragment_cache.key('menu', locale),
+            'blocks': self.fragment_cache.key('blocks', page, locale),
+            'comments': self.fragment_cache.key('comments', page or 'home', locale),
+            # params snapshot also sees writes of other processes, so its values are the key
+            'footer': self.fragment_cache.key('footer', *footer_data.values()),
+        }
+        fragments = {name: self.fragment_cache.get(key) for name, key in keys.items()}
+        missing = [name for name, html in fragments.items() if html is None]
+        if missing:
+            ctx = self._context(locale, page=page, menu='menu' in missing,
+                                blocks='blocks' in missing, comments='comments' in missing)
+            if 'blocks' in missing:
+                ctx['blocks'] = self.media_service.expand_shortcodes(ctx['blocks'])
+            for name in missing:
+                fragments[name] = render_template(f'{name}.html', page=page, locale=locale, **ctx)
+                self.fragment_cache.put(keys[name], fragments[name])
+        return {name: Markup(html) for name, html in fragments.items()}
+
     def render_admin_page(self, page: str):
         locale = self.detect_locale()
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-        if not site_title or not site_domain:
+        ctx = self._context(locale, comments=False)
+        if not ctx['site_title'] or not ctx['site_domain']:
             return redirect(url_for('add_page', lang=locale))
-        footer_data = self.home_service.get_footer_data()
-        pages = self.get_pages_list()
-        return render_template(
-                'admin.html',
-                page=page,
-                locale=locale,
-                site_title=site_title,
-                site_domain=site_domain,
-                footer_data=footer_data,
-                pages = pages
-                )
+        return render_template('admin.html', page=page, locale=locale, **ctx)
     
     def get_comments_and_footer(self):
         comments = self.comment_service.get_all()
@@ -104,37 +157,22 @@ class PageService:
         Returns HTTP response (render or redirect).
         """
         locale = self.detect_locale()
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-        pages = self.page_model.get_pages_list()
-        comments = self.comment_service.get_all()
-        footer_data = self.home_service.get_footer_data()
-        recent_media = [
-            {"url": f"/static/{m['rel_path']}", "mime": m["mime"], "uploaded_at": m["uploaded_at"]}
-            for m in self.media_service.recent()
-        ]
+        ctx = self._context(locale, recent_media=True)
 
         if request.method == 'POST':
             # if there's not title, try to set it up
-            if not site_title or not site_domain:
+            if not ctx['site_title'] or not ctx['site_domain']:
                 new_title = (request.form.get('title') or '').strip()
                 new_domain = (request.form.get('domain') or '').strip()
                 if new_title and new_domain:
                     self.home_service.set_param('title', new_title)
                     self.home_service.set_param('domain', new_domain)
-                    site_title = new_title
-                    site_domain = new_domain
+                    ctx['site_title'] = new_title
+                    ctx['site_domain'] = new_domain
                 else:
                     # no title -> show our form again
-                    return render_template('add_page.html',
-                                           locale=locale,
-                                           site_title=None,
-                                           site_domain=None,
-                                           pages=pages,
-                                           comments=comments,
-                                           recent_media=recent_media,
-                                           footer_data=footer_data
-                                           )
+                    ctx['site_title'] = ctx['site_domain'] = None
+                    return render_template('add_page.html', locale=locale, **ctx)
 
             # if title exists let's work with content
             page = (request.form.get('page') or '').strip()
@@ -147,65 +185,41 @@ class PageService:
                 return self.render_edit_page(page)
             
             # no content -> show form
-            return render_template('add_page.html',
-                                   locale=locale,
-                                   site_title=site_title,
-                                   site_domain=site_domain,
-                                   pages=pages,
-                                   comments=comments,
-                                   recent_media=recent_media,
-                                   footer_data=footer_data
-                                   )
+            return render_template('add_page.html', locale=locale, **ctx)
 
         # GET
-        return render_template('add_page.html',
-                               locale=locale,
-                               site_title=site_title,
-                               site_domain=site_domain,
-                               pages=pages,
-                               comments=comments,
-                               recent_media=recent_media,
-                               footer_data=footer_data
-                               )
+        return render_template('add_page.html', locale=locale, **ctx)
+
+    def render_search(self):
+        """Search results page for ?q=..."""
+        locale = self.detect_locale()
+        query = (request.args.get('q') or '').strip()[:200]
+        ctx = self._context(locale, comments=False)
+        if not ctx['site_title'] or not ctx['site_domain']:
+            return redirect(url_for('add_page', lang=locale))
+        results = self.page_model.search(query, locale) if query else []
+        return render_template('search.html', page='search', locale=locale, query=query,
+                               results=results, **ctx)
+
+    def rebuild_search_index(self) -> int:
+        return self.page_model.rebuild_search_index()
 
     def delete(self, page_id: int) -> int:
         return self.page_model.delete(page_id)
     
-    def delete_by_name(self, page_name: str):
+    def delete_by_name(self, page_name: str, locale: str):
         self.page_model.delete_by_name(page_name)
-        locale = self.detect_locale()
         return redirect(url_for('admin_page', lang=locale))
     
     def render_edit_page(self, page: str):
         """Render edit pagei: list of blocks + forms."""
         locale = self.detect_locale()
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-        if not site_title or not site_domain:
-            return redirect(url_for('add_page', lang=locale))
-
         # context data
-        pages = self.page_model.get_pages_list()
-        comments = self.comment_service.get_all()
-        footer_data = self.home_service.get_footer_data()
-        recent_media = [
-            {"url": f"/static/{m['rel_path']}", "mime": m["mime"], "uploaded_at": m["uploaded_at"]}
-            for m in self.media_service.recent()
-        ]
-        blocks = self.page_model.get_blocks_for_page(page, locale)
+        ctx = self._context(locale, page=page, editable=True, recent_media=True)
+        if not ctx['site_title'] or not ctx['site_domain']:
+            return redirect(url_for('add_page', lang=locale))
 
-        return render_template(
-            'edit_page.html',
-            page=page,
-            locale=locale,
-            site_title=site_title,
-            site_domain=site_domain,
-            pages=pages,
-            comments=comments,
-            footer_data=footer_data,
-            recent_media=recent_media,
-            blocks=blocks
-        )
+        return render_template('edit_page.html', page=page, locale=locale, **ctx)
     
     def save_block(self, block_id: int):
         """Save of one block (position + content) and return to edit this page."""
@@ -220,6 +234,13 @@ class PageService:
         self.page_model.update_block(block_id=int(block_id), position=int(pos_raw), content=content)
         return redirect(url_for('edit_page', page=page, lang=locale))
 
+    def get_blocks(self, page: str, locale: str):
+        return self.page_model.get_blocks_for_page(page, locale)
+
+    def replace_blocks(self, page: str, locale: str, blocks: list):
+        """All blocks of page/locale in the given order (inserts, updates, deletes) in one commit."""
+        return self.page_model.replace_blocks(page, locale, blocks)
+
     def delete_block(self, block_id: int):
         """Delete one block and return to edit this page."""
         page = (request.form.get('page') or '').strip()
@@ -229,12 +250,6 @@ class PageService:
     
     def media_upload_response(self):
         locale = self.detect_locale()
-        pages = self.page_model.get_pages_list()
-        comments = self.comment_service.get_all()
-        footer_data = self.home_service.get_footer_data() or {}
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-
         file = request.files.get('file')
         media_result = None
         error = None
@@ -247,67 +262,21 @@ class PageService:
             if ext not in ALLOWED_EXT:
                 error = "Unsupported extension."
             else:
-                sha = self.media_service._calc_sha256(file)
-                existing = self.media_service.get_by_hash(sha)
-                if existing:
-                    url = f"/static/{existing['rel_path']}"
-                    media_result = {"url": url, "sha256": sha, "mime": existing['mime'], "deduplicated": True}
-                else:
-                    rel_dir = self._date_rel_dir()
-                    prefix = sha[:12]
-                    rel_name = f"{prefix}_{name}{ext}"
-                    rel_path = f"{rel_dir}/{rel_name}"
-                    abs_dir = Path(STATIC_ROOT) / rel_dir
-                    abs_dir.mkdir(parents=True, exist_ok=True)
-                    abs_path = Path(STATIC_ROOT) / rel_path
-    
-                    file.save(abs_path)
-    
-                    mime = mimetypes.types_map.get(ext, 'application/octet-stream')
-    
-                    self.media_service.insert(sha, rel_path, mime)
-                    url = f"/static/{rel_path}"
-                    media_result = {"url": url, "sha256": sha, "mime": mime, "deduplicated": False}
-    
-        recent_media = [
-            {"url": f"/static/{m['rel_path']}", "mime": m["mime"], "uploaded_at": m["uploaded_at"]}
-            for m in self.media_service.recent()
-        ]
+                media_result, error = self.media_service.save_upload(file, name, ext, self._date_rel_dir())
+
+        ctx = self._context(locale, recent_media=True)
         return render_template(
             'add_page.html',
             locale=locale,
-            site_title=site_title,
-            site_domain=site_domain,
-            pages=pages,
-            comments=comments,
-            footer_data=footer_data,
             media_result=media_result,
             media_error=error,
-            recent_media=recent_media
+            **ctx
             )
     
     def media_delete_response(self, rel_path: str, locale: str):
-        self.media_service.delete(rel_path, locale)
-        locale = self.detect_locale()
-        site_title = self._site_title()
-        site_domain = self._site_domain()
-        pages = self.page_model.get_pages_list()
-        comments = self.comment_service.get_all()
-        footer_data = self.home_service.get_footer_data()
-        recent_media = [
-            {"url": f"/static/{m['rel_path']}", "mime": m["mime"], "uploaded_at": m["uploaded_at"]}
-            for m in self.media_service.recent()
-        ]
-        return render_template(
-            'add_page.html',
-            locale=locale,
-            site_title=site_title,
-            site_domain=site_domain,
-            pages=pages,
-            comments=comments,
-            footer_data=footer_data,
-            recent_media=recent_media
-            )
+        error = self.media_service.delete(rel_path)
+        ctx = self._context(locale, recent_media=True)
+        return render_template('add_page.html', locale=locale, media_error=error, **ctx)
         
     
     def _date_rel_dir(self) -> str:
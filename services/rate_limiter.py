@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# rate_limiter.py - token buckets per client address and write route, 429 before any work is done
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+# QCMS_RATE_LIMIT=0 turns the limiter off
+RATE_LIMIT = os.getenv("QCMS_RATE_LIMIT", "1") == "1"
+# endpoint -> (requests, seconds): burst of `requests`, refilled evenly over `seconds`
+DEFAULT_LIMITS = {
+    'add_comment': (5, 60),
+    'add_page': (60, 60),
+    'save_block': (120, 60),
+    'delete_block': (120, 60),
+    'page_blocks': (60, 60),
+    'upload_media': (30, 60),
+    'delete_media': (60, 60),
+    'del_page': (60, 60),
+    'delete': (60, 60),
+}
+RATE_LIMIT_KEYS = int(os.getenv("QCMS_RATE_LIMIT_KEYS", "10000"))  # (address, route) buckets kept
+
+
+def parse_limits(spec: str, defaults: Dict[str, Tuple[int, float]] = DEFAULT_LIMITS) -> Dict[str, Tuple[int, float]]:
+    """
+    QCMS_RATE_LIMITS="add_comment=3/60,upload_media=10/3600" overrides the defaults of
+    those endpoints; 0 requests (add_comment=0/60) = no limit for the endpoint.
+    """
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            endpoint, rate = item.split('=')
+            count, seconds = rate.split('/')
+            limits[endpoint.strip()] = (int(count), float(seconds))
+        except ValueError:
+            raise ValueError(f"QCMS_RATE_LIMITS: {item!r} is not <endpoint>=<requests>/<seconds>") from None
+    return {endpoint: rate for endpoint, rate in limits.items() if rate[0] > 0 and rate[1] > 0}
+
+
+class RateLimiter:
+    """
+    Token bucket per (client address, endpoint). Buckets live in an OrderedDict in the
+    order of last use: a request costs one dict lookup plus dropping buckets from the
+    front that are full again (expired) or over max_keys - O(1) amortized, bounded memory.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, float]]] = None, max_keys: int = RATE_LIMIT_KEYS):
+        self.limits = parse_limits(os.getenv("QCMS_RATE_LIMITS", "")) if limits is None else limits
+        self.max_keys = max_keys
+        self.rejected = 0
+        # a bucket unused this long is full again, forgetting it changes nothing
+        self._expiry = max((seconds for _, seconds in self.limits.values()), default=0)
+        self._buckets = OrderedDict()  # (address, endpoint) -> [tokens, updated at]
+        self._lock = threading.Lock()
+
+    def acquire(self, address: str, endpoint: str, now: Optional[float] = None) -> float:
+        """Takes a token of address on endpoint. Returns 0 if allowed, else seconds until one is available."""
+        rate = self.limits.get(endpoint)
+        if rate is None:
+            return 0.0
+        capacity, seconds = rate
+        refill = capacity / seconds  # tokens per second
+        now = time.monotonic() if now is None else now
+        key = (address, endpoint)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(capacity), now]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill)
+                bucket[1] = now
+            self._expire(now)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            self.rejected += 1
+            return (1 - bucket[0]) / refill
+
+    def _expire(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            _, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self._expiry and len(buckets) <= self.max_keys:
+                break
+            buckets.popitem(last=False)
+
+    def limit(self, methods: Optional[Iterable[str]] = None):
+        """
+        Route decorator (put it above auth, so a rejected request costs nothing): over the
+        limit of the endpoint (= view name) -> 429 with Retry-After, before the view runs.
+        methods = limit only these (ie. POST of a form route). Views without a limit stay as they are.
+        """
+        methods = set(methods) if methods else None
+
+        def decorator(view):
+            endpoint = view.__name__
+            if endpoint not in self.limits:
+                return view
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    wait = self.acquire(request.remote_addr or '', endpoint)
+                    if wait:
+                        raise TooManyRequests(retry_after=math.ceil(wait))
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'buckets': len(self._buckets), 'max_keys': self.max_keys, 'rejected': self.rejected}
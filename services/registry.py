@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# registry.py
+import threading
+from functools import cached_property
+
+from models.migrations import migrate
+from services.comment_service import CommentService
+from services.home_service import HomeService
+from services.media_service import MediaService
+from services.page_service import PageService
+
+
+class ServiceRegistry:
+    """ One shared instance of every service, created on first use (all of them use qcms.db) """
+
+    def __init__(self):
+        migrate()
+
+    @cached_property
+    def comment_service(self) -> CommentService:
+        return CommentService()
+
+    @cached_property
+    def home_service(self) -> HomeService:
+        return HomeService()
+
+    @cached_property
+    def media_service(self) -> MediaService:
+        return MediaService()
+
+    @cached_property
+    def page_service(self) -> PageService:
+        return PageService(self.comment_service, self.home_service, self.media_service)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ServiceRegistry:
+    """Process-wide registry (schema is migrated when it's created)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ServiceRegistry()
+        return _registry
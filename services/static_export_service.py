@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# static_export_service.py - public pages rendered to files for a web server, incremental
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Set
+from urllib.parse import quote
+
+from models.page_model import media_refs
+from models.static_export_model import StaticExportModel
+from services.compression import GZIP_MIN_SIZE, gzip_bytes
+
+STATIC_URL = 'static'  # static files are served under /static/ - the export keeps that
+UPLOAD_BASE = 'uploads'
+MANIFEST = '.qcms-static.json'
+MANIFEST_FORMAT = 2  # 2: /static/uploads/ links rewritten to /media/uploads/
+# templates a public page is rendered from, a change of any of them re-renders all pages
+PAGE_TEMPLATES = ('page.html', 'menu.html', 'blocks.html', 'comments.html', 'footer.html')
+# blocks from before /media embed uploads as /static/uploads/..., the export has them under media/ only
+_STATIC_UPLOADS = ('/' + STATIC_URL + '/' + UPLOAD_BASE + '/').encode()
+_MEDIA_UPLOADS = ('/media/' + UPLOAD_BASE + '/').encode()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """The web server sees the old or the new file, never half of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.part')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _link_or_copy(src: str, dst: str) -> bool:
+    """Hard link src at dst (copy on another filesystem). False if dst is already up to date."""
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        pass
+    else:
+        if (dst_stat.st_ino == src_stat.st_ino and dst_stat.st_dev == src_stat.st_dev) or \
+                (dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime >= src_stat.st_mtime):
+            return False
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(dst), '.' + os.path.basename(dst) + '.part')
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return True
+
+
+class StaticExportService:
+    """ Writes every public page (and the files it uses) to a directory served without the app """
+
+    def __init__(self, app, page_service):
+        self.app = app
+        self.page_service = page_service
+        # uploads are under static/uploads, so both come from the app's static folder (not the cwd)
+        self.static_root = app.static_folder
+        self.static_export_model = StaticExportModel()
+
+    def export(self, out_dir: str, full: bool = False) -> Dict[str, int]:
+        """
+        Renders pages of get_pages_list into out_dir: index.html (home), page/<page>.html,
+        media/<rel_path> for referenced uploads, static/ for the other static files.
+        Only pages whose hash changed since the last export (manifest in out_dir) are
+        rendered, unless full=True. Pages deleted since then are removed.
+        Returns counts: rendered, unchanged, removed, files.
+        """
+        with self.app.test_request_context('/'):
+            locale = self.page_service.detect_locale()
+        # hashes are taken before rendering - a write in between renders that page again next time
+        site_hash, page_hashes = self.static_export_model.hashes(locale)
+        site_hash = self._with_templates(site_hash)
+
+        manifest = self._read_manifest(out_dir)
+        previous = manifest['pages'] if manifest.get('site') == site_hash and not full else {}
+        pages, counts = {}, {'rendered': 0, 'unchanged': 0, 'removed': 0, 'files': 0}
+        for page in self.page_service.get_pages_list():
+            if not page or page.startswith('.') or '/' in page or os.sep in page:
+                continue  # not a usable file name
+            page_hash = page_hashes.get(page, '')
+            old = previous.get(page)
+            if old and old['hash'] == page_hash and os.path.exists(self._page_file(out_dir, page)):
+                pages[page] = old
+                counts['unchanged'] += 1
+                continue
+            body = self._render(page)
+            # .gz next to the page for nginx gzip_static, compressed once per change
+            compressed = gzip_bytes(body) if len(body) >= GZIP_MIN_SIZE else None
+            for path in [self._page_file(out_dir, page)] + ([os.path.join(out_dir, 'index.html')]
+                                                            if page == 'home' else []):
+                _write_atomic(path, body)
+                if compressed is not None:
+                    _write_atomic(path + '.gz', compressed)
+                elif os.path.exists(path + '.gz'):
+                    os.remove(path + '.gz')
+            media = sorted(media_refs(body.decode('utf-8')))
+            pages[page] = {'hash': page_hash, 'media': media}
+            counts['rendered'] += 1
+
+        for page in set(manifest.get('pages', {})) - set(pages):
+            for path in (self._page_file(out_dir, page),
+                         os.path.join(out_dir, 'index.html') if page == 'home' else None):
+                for name in (path, path + '.gz') if path else ():
+                    if os.path.exists(name):
+                        os.remove(name)
+            counts['removed'] += 1
+
+        counts['files'] = self._sync_files(out_dir, {m for p in pages.values() for m in p['media']})
+        _write_atomic(os.path.join(out_dir, MANIFEST), json.dumps(
+            {'format': MANIFEST_FORMAT, 'site': site_hash, 'locale': locale, 'pages': pages},
+            ensure_ascii=False, indent=1).encode('utf-8'))
+        return counts
+
+    def _render(self, page: str) -> bytes:
+        path = '/' if page == 'home' else f'/page/{quote(page)}'
+        with self.app.test_request_context(path):
+            result = self.page_service.render_page(page)
+        if not isinstance(result, str):
+            raise ValueError("site has no title/domain yet, nothing to export")
+        return result.encode('utf-8').replace(_STATIC_UPLOADS, _MEDIA_UPLOADS)
+
+    def _with_templates(self, site_hash: str) -> str:
+        env = self.app.jinja_env
+        digest = hashlib.sha256(site_hash.encode())
+        for name in PAGE_TEMPLATES:
+            digest.update(env.loader.get_source(env, name)[0].encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _page_file(out_dir: str, page: str) -> str:
+        return os.path.join(out_dir, 'page', page + '.html')
+
+    @staticmethod
+    def _read_manifest(out_dir: str) -> Dict:
+        try:
+            with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return manifest if manifest.get('format') == MANIFEST_FORMAT else {}
+
+    def _sync_files(self, out_dir: str, media: Set[str]) -> int:
+        """Links referenced uploads to media/, the rest of static/ (css, ...) to static/."""
+        changed = 0
+        media_dir = os.path.join(out_dir, 'media')
+        wanted = set()
+        for rel_path in media:
+            name = os.path.normpath(rel_path)
+            src = os.path.join(self.static_root, name)
+            if os.path.isabs(name) or not name.startswith(UPLOAD_BASE + os.sep) or not os.path.isfile(src):
+                continue
+            wanted.add(name)
+            changed += _link_or_copy(src, os.path.join(media_dir, name))
+        # uploads no longer used by any page
+        for dirpath, _, filenames in os.walk(media_dir):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                if os.path.relpath(full, media_dir) not in wanted:
+                    os.remove(full)
+
+        for dirpath, dirnames, filenames in os.walk(self.static_root):
+            if dirpath == self.static_root and UPLOAD_BASE in dirnames:
+                dirnames.remove(UPLOAD_BASE)  # served as media/ above
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                src = os.path.join(dirpath, filename)
+                dst = os.path.join(out_dir, STATIC_URL, os.path.relpath(src, self.static_root))
+                changed += _link_or_copy(src, dst)
+        return changed
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# template_cache.py - Jinja bytecode cache, precompile and warm-up of all templates
+import logging
+import os
+import time
+from typing import Dict, List
+
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+# compiled templates survive restarts here ('' = compile in memory only, like before)
+TEMPLATE_CACHE_DIR = os.getenv("QCMS_TEMPLATE_CACHE", "template_cache")
+# render every template once when the app is created, before the first request
+WARMUP = os.getenv("QCMS_WARMUP", "1") == "1"
+
+logger = logging.getLogger('qcms.templates')
+
+# one item per list, so loop bodies (and their url_for calls) run during warm-up too
+_WARMUP_CONTEXT = {
+    'page': 'home',
+    'locale': 'en',
+    'site_title': 'warm-up',
+    'site_domain': 'localhost',
+    'footer_data': {'version': '', 'creation_date': '', 'modification_date': ''},
+    'pages': ['home'],
+    'blocks': [{'id': 1, 'position': 1, 'content': ''}],
+    'comments': [{'id': 1, 'ip': '', 'user': '', 'comment': '', 'creation_date': ''}],
+    'recent_media': [{'url': '', 'rel_path': '', 'mime': '', 'uploaded_at': ''}],
+    'query': '',
+    'results': [],
+    'fragments': {name: Markup('') for name in ('menu', 'blocks', 'comments', 'footer')},
+}
+
+
+def install(app, cache_dir: str = TEMPLATE_CACHE_DIR) -> None:
+    """Gives app's Jinja environment a bytecode cache in cache_dir (shared by all workers)."""
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def precompile(app) -> List[str]:
+    """
+    Compiles every template of app (into the bytecode cache, if installed, and the
+    environment's in-memory cache). Returns names of the templates.
+    """
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def warm_up(app) -> Dict[str, float]:
+    """
+    Renders every template once with a sample context inside a test request, so the
+    first real request finds compiled templates and a built URL map.
+    A template that fails is logged, not raised. Returns ms per template.
+    """
+    timings = {}
+    with app.test_request_context('/'):
+        for name in precompile(app):
+            start = time.perf_counter()
+            try:
+                context = dict(_WARMUP_CONTEXT)
+                app.update_template_context(context)
+                app.jinja_env.get_template(name).render(context)
+            except Exception:
+                logger.warning('warm-up of %s failed', name, exc_info=True)
+                continue
+            timings[name] = round((time.perf_counter() - start) * 1000, 3)
+    return timings
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# transfer_service.py - NDJSON export/import of the site, optional tar of the uploads
+import gzip
+import io
+import json
+import os
+import sys
+import tarfile
+from typing import Dict, Iterator, Optional
+
+from models.transfer_model import TransferModel
+
+STATIC_ROOT = 'static'
+UPLOAD_BASE = 'uploads'
+
+
+def _open(path: str, mode: str):
+    """'-' = stdin/stdout, *.gz = gzip compressed, text in utf-8."""
+    if path == '-':
+        stream = sys.stdout if 'w' in mode else sys.stdin
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', newline='\n', write_through=True)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='\n')
+    return open(path, mode, encoding='utf-8', newline='\n')
+
+
+class TransferService:
+    """ Moves site content between hosts: params, pages, comments, media metadata (+ files) """
+
+    def __init__(self):
+        self.transfer_model = TransferModel()
+
+    def export(self, path: str, files_path: Optional[str] = None) -> Dict[str, int]:
+        """Writes one JSON record per line to path; files under static/uploads to a tar at files_path."""
+        counts = {}
+        out = _open(path, 'w')
+        try:
+            for record in self.transfer_model.export_records():
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                counts[record['type']] = counts.get(record['type'], 0) + 1
+        finally:
+            if path != '-':
+                out.close()
+            else:
+                out.detach()
+        counts.pop('meta', None)
+        if files_path:
+            counts['files'] = self._write_files(files_path)
+        return counts
+
+    def import_(self, path: str, files_path: Optional[str] = None, replace: bool = False) -> Dict[str, int]:
+        """Loads an export made by export() - all or nothing; files are unpacked after the rows."""
+        src = _open(path, 'r')
+        try:
+            counts = self.transfer_model.import_records(self._records(src), replace=replace)
+        finally:
+            if path != '-':
+                src.close()
+            else:
+                src.detach()
+        if files_path:
+            counts['files'] = self._read_files(files_path)
+        return counts
+
+    @staticmethod
+    def _records(lines) -> Iterator[Dict]:
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError(f"line {line_no}: not valid JSON") from None
+
+    def _write_files(self, files_path: str) -> int:
+        count = 0
+        root = os.path.join(STATIC_ROOT, UPLOAD_BASE)
+        # streamed: one file at a time goes through the archive, '|' = no seeking (works on pipes)
+        mode = 'w|gz' if files_path.endswith('gz') else 'w|'
+        with tarfile.open(files_path, mode) as tar:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.startswith('.'):  # unfinished uploads/variants (*.part, tmp files)
+                        continue
+                    full = os.path.join(dirpath, name)
+                    tar.add(full, arcname=os.path.relpath(full, STATIC_ROOT), recursive=False)
+                    count += 1
+        return count
+
+    def _read_files(self, files_path: str) -> int:
+        count = 0
+        with tarfile.open(files_path, 'r|*') as tar:
+            for member in tar:
+                name = os.path.normpath(member.name)
+                # only regular files under uploads/, nothing absolute or outside
+                if not member.isfile() or os.path.isabs(name) or not name.startswith(UPLOAD_BASE + os.sep):
+                    continue
+                target = os.path.join(STATIC_ROOT, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                src = tar.extractfile(member)
+                tmp = os.path.join(os.path.dirname(target), '.' + os.path.basename(target) + '.part')
+                with open(tmp, 'wb') as dst:
+                    while True:
+                        chunk = src.read(64 * 1024)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                os.replace(tmp, target)
+                count += 1
+        return count
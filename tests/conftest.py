@@ -0,0 +1,71 @@
+# conftest.py - every test runs in a temp directory with a fresh qcms.db and fresh services
+import os
+import threading
+
+from werkzeug.security import generate_password_hash
+
+# read at import time by the modules below
+os.environ.setdefault('QCMS_WARMUP', '0')
+os.environ.setdefault('QCMS_TEMPLATE_CACHE', '')
+os.environ.setdefault('QCMS_DERIVATIVE_WORKERS', '0')
+os.environ['ADMIN_PASS_HASH'] = generate_password_hash('pw', method='pbkdf2:sha256:1000')
+
+import base64  # noqa: E402
+
+import pytest  # noqa: E402
+from flask import Flask  # noqa: E402
+
+from models import database, migrations  # noqa: E402
+from models.home_model import HomeModel  # noqa: E402
+from services import registry  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTH = {'Authorization': 'Basic ' + base64.b64encode(b'admin:pw').decode()}
+
+
+def _forget_state():
+    # connections, snapshots and services of the previous test point at its qcms.db
+    for conn in getattr(database._local, 'conns', {}).values():
+        conn.close()
+    database._local.conns = {}
+    for conn in database._watchers.pop(os.getpid(), {}).values():
+        conn.close()
+    migrations._migrated.clear()
+    HomeModel._snapshots.clear()
+    HomeModel._seen = threading.local()
+    registry._registry = None
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Empty, migrated qcms.db in the (temp) working directory."""
+    monkeypatch.chdir(tmp_path)
+    _forget_state()
+    migrations.migrate()
+    yield 'qcms.db'
+    _forget_state()
+
+
+@pytest.fixture
+def app(db):
+    """App over the test database, like app.py creates it."""
+    from controllers.app_controller import AppController
+    flask_app = Flask('app', root_path=ROOT)
+    flask_app.config['TESTING'] = True
+    AppController(flask_app)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def site(client):
+    """Site with title/domain and a home page of one block."""
+    r = client.post('/add_page', headers=AUTH, data={
+        'title': 'Test site', 'domain': 'example.org', 'page': 'home', 'position': '1',
+        'page_order': '0', 'content': '<p>Hello home</p>'})
+    assert r.status_code in (200, 302)
+    return client
@@ -0,0 +1,63 @@
+# test_auth.py - basic auth with the cache of verified credentials
+import base64
+
+import pytest
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+import auth
+from conftest import AUTH
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    """Client of a protected route; the list collects the passwords pbkdf2 checked."""
+    auth._verified.clear()
+    checked = []
+    check = auth.check_password_hash
+
+    def counting(pwhash, password):
+        checked.append(password)
+        return check(pwhash, password)
+
+    monkeypatch.setattr(auth, 'check_password_hash', counting)
+    app = Flask(__name__)
+    app.add_url_rule('/secret', 'secret', auth.requires_basic_auth(lambda: 'ok'))
+    yield app.test_client(), checked
+    auth._verified.clear()
+
+
+def _basic(user, password):
+    return {'Authorization': 'Basic ' + base64.b64encode(f'{user}:{password}'.encode()).decode()}
+
+
+def test_verified_credentials_skip_pbkdf2(checks):
+    client, checked = checks
+    assert client.get('/secret', headers=AUTH).status_code == 200
+    assert client.get('/secret', headers=AUTH).status_code == 200
+    assert checked == ['pw']
+
+
+def test_wrong_credentials_are_never_cached(checks):
+    client, checked = checks
+    assert client.get('/secret').status_code == 401
+    assert client.get('/secret', headers=_basic('admin', 'nope')).status_code == 401
+    assert client.get('/secret', headers=_basic('admin', 'nope')).status_code == 401
+    assert client.get('/secret', headers=_basic('root', 'pw')).status_code == 401
+    assert checked == ['nope', 'nope']
+
+
+def test_new_password_hash_invalidates_the_cache(checks, monkeypatch):
+    client, checked = checks
+    assert client.get('/secret', headers=AUTH).status_code == 200
+    monkeypatch.setattr(auth, 'ADMIN_PASS_HASH', generate_password_hash('new', method='pbkdf2:sha256:1000'))
+    assert client.get('/secret', headers=AUTH).status_code == 401
+    assert client.get('/secret', headers=_basic('admin', 'new')).status_code == 200
+
+
+def test_expired_entries_are_verified_again(checks, monkeypatch):
+    client, checked = checks
+    monkeypatch.setattr(auth, 'ADMIN_AUTH_CACHE_TTL', 0.000001)
+    client.get('/secret', headers=AUTH)
+    client.get('/secret', headers=AUTH)
+    assert checked == ['pw', 'pw']
@@ -0,0 +1,50 @@
+# test_benchmarks.py - seed data and the benchmark runner
+import json
+import subprocess
+import sys
+
+from benchmarks.run import _percentile, compare
+from benchmarks.seed import seed
+from conftest import ROOT
+from models.database import get_connection
+
+
+def test_seed_is_deterministic(db):
+    counts = seed(db, pages=3, blocks=4, comments=30, media=5)
+    assert counts == {'pages': 3, 'blocks': 12, 'comments': 30, 'media': 5}
+    conn = get_connection(db)
+    first = conn.execute('SELECT page, content FROM pages ORDER BY id').fetchall()
+    conn.execute('DELETE FROM pages')
+    conn.commit()
+    seed(db, pages=3, blocks=4, comments=0, media=5)
+    assert conn.execute('SELECT page, content FROM pages ORDER BY id').fetchall() == first
+    assert conn.execute('SELECT COUNT(*) FROM media_refs').fetchone()[0] > 0
+
+
+def test_compare_reports_regressions():
+    old = {'routes': {'home': {'p95_ms': 1.0, 'statements_per_request': 1.0},
+                      'gone': {'p95_ms': 1.0, 'statements_per_request': 1.0}}}
+    new = {'routes': {'home': {'p95_ms': 1.2, 'statements_per_request': 1.4}}}
+    assert compare(new, old, 0.25) == ['gone: missing in this run']
+    new['routes']['home'] = {'p95_ms': 1.3, 'statements_per_request': 1.5}
+    assert compare(new, old, 0.25)[:2] == ['home: p95 1.0 -> 1.3 ms', 'home: statements/request 1.0 -> 1.5']
+    assert _percentile([1, 2, 3, 4], 50) == 2 and _percentile([], 99) == 0.0
+
+
+def test_every_route_has_a_working_scenario(tmp_path):
+    out = tmp_path / 'bench.json'
+    args = [sys.executable, '-m', 'benchmarks.run', '--pages', '3', '--blocks', '2', '--comments', '20',
+            '--media', '3', '--requests', '2', '--warmup', '1']
+    subprocess.run(args + ['--workdir', str(tmp_path / 'run1'), '--out', str(out)], cwd=ROOT, check=True,
+                   capture_output=True)
+    result = json.loads(out.read_text())
+    assert result['uncovered_routes'] == []
+    assert all(int(code) < 400 for r in result['routes'].values() for code in r['status'])
+
+    for r in result['routes'].values():
+        r['statements_per_request'] -= 1
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(result))
+    run = subprocess.run(args + ['--workdir', str(tmp_path / 'run2'), '--out', str(tmp_path / 'again.json'),
+                                 '--baseline', str(baseline)], cwd=ROOT, capture_output=True, text=True)
+    assert run.returncode == 1 and 'statements/request' in run.stdout + run.stderr
@@ -0,0 +1,67 @@
+# test_comment_writer.py - write-behind batching of comment inserts
+import threading
+
+from models.comment_model import CommentModel
+from services import comment_service
+from services.comment_service import CommentService
+from services.comment_writer import CommentWriter
+
+
+class _Model:
+    """Records add_many batches; `gate` holds the writer thread inside the first one."""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def add_many(self, comments):
+        self.gate.wait(5)
+        self.batches.append(list(comments))
+        return len(comments)
+
+
+def _comment(i):
+    return ('127.0.0.1', 'ann', f'c{i}', 'home', 'en')
+
+
+def test_queued_comments_are_written_in_batches():
+    model = _Model()
+    model.gate.clear()
+    writer = CommentWriter(model, max_size=100, flush_ms=1000, batch_size=3)
+    assert writer.put(_comment(0))
+    # add_many is held until everything is queued
+    for i in range(1, 8):
+        assert writer.put(_comment(i))
+    model.gate.set()
+    writer.close()
+    assert writer.depth() == 0
+    assert [c for batch in model.batches for c in batch] == [_comment(i) for i in range(8)]
+    assert max(len(batch) for batch in model.batches) == 3
+    assert not writer.put(_comment(8))
+
+
+def test_full_queue_refuses_comments():
+    model = _Model()
+    model.gate.clear()
+    writer = CommentWriter(model, max_size=1, flush_ms=1, batch_size=1)
+    writer.put(_comment(0))
+    while writer.depth():
+        pass  # taken by the writer thread, which is stuck in add_many
+    assert writer.put(_comment(1))
+    assert not writer.put(_comment(2))
+    model.gate.set()
+    writer.close()
+    assert model.batches == [[_comment(0)], [_comment(1)]]
+
+
+def test_service_falls_back_to_direct_insert(db, monkeypatch):
+    monkeypatch.setattr(comment_service, 'COMMENT_QUEUE_SIZE', 1)
+    service = CommentService(write_behind=True)
+    assert service.add('127.0.0.1', 'ann', 'queued') == (True, None)
+    service.close()
+    assert [c['comment'] for c in CommentModel(db).get_all()] == ['queued']
+    # closed writer refuses the comment, it's inserted right away
+    ok, comment_id = service.add('127.0.0.1', 'ann', 'direct')
+    assert ok and comment_id is not None
+    assert service.add('127.0.0.1', ' ', 'x') == (False, 'USER_CANT_BE_EMPTY')
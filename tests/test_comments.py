@@ -0,0 +1,74 @@
+# test_comments.py - keyset paging of comments, the NDJSON export, comments per page
+import json
+
+from conftest import AUTH
+from models.comment_model import COMMENTS_MAX_LIMIT, CommentModel
+from models.database import get_connection
+
+
+def _add(db, count, page='home', locale='en'):
+    return [CommentModel(db).add('127.0.0.1', 'ann', f'{page}-{i}', page, locale) for i in range(count)]
+
+
+def test_pages_follow_the_cursor(db):
+    ids = _add(db, 7)
+    model = CommentModel(db)
+    seen, before = [], None
+    while True:
+        rows = model.get_latest(limit=3, before=before)
+        if not rows:
+            break
+        seen += [r['id'] for r in rows]
+        before = rows[-1]['id']
+    assert seen == ids[::-1]
+
+
+def test_deleted_cursor_comment_does_not_end_paging(db):
+    ids = _add(db, 5)
+    model = CommentModel(db)
+    first = model.get_latest(limit=2)
+    assert [r['id'] for r in first] == [ids[4], ids[3]]
+    with get_connection(db) as conn:
+        conn.execute('DELETE FROM comments WHERE id = ?', (ids[3],))
+    assert [r['id'] for r in model.get_latest(limit=2, before=ids[3])] == [ids[2], ids[1]]
+
+
+def test_limit_is_clamped(db):
+    _add(db, 3)
+    assert len(CommentModel(db).get_latest(limit=0)) == 1
+    assert len(CommentModel(db).get_latest(limit=COMMENTS_MAX_LIMIT + 1)) == 3
+
+
+def test_get_comments_route_pages_and_exports(client):
+    ids = _add('qcms.db', 3)
+    body = client.get('/get_comments?limit=2').json
+    assert [c['id'] for c in body['comments']] == [ids[2], ids[1]]
+    body = client.get(f"/get_comments?limit=2&before={body['next_before']}").json
+    assert [c['id'] for c in body['comments']] == [ids[0]]
+    assert client.get(f'/get_comments?before={ids[0]}').json == {'comments': [], 'next_before': None}
+
+    r = client.get('/get_comments?format=ndjson')
+    assert r.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in r.get_data(as_text=True).splitlines()] == ids
+
+
+def test_iter_all_reads_in_batches(db):
+    ids = _add(db, 5)
+    assert [c['id'] for c in CommentModel(db).iter_all(batch_size=2)] == ids
+
+
+
+def test_comments_belong_to_their_page(site):
+    site.post('/add_page', headers=AUTH, data={
+        'page': 'about', 'position': '1', 'page_order': '0', 'content': '<p>About us</p>'})
+    r = site.post('/add_comment', data={'user': 'ann', 'comment': 'about-comment', 'page': 'about', 'locale': 'en'})
+    assert r.status_code == 302 and '/page/about' in r.location
+    site.post('/add_comment', data={'user': 'bob', 'comment': 'home-comment'})
+    about, home = site.get('/page/about').data, site.get('/').data
+    assert b'about-comment' in about and b'home-comment' not in about
+    assert b'home-comment' in home and b'about-comment' not in home
+
+    comments = site.get('/get_comments?page=about&locale=en').json['comments']
+    assert [c['comment'] for c in comments] == ['about-comment']
+    assert site.get('/get_comments?page=about&locale=pl').json['comments'] == []
+    assert len(site.get('/get_comments').json['comments']) == 2
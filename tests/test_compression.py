@@ -0,0 +1,65 @@
+# test_compression.py - gzip of responses and precompressed static files
+import gzip
+import os
+
+from flask import Flask, Response
+
+from services.compression import Compression, gzip_bytes, precompress_file
+
+BIG = 'compress me ' * 200
+GZ = {'Accept-Encoding': 'gzip'}
+
+
+def test_gzip_bytes_is_stable():
+    assert gzip_bytes(b'x' * 100) == gzip_bytes(b'x' * 100)
+    assert gzip.decompress(gzip_bytes(b'abc')) == b'abc'
+
+
+def test_precompress_file(tmp_path):
+    path = tmp_path / 'site.css'
+    path.write_text(BIG)
+    os.chmod(path, 0o644)
+    assert precompress_file(str(path), min_size=10000) is None
+    gz = precompress_file(str(path), min_size=100)
+    assert gzip.decompress(open(gz, 'rb').read()).decode() == BIG
+    assert os.stat(gz).st_mode & 0o777 == 0o644
+    assert sorted(os.listdir(tmp_path)) == ['site.css', 'site.css.gz']
+    # up to date: not written again
+    os.utime(gz, (1, 1))
+    os.utime(path, (0, 0))
+    precompress_file(str(path), min_size=100)
+    assert os.stat(gz).st_mtime == 1
+
+
+def _app(tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'site.css').write_text(BIG)
+    app = Flask(__name__, static_folder=str(static))
+    app.add_url_rule('/big', 'big', lambda: BIG)
+    app.add_url_rule('/small', 'small', lambda: 'small')
+    app.add_url_rule('/stream', 'stream', lambda: Response(iter([BIG]), mimetype='text/plain'))
+    compression = Compression(min_size=100)
+    compression.install(app)
+    return app.test_client(), compression
+
+
+def test_responses_are_gzipped_once(tmp_path):
+    client, compression = _app(tmp_path)
+    r = client.get('/big', headers=GZ)
+    assert r.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in r.headers['Vary']
+    assert gzip.decompress(r.data).decode() == BIG
+    client.get('/big', headers=GZ)
+    assert compression.stats()['hits'] == 1
+    assert 'Content-Encoding' not in client.get('/big').headers
+    assert 'Content-Encoding' not in client.get('/small', headers=GZ).headers
+    assert 'Content-Encoding' not in client.get('/stream', headers=GZ).headers
+
+
+def test_static_files_come_from_the_gz(tmp_path):
+    client, _ = _app(tmp_path)
+    r = client.get('/static/site.css', headers=GZ)
+    assert r.headers['Content-Encoding'] == 'gzip' and gzip.decompress(r.data).decode() == BIG
+    assert (tmp_path / 'static' / 'site.css.gz').exists()
+    r = client.get('/static/site.css')
+    assert 'Content-Encoding' not in r.headers and r.get_data(as_text=True) == BIG
@@ -0,0 +1,42 @@
+# test_database.py - shared per-thread connections
+import threading
+
+from models.database import DB_BUSY_TIMEOUT, get_connection, notify_write, on_write
+
+
+def test_connection_is_reused_per_thread(db):
+    assert get_connection(db) is get_connection(db)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_connection(db)))
+    thread.start()
+    thread.join()
+    assert other[0] is not get_connection(db)
+
+
+def test_connection_is_tuned(db):
+    conn = get_connection(db)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == DB_BUSY_TIMEOUT
+
+
+def test_with_block_commits_and_rolls_back(db):
+    conn = get_connection(db)
+    with conn:
+        conn.execute("INSERT INTO params(name, value) VALUES('t1', 'x')")
+    try:
+        with conn:
+            conn.execute("INSERT INTO params(name, value) VALUES('t2', 'x')")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    names = {r[0] for r in conn.execute("SELECT name FROM params WHERE name IN ('t1', 't2')")}
+    assert names == {'t1'}
+    assert not conn.in_transaction
+
+
+def test_write_listeners_get_the_table(db):
+    seen = []
+    on_write(seen.append)
+    notify_write('comments')
+    assert seen == ['comments']
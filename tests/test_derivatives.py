@@ -0,0 +1,95 @@
+# test_derivatives.py - responsive image variants and the worker pool around them
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+from models.media_model import MediaModel
+from services import derivative_service
+from services.derivative_service import DerivativeService, render_derivatives
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def photo(db):
+    """800x400 PNG stored like an upload: (media_id, sha256, rel_path)."""
+    rel_path = 'uploads/t/abc_photo.png'
+    path = Path('static') / rel_path
+    path.parent.mkdir(parents=True)
+    Image.new('RGB', (800, 400), 'red').save(path)
+    return MediaModel(db).insert('abc', rel_path, 'image/png'), 'abc', rel_path
+
+
+def test_variants_are_written_for_smaller_widths(photo):
+    _, _, rel_path = photo
+    variants = render_derivatives(str(Path('static') / rel_path), (320, 640, 1280))
+    assert [(v['width'], v['format']) for v in variants] == [
+        (320, 'png'), (320, 'webp'), (640, 'png'), (640, 'webp')]
+    with Image.open(Path('static') / variants[0]['rel_path']) as img:
+        assert img.size == (320, 160)
+    assert not list(Path('static/uploads/t').glob('.*.part'))
+
+
+def test_shortcode_becomes_picture_with_srcset(photo):
+    media_id, sha256, rel_path = photo
+    service = DerivativeService()
+    plain = service.expand_shortcodes([f'<p>[[image:{rel_path}|a "red" one]]</p>'])
+    assert plain == [f'<p><img src="/media/{rel_path}" alt="a &#34;red&#34; one" loading="lazy"></p>']
+
+    service.media_model.add_derivatives(media_id, sha256, render_derivatives(str(Path('static') / rel_path), (320,)))
+    html = service.expand_shortcodes([f'[[image:{rel_path}]]'])[0]
+    assert html.startswith('<picture><source type="image/webp" srcset="/media/uploads/t/abc_photo-320w.webp 320w"')
+    assert 'srcset="/media/uploads/t/abc_photo-320w.png 320w"' in html
+    assert service.expand_shortcodes(['no images']) == ['no images']
+
+
+class _Pool:
+    """ProcessPoolExecutor stand-in: renders in-process, or fails like a pool whose worker was killed."""
+    created = []
+
+    def __init__(self, broken=False, **kwargs):
+        self.broken = broken
+        self.stopped = False
+        _Pool.created.append(self)
+
+    def submit(self, fn, *args):
+        if self.broken:
+            raise BrokenProcessPool('worker died')
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.stopped = True
+
+
+def test_broken_pool_is_replaced(photo, monkeypatch):
+    media_id, sha256, rel_path = photo
+    monkeypatch.setattr(derivative_service, 'DERIVATIVE_WORKERS', 1)
+    monkeypatch.setattr(derivative_service, 'ProcessPoolExecutor',
+                        lambda **kwargs: _Pool(broken=not _Pool.created, **kwargs))
+    _Pool.created = []
+    service = DerivativeService()
+    assert not service.schedule(media_id, sha256, rel_path)
+    assert _Pool.created[0].stopped and service._executor is None and not service._pending
+    assert service.schedule(media_id, sha256, rel_path)
+    assert len(_Pool.created) == 2 and service.media_model.has_derivatives(sha256)
+    # variants exist now, nothing more to do
+    assert not service.schedule(media_id, sha256, rel_path)
+
+
+def test_variants_are_made_by_worker_processes(photo, monkeypatch):
+    media_id, sha256, rel_path = photo
+    monkeypatch.setattr(derivative_service, 'DERIVATIVE_WORKERS', 1)
+    service = DerivativeService()
+    try:
+        assert service.schedule(media_id, sha256, rel_path)
+        deadline = time.monotonic() + 60
+        while service._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        service.shutdown()
+    assert service.media_model.has_derivatives(sha256)
@@ -0,0 +1,41 @@
+# test_fragment_cache.py - page fragments keyed by the write versions of their tables
+from services.fragment_cache import FragmentCache
+from services.registry import get_registry
+
+
+def test_write_only_moves_keys_of_its_fragments():
+    cache = FragmentCache()
+    menu, comments = cache.key('menu', 'en'), cache.key('comments', 'home', 'en')
+    cache.put(menu, '<nav>')
+    cache.put(comments, '<ul>')
+    cache.on_write('comments')
+    assert cache.key('menu', 'en') == menu and cache.get(cache.key('menu', 'en')) == '<nav>'
+    assert cache.key('comments', 'home', 'en') != comments
+    assert cache.get(cache.key('comments', 'home', 'en')) is None
+
+
+def test_render_during_a_write_is_never_served():
+    cache = FragmentCache()
+    key = cache.key('blocks', 'home', 'en')  # taken before the data is loaded
+    cache.on_write('media_derivatives')
+    cache.put(key, '<p>stale</p>')
+    assert cache.get(cache.key('blocks', 'home', 'en')) is None
+
+
+def test_invalidate_drops_everything():
+    cache = FragmentCache()
+    keys = [cache.key(name) for name in ('menu', 'blocks', 'comments', 'footer')]
+    for key in keys:
+        cache.put(key, 'x')
+    cache.invalidate()
+    assert all(cache.get(key) is None for key in keys)
+    assert all(cache.key(name) not in keys for name in ('menu', 'blocks', 'comments', 'footer'))
+
+
+def test_comment_rerenders_only_the_comments(site):
+    fragments = get_registry().page_service.fragment_cache
+    site.get('/')
+    site.post('/add_comment', data={'user': 'ann', 'comment': 'fresh'})
+    hits, misses = fragments.stats()['hits'], fragments.stats()['misses']
+    assert b'fresh' in site.get('/').data
+    assert fragments.stats()['hits'] - hits == 3 and fragments.stats()['misses'] - misses == 1
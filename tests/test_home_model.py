@@ -0,0 +1,37 @@
+# test_home_model.py - in-memory params snapshot
+import sqlite3
+
+from models import home_model
+from models.home_model import HomeModel
+
+
+def test_set_param_is_visible_at_once(db):
+    home = HomeModel(db)
+    home.set_param('title', 'One')
+    assert home.get_param('title') == 'One'
+    home.set_param('title', 'Two')
+    assert HomeModel(db).get_param('title') == 'Two'
+
+
+def test_snapshot_runs_no_sql_between_rechecks(db, monkeypatch):
+    home = HomeModel(db)
+    home.set_param('title', 'One')
+
+    def no_sql(db_name):
+        raise AssertionError('params read from the db')
+
+    monkeypatch.setattr(home_model, 'get_connection', no_sql)
+    assert home.get_param('title') == 'One'
+    assert home.get_params()['version'] == home_model.VERSION
+
+
+def test_writes_of_other_connections_are_picked_up(db, monkeypatch):
+    monkeypatch.setattr(home_model, 'PARAMS_RECHECK', 0)
+    home = HomeModel(db)
+    home.set_param('title', 'One')
+    assert home.get_param('title') == 'One'
+    other = sqlite3.connect(db)
+    with other:
+        other.execute("UPDATE params SET value = 'Elsewhere' WHERE name = 'title'")
+    other.close()
+    assert home.get_param('title') == 'Elsewhere'
@@ -0,0 +1,80 @@
+# test_io_executor.py - async views on the I/O pool and the ASGI entry point
+import asyncio
+import threading
+
+import pytest
+from flask import Flask, request
+
+from conftest import ROOT
+from controllers import app_controller
+from services import io_executor
+from services.io_executor import offload, run_io
+
+pytest.importorskip('asgiref')
+
+
+def test_run_io_keeps_the_request_context():
+    app = Flask(__name__)
+
+    def blocking():
+        return threading.current_thread().name, request.args['q']
+
+    async def view():
+        return await run_io(blocking)
+
+    with app.test_request_context('/?q=x'):
+        thread, q = asyncio.run(view())
+    assert thread.startswith('qcms-io') and q == 'x'
+
+
+def test_offload_only_changes_views_in_async_mode(monkeypatch):
+    def view():
+        return 'ok'
+
+    assert offload(view) is view
+    monkeypatch.setattr(io_executor, 'ASYNC_MODE', True)
+    assert asyncio.iscoroutinefunction(offload(view))
+    assert asyncio.run(offload(view)()) == 'ok'
+
+
+def test_app_in_async_mode(db, monkeypatch):
+    monkeypatch.setattr(io_executor, 'ASYNC_MODE', True)
+    monkeypatch.setattr(app_controller, 'ASYNC_MODE', True)
+    flask_app = Flask('app', root_path=ROOT)
+    app_controller.AppController(flask_app)
+    assert asyncio.iscoroutinefunction(flask_app.view_functions['get_comments'])
+    client = flask_app.test_client()
+    client.post('/add_comment', data={'user': 'ann', 'comment': 'async'})
+    assert client.get('/get_comments').json['comments'][0]['comment'] == 'async'
+
+
+def test_asgi_requests_run_concurrently(db):
+    from asgi import QcmsAsgi
+    # both requests must be inside the app at once to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wsgi(environ, start_response):
+        barrier.wait()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    asgi = QcmsAsgi(wsgi)
+
+    async def call():
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': [],
+                 'http_version': '1.1', 'scheme': 'http', 'server': ('test', 80), 'root_path': ''}
+        await asgi(scope, receive, send)
+        return sent[0]['status']
+
+    async def both():
+        return await asyncio.gather(call(), call())
+
+    assert asyncio.run(both()) == [200, 200]
@@ -0,0 +1,133 @@
+# test_media.py - uploads: storage, deduplication, serving, references and clean-up
+import base64
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+
+from werkzeug.datastructures import FileStorage
+
+from conftest import AUTH
+from models.database import get_connection
+from models.page_model import PageModel, media_refs
+from services import media_service
+from services.media_service import MediaService
+
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+SHA = hashlib.sha256(PNG).hexdigest()
+
+
+def _save(service, data=PNG, name='pixel'):
+    return service.save_upload(FileStorage(io.BytesIO(data), f'{name}.png'), name, '.png', 'uploads/t')
+
+
+def test_upload_is_stored_under_its_hash(db):
+    result, error = _save(MediaService())
+    assert error is None and not result['deduplicated']
+    assert result['rel_path'] == f'uploads/t/{SHA[:12]}_pixel.png' and result['sha256'] == SHA
+    assert (Path('static') / result['rel_path']).read_bytes() == PNG
+    assert not list(Path('static/uploads/t').glob('*.part'))
+
+
+def test_same_content_is_stored_once(db):
+    service = MediaService()
+    first, _ = _save(service)
+    second, _ = _save(service, name='copy')
+    assert second['deduplicated'] and second['rel_path'] == first['rel_path']
+    assert [p.name for p in Path('static/uploads/t').iterdir()] == [Path(first['rel_path']).name]
+
+
+def test_too_large_upload_leaves_nothing_behind(db, monkeypatch):
+    monkeypatch.setattr(media_service, 'MAX_UPLOAD_BYTES', len(PNG) - 1)
+    result, error = _save(MediaService())
+    assert result is None and error == 'File too large.'
+    assert not list(Path('static/uploads/t').iterdir())
+
+
+def test_request_over_max_content_length_is_refused(app, client):
+    assert app.config['MAX_CONTENT_LENGTH'] > media_service.MAX_UPLOAD_BYTES
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    r = client.post('/upload_media', headers=AUTH, content_type='multipart/form-data',
+                    data={'file': (io.BytesIO(b'x' * 4096), 'big.png')})
+    assert r.status_code == 413
+
+
+def test_media_route_is_cacheable(client):
+    result, _ = _save(MediaService())
+    r = client.get(f"/media/{result['rel_path']}")
+    assert r.status_code == 200 and r.data == PNG and r.mimetype == 'image/png'
+    assert r.headers['ETag'] == f'"{SHA}"'
+    assert 'immutable' in r.headers['Cache-Control'] and 'public' in r.headers['Cache-Control']
+    assert client.get(f"/media/{result['rel_path']}", headers={'If-None-Match': f'"{SHA}"'}).status_code == 304
+    r = client.get(f'/media/sha256/{SHA}', headers={'Range': 'bytes=0-3'})
+    assert r.status_code == 206 and r.data == PNG[:4]
+
+
+def test_only_known_uploads_are_served(client):
+    assert client.get('/media/sha256/' + '0' * 64).status_code == 404
+    # a file under static/ without its media row isn't an upload
+    Path('static/uploads').mkdir(parents=True)
+    Path('static/uploads/loose.png').write_bytes(PNG)
+    assert client.get('/media/uploads/loose.png').status_code == 404
+
+
+def _upload(data, name):
+    """Upload of data plus one (fake) variant file and row: (upload, variant rel_path)."""
+    service = MediaService()
+    result, _ = _save(service, data, name)
+    variant = result['rel_path'].replace('.png', '-320w.webp')
+    (Path('static') / variant).write_bytes(b'variant')
+    media = service.get_by_hash(result['sha256'])
+    service.media_model.add_derivatives(media['id'], result['sha256'], [
+        {'width': 320, 'format': 'webp', 'rel_path': variant, 'mime': 'image/webp'}])
+    return result, variant
+
+
+def _age(hours):
+    with get_connection('qcms.db') as conn:
+        conn.execute("UPDATE media SET uploaded_at = datetime('now', ?)", (f'-{hours} hours',))
+
+
+def test_media_refs_of_content():
+    assert media_refs('<p>[[image:uploads/a.png|alt]] <a href="/media/uploads/b.pdf">b</a> '
+                      '<img src="/static/uploads/c%20d.png"> <img src="/static/css/x.png"> '
+                      '<a href="/media/uploads/e&amp;f.png?x=1">e</a></p>') == {
+        'uploads/a.png', 'uploads/b.pdf', 'uploads/c%20d.png', 'uploads/e&f.png'}
+    assert media_refs('<p>no uploads</p>') == set()
+
+
+def test_used_upload_is_not_deleted(db):
+    upload, variant = _upload(PNG, 'used')
+    pages = PageModel(db)
+    block = pages.add('about', 'en', 1, 0, f'<p>[[image:{upload["rel_path"]}]]</p>')
+    service = MediaService()
+    assert service.delete(upload['url']) == f'{upload["rel_path"]} is used by: about'
+    # a link to one of its variants keeps the upload too
+    pages.update_block(block, 1, f'<img src="/media/{variant}">')
+    assert service.delete(upload['rel_path']) == f'{upload["rel_path"]} is used by: about'
+    assert service.recent()[0]['refs'] == 1
+
+    pages.update_block(block, 1, '<p>no image</p>')
+    assert service.delete(upload['rel_path']) is None
+    assert not (Path('static') / upload['rel_path']).exists() and not (Path('static') / variant).exists()
+    assert service.media_model.get_by_path(upload['rel_path']) is None
+
+
+def test_gc_removes_unused_uploads_and_stray_files(db):
+    used, used_variant = _upload(PNG, 'used')
+    unused, unused_variant = _upload(b'other bytes', 'unused')
+    PageModel(db).add('home', 'en', 1, 0, f'<img src="/media/{used_variant}">')
+    Path('static/uploads/t/stray.png').write_bytes(b'x')
+    Path('static/uploads/t/.upload-123.part').write_bytes(b'x')
+    service = MediaService()
+    assert service.gc(min_age_hours=1) == {'rows': 0, 'files': 0, 'bytes': 0}  # all of it is new
+
+    _age(2)
+    for path in Path('static/uploads/t').iterdir():
+        os.utime(path, (time.time() - 7200,) * 2)
+    counts = service.gc(batch=1, min_age_hours=1)
+    assert counts['rows'] == 1 and counts['files'] == 4
+    left = sorted(p.name for p in Path('static/uploads/t').iterdir())
+    assert left == sorted([Path(used['rel_path']).name, Path(used_variant).name])
+    assert service.media_model.get_by_path(unused['rel_path']) is None
@@ -0,0 +1,73 @@
+# test_metrics.py - Server-Timing, per-route histograms and the per-request query log
+import logging
+import sqlite3
+
+import pytest
+from flask import Flask, render_template_string
+
+from conftest import AUTH, ROOT
+from controllers import app_controller
+from models import database, query_log
+from models.query_log import TimedConnection
+from services.metrics import Metrics
+
+
+def test_query_log_collects_statements_of_its_context():
+    conn = sqlite3.connect(':memory:', factory=TimedConnection)
+    conn.execute('CREATE TABLE t(x)')
+    token = query_log.start()
+    conn.executemany('INSERT INTO t VALUES(?)', [(1,), (2,), (3,)])
+    conn.execute('SELECT x FROM t').fetchall()
+    queries = query_log.stop(token)
+    assert [(q.sql, q.rows) for q in queries] == [('INSERT INTO t VALUES(?)', 3), ('SELECT x FROM t', 3)]
+    conn.execute('SELECT x FROM t').fetchall()  # nobody collects
+    assert query_log.stop(query_log.start()) == []
+
+
+def test_requests_get_server_timing_and_slow_queries_are_logged(caplog):
+    app = Flask(__name__)
+    metrics = Metrics(slow_query_ms=0)
+    metrics.install(app)
+    conn = sqlite3.connect(':memory:', factory=TimedConnection, check_same_thread=False)
+
+    @app.route('/q/<int:n>')
+    def q(n):
+        for _ in range(n):
+            conn.execute('SELECT 1').fetchone()
+        return render_template_string('{{ n }}', n=n)
+
+    with caplog.at_level(logging.WARNING, 'qcms.slow_query'):
+        r = app.test_client().get('/q/3')
+    assert r.headers['Server-Timing'].startswith('db;dur=') and 'desc="3 queries"' in r.headers['Server-Timing']
+    assert 'template;dur=' in r.headers['Server-Timing'] and 'total;dur=' in r.headers['Server-Timing']
+    assert len([rec for rec in caplog.records if 'GET /q/<int:n>: SELECT 1' in rec.getMessage()]) == 3
+
+    with app.app_context():
+        render_template_string('outside a request')
+    app.test_client().get('/q/1')
+    snapshot = metrics.snapshot()
+    route = snapshot['routes']['GET /q/<int:n>']
+    assert route['count'] == 2 and route['queries_per_request'] == 2.0
+    assert sum(route['histogram_ms'].values()) == 2
+    assert snapshot['queries'][0]['sql'] == 'SELECT 1' and snapshot['queries'][0]['count'] == 4
+
+
+@pytest.fixture
+def metered_client(db, monkeypatch):
+    """App with QCMS_METRICS=1: connections opened from now on are timed."""
+    monkeypatch.setattr(app_controller, 'METRICS', True)
+    monkeypatch.setattr(database, 'DB_QUERY_LOG', True)
+    for conn in database._local.conns.values():
+        conn.close()
+    database._local.conns = {}
+    flask_app = Flask('app', root_path=ROOT)
+    app_controller.AppController(flask_app)
+    return flask_app.test_client()
+
+
+def test_admin_metrics_lists_routes(metered_client):
+    metered_client.get('/pages_list')
+    assert 'queries' in metered_client.get('/pages_list').headers['Server-Timing']
+    data = metered_client.get('/admin/metrics', headers=AUTH).json
+    assert data['enabled'] and data['routes']['GET /pages_list']['count'] == 2
+    assert any('page_catalog' in q['sql'] for q in data['queries'])
@@ -0,0 +1,66 @@
+# test_migrations.py - numbered schema migrations and the service registry
+import sqlite3
+
+from models import migrations
+from models.comment_model import CommentModel
+from models.home_model import VERSION, HomeModel
+from models.migrations import LATEST, migrate
+from models.page_model import PageModel
+from services.registry import get_registry
+
+
+def _schema(db):
+    conn = sqlite3.connect(db)
+    try:
+        return sorted(conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+    finally:
+        conn.close()
+
+
+def test_fresh_database_gets_latest_schema(db):
+    conn = sqlite3.connect(db)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST
+    conn.close()
+    assert HomeModel(db).get_param('version') == VERSION
+    schema = _schema(db)
+    migrations._migrated.clear()
+    assert migrate(db) == LATEST
+    assert _schema(db) == schema
+
+
+def test_database_from_before_the_runner_is_upgraded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    migrations._migrated.clear()
+    conn = sqlite3.connect('legacy.db')
+    conn.executescript("""
+        CREATE TABLE params(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, value TEXT);
+        INSERT INTO params(name, value) VALUES('version', '0.1.0'), ('title', 'Old site');
+        CREATE TABLE pages(id INTEGER PRIMARY KEY AUTOINCREMENT, page TEXT NOT NULL, page_order INTEGER NOT NULL,
+                           locale TEXT NOT NULL DEFAULT 'pl', content TEXT NOT NULL,
+                           position INTEGER NOT NULL DEFAULT 0, UNIQUE(page, locale, position));
+        INSERT INTO pages(page, page_order, locale, content, position)
+        VALUES('home', 0, 'en', '<p>old words [[image:uploads/a.png]]</p>', 1);
+        CREATE TABLE comments(id INTEGER PRIMARY KEY AUTOINCREMENT, ip TEXT NOT NULL,
+                              creation_date TEXT DEFAULT CURRENT_TIMESTAMP, user TEXT, comment TEXT NOT NULL);
+        INSERT INTO comments(ip, user, comment) VALUES('127.0.0.1', 'ann', 'old comment');
+    """)
+    conn.close()
+
+    assert migrate('legacy.db') == LATEST
+    assert HomeModel('legacy.db').get_param('version') == VERSION
+    assert HomeModel('legacy.db').get_param('title') == 'Old site'
+    pages = PageModel('legacy.db')
+    assert pages.get_pages_list() == ['home']
+    assert [r['page'] for r in pages.search('old', 'en')] == ['home']
+    comment = CommentModel('legacy.db').get_all()[0]
+    assert (comment['comment'], comment['page'], comment['locale']) == ('old comment', 'home', 'en')
+    conn = sqlite3.connect('legacy.db')
+    assert conn.execute('SELECT rel_path FROM media_refs').fetchall() == [('uploads/a.png',)]
+    conn.close()
+
+
+def test_registry_shares_one_instance_of_every_service(db):
+    registry = get_registry()
+    assert get_registry() is registry
+    assert registry.page_service.comment_service is registry.comment_service
+    assert registry.page_service.media_service is registry.media_service
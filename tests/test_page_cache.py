@@ -0,0 +1,46 @@
+# test_page_cache.py - rendered page cache and its invalidation
+import sqlite3
+
+from services import page_service
+from services.page_cache import PageCache
+from services.registry import get_registry
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PageCache(max_size=2)
+    cache.put('a', 'A', cache.generation)
+    cache.put('b', 'B', cache.generation)
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C', cache.generation)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_put_of_page_rendered_before_clear_is_dropped():
+    cache = PageCache()
+    generation = cache.generation
+    cache.clear()
+    cache.put('a', 'stale', generation)
+    assert cache.get('a') is None
+
+
+def test_page_is_served_from_cache_until_a_write(site):
+    cache = get_registry().page_service.page_cache
+    assert b'Hello home' in site.get('/').data
+    hits = cache.hits
+    site.get('/')
+    assert cache.hits == hits + 1
+    site.post('/add_comment', data={'user': 'ann', 'comment': 'first!'})
+    assert b'first!' in site.get('/').data
+
+
+def test_writes_of_another_process_are_seen(site, monkeypatch):
+    monkeypatch.setattr(page_service, 'PAGE_CACHE_RECHECK', 0)
+    site.get('/')
+    # a plain connection never calls notify_write, like a writer in another worker
+    other = sqlite3.connect('qcms.db')
+    with other:
+        other.execute("UPDATE pages SET content = '<p>Changed elsewhere</p>'")
+    other.close()
+    assert b'Changed elsewhere' in site.get('/').data
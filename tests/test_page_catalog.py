@@ -0,0 +1,31 @@
+# test_page_catalog.py - page_catalog kept in sync with pages by triggers
+from models.page_model import PageModel
+
+
+def _catalog(pages):
+    return [(r['page'], r['page_order'], sorted(r['locales']), r['block_count'])
+            for r in pages.get_page_catalog()]
+
+
+def test_catalog_follows_blocks(db):
+    pages = PageModel(db)
+    pages.add('home', 'en', 1, 0, '<p>a</p>')
+    pages.add('home', 'pl', 1, 0, '<p>b</p>')
+    about = pages.add('about', 'en', 1, 0, '<p>c</p>')
+    assert _catalog(pages) == [('home', 0, ['en', 'pl'], 2), ('about', 1, ['en'], 1)]
+    assert pages.get_pages_list() == ['home', 'about']
+
+    pages.add('about', 'en', 2, 0, '<p>d</p>')
+    assert _catalog(pages)[1] == ('about', 1, ['en'], 2)
+    pages.delete(about)
+    assert _catalog(pages)[1] == ('about', 1, ['en'], 1)
+    pages.delete_by_name('about')
+    assert pages.get_pages_list() == ['home']
+
+
+def test_new_page_gets_next_order(db):
+    pages = PageModel(db)
+    pages.add('contact', 'en', 1, 5, '<p>x</p>')
+    pages.add('news', 'en', 1, 0, '<p>y</p>')
+    assert pages.get_pages_list() == ['contact', 'news']
+    assert _catalog(pages)[1][1] == 6
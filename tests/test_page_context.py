@@ -0,0 +1,39 @@
+# test_page_context.py - template context loaded in one read transaction
+from models.comment_model import COMMENTS_WINDOW, CommentModel
+from models.database import get_connection
+from models.home_model import HomeModel
+from models.page_context import PageContext
+from models.page_model import PageModel
+
+
+def _fill(db):
+    home = HomeModel(db)
+    home.set_param('title', 'Site')
+    home.set_param('domain', 'example.org')
+    pages = PageModel(db)
+    pages.add('about', 'en', 2, 2, '<p>second</p>')
+    pages.add('about', 'en', 1, 2, '<p>first</p>')
+    pages.add('home', 'en', 1, 1, '<p>home</p>')
+    comments = CommentModel(db)
+    for i in range(COMMENTS_WINDOW + 2):
+        comments.add('127.0.0.1', 'ann', f'c{i}', 'about', 'en')
+
+
+def test_load_returns_everything_a_page_needs(db):
+    _fill(db)
+    ctx = PageContext(db).load(page='about', locale='en')
+    assert ctx['site_title'] == 'Site' and ctx['site_domain'] == 'example.org'
+    assert ctx['pages'] == ['home', 'about']
+    assert ctx['blocks'] == ['<p>first</p>', '<p>second</p>']
+    # the latest window, oldest first
+    assert [c['comment'] for c in ctx['comments']] == [f'c{i}' for i in range(2, COMMENTS_WINDOW + 2)]
+    assert ctx['recent_media'] == []
+    assert not get_connection(db).in_transaction
+
+
+def test_load_skips_what_is_not_asked_for(db):
+    _fill(db)
+    ctx = PageContext(db).load(page='about', editable=True, comments=False, menu=False)
+    assert ctx['pages'] == [] and ctx['comments'] == []
+    assert [(b['position'], b['content']) for b in ctx['blocks']] == [(1, '<p>first</p>'), (2, '<p>second</p>')]
+    assert PageContext(db).load(page='about', blocks=False)['blocks'] == []
@@ -0,0 +1,47 @@
+# test_rate_limiter.py - token buckets per client address and write route
+import pytest
+
+from services.rate_limiter import DEFAULT_LIMITS, RateLimiter, parse_limits
+
+
+def test_burst_then_even_refill():
+    limiter = RateLimiter({'add_comment': (2, 60)})
+    assert limiter.acquire('a', 'add_comment', now=0) == 0
+    assert limiter.acquire('a', 'add_comment', now=0) == 0
+    assert limiter.acquire('a', 'add_comment', now=0) == pytest.approx(30)
+    # other address, other bucket; routes without a limit are free
+    assert limiter.acquire('b', 'add_comment', now=0) == 0
+    assert limiter.acquire('a', 'search', now=0) == 0
+    assert limiter.acquire('a', 'add_comment', now=30) == 0
+    assert limiter.acquire('a', 'add_comment', now=30) > 0
+    assert limiter.stats()['rejected'] == 2
+
+
+def test_buckets_are_bounded():
+    limiter = RateLimiter({'add_comment': (5, 60)}, max_keys=3)
+    for i in range(10):
+        limiter.acquire(f'10.0.0.{i}', 'add_comment', now=i)
+    assert limiter.stats()['buckets'] == 3
+    # unused longer than the window: full again, forgotten
+    limiter.acquire('10.0.0.99', 'add_comment', now=1000)
+    assert limiter.stats()['buckets'] == 1
+
+
+def test_parse_limits():
+    limits = parse_limits('add_comment=3/60, upload_media=0/60,new_route=1/1')
+    assert limits['add_comment'] == (3, 60.0) and limits['new_route'] == (1, 1.0)
+    assert 'upload_media' not in limits and limits['add_page'] == DEFAULT_LIMITS['add_page']
+    with pytest.raises(ValueError, match='not <endpoint>'):
+        parse_limits('add_comment=3')
+
+
+def test_comment_flood_gets_429(client):
+    limit = DEFAULT_LIMITS['add_comment'][0]
+    for _ in range(limit):
+        assert client.post('/add_comment', data={'user': 'ann', 'comment': 'hi'}).status_code == 302
+    r = client.post('/add_comment', data={'user': 'ann', 'comment': 'hi'})
+    assert r.status_code == 429 and int(r.headers['Retry-After']) > 0
+    # another client address has its own bucket
+    r = client.post('/add_comment', data={'user': 'bob', 'comment': 'hi'},
+                    environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert r.status_code == 302
@@ -0,0 +1,59 @@
+# test_replace_blocks.py - whole block list of a page replaced in one transaction
+import pytest
+
+from conftest import AUTH
+from models.page_model import PageModel
+
+
+@pytest.fixture
+def blocks(db):
+    """PageModel and ids of blocks a, b, c of page 'about' (positions 1-3)."""
+    model = PageModel(db)
+    ids = [model.add('about', 'en', i, 1, f'<p>{name}</p>') for i, name in enumerate('abc', start=1)]
+    return model, ids
+
+
+def _contents(model):
+    return [(b['position'], b['content']) for b in model.get_blocks_for_page('about', 'en')]
+
+
+def test_reorder_edit_add_and_drop(blocks):
+    model, (a, b, c) = blocks
+    result = model.replace_blocks('about', 'en', [
+        {'id': c, 'content': '<p>c</p>'}, {'content': '<p>new</p>'}, {'id': a, 'content': '<p>a2</p>'}])
+    assert [r['id'] for r in result][::2] == [c, a] and [r['position'] for r in result] == [1, 2, 3]
+    assert _contents(model) == [(1, '<p>c</p>'), (2, '<p>new</p>'), (3, '<p>a2</p>')]
+    assert [r['page'] for r in model.search('a2', 'en')] == ['about']
+    assert model.search('b', 'en') == []
+    assert model.get_page_catalog()[0]['block_count'] == 3
+
+
+def test_swap_needs_no_free_position(blocks):
+    model, (a, b, c) = blocks
+    model.replace_blocks('about', 'en', [{'id': b, 'content': '<p>b</p>'}, {'id': a, 'content': '<p>a</p>'},
+                                         {'id': c, 'content': '<p>c</p>'}])
+    assert _contents(model) == [(1, '<p>b</p>'), (2, '<p>a</p>'), (3, '<p>c</p>')]
+
+
+def test_foreign_or_repeated_id_changes_nothing(blocks):
+    model, (a, b, c) = blocks
+    other = model.add('home', 'en', 1, 0, '<p>home</p>')
+    before = _contents(model)
+    with pytest.raises(ValueError):
+        model.replace_blocks('about', 'en', [{'id': other, 'content': 'x'}])
+    with pytest.raises(ValueError):
+        model.replace_blocks('about', 'en', [{'id': a, 'content': 'x'}, {'id': a, 'content': 'y'}])
+    assert _contents(model) == before
+
+
+def test_blocks_route(blocks, client):
+    model, (a, b, c) = blocks
+    r = client.get('/admin/page/about/blocks?locale=en', headers=AUTH)
+    assert [x['id'] for x in r.json['blocks']] == [a, b, c]
+    r = client.put('/admin/page/about/blocks', headers=AUTH,
+                   json={'locale': 'en', 'blocks': [{'id': b, 'content': '<p>only</p>'}]})
+    assert r.status_code == 200 and r.json['blocks'] == [{'id': b, 'position': 1}]
+    assert client.put('/admin/page/about/blocks', headers=AUTH, json={'blocks': [{'id': '1'}]}).status_code == 400
+    r = client.put('/admin/page/about/blocks', headers=AUTH, json={'blocks': [{'id': a, 'content': 'x'}]})
+    assert r.status_code == 400 and r.json == {'error': 'UNKNOWN_BLOCK'}
+    assert client.put('/admin/page/about/blocks', json={'blocks': []}).status_code == 401
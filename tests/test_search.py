@@ -0,0 +1,69 @@
+# test_search.py - full-text search over blocks
+import sqlite3
+
+import pytest
+
+from models.database import strip_html
+from models.page_model import PageModel
+
+
+@pytest.fixture
+def pages(db):
+    model = PageModel(db)
+    for position in range(1, 6):
+        model.add('many', 'en', position, 1, f'<p>apple pie number {position}</p>')
+    model.add('one', 'en', 1, 2, '<p>apple &amp; <b>pear</b> <script>apple()</script></p>')
+    model.add('polish', 'pl', 1, 3, '<p>apple po polsku</p>')
+    return model
+
+
+def test_one_result_per_page_before_limit(pages):
+    assert sorted(r['page'] for r in pages.search('apple', 'en')) == ['many', 'one']
+    assert len(pages.search('apple', 'en', limit=1)) == 1
+    assert [r['page'] for r in pages.search('apple', 'pl')] == ['polish']
+
+
+def test_all_words_last_as_prefix(pages):
+    assert [r['page'] for r in pages.search('apple pe', 'en')] == ['one']
+    assert pages.search('pear pie', 'en') == []
+    assert pages.search('"unbalanced AND (', 'en') == []
+    assert pages.search('   ', 'en') == []
+
+
+def test_snippet_is_escaped_and_marked(pages):
+    snippet = pages.search('pear', 'en')[0]['snippet']
+    assert '<mark>pear</mark>' in snippet and 'apple &amp; ' in snippet
+    assert '<b>' not in snippet and 'apple()' not in snippet
+
+
+def test_index_follows_block_writes(pages):
+    block = pages.get_blocks_for_page('one', 'en')[0]
+    pages.update_block(block['id'], 1, '<p>plum</p>')
+    assert [r['page'] for r in pages.search('plum', 'en')] == ['one']
+    assert pages.search('pear', 'en') == []
+    pages.delete_block_by_id(block['id'])
+    assert pages.search('plum', 'en') == []
+
+
+def test_outside_writers_need_no_sql_function(pages):
+    # an outside tool has none of our Python functions registered
+    other = sqlite3.connect('qcms.db')
+    with other:
+        other.execute("INSERT INTO pages(page, page_order, locale, content, position) "
+                      "VALUES('tool', 9, 'en', '<p>quince</p>', 1)")
+        other.execute("UPDATE pages SET content = '<p>cherry</p>' WHERE page = 'polish'")
+    other.close()
+    assert pages.search('quince', 'en') == []
+    assert pages.rebuild_search_index() == 8
+    assert [r['page'] for r in pages.search('quince', 'en')] == ['tool']
+    assert [r['page'] for r in pages.search('cherry', 'pl')] == ['polish']
+
+
+def test_strip_html():
+    assert strip_html('<p>a<style>b{}</style> &lt;c&gt; [[image:uploads/x.png|alt text]]</p>').split() == [
+        'a', '<c>', 'alt', 'text']
+
+
+def test_search_page(site):
+    r = site.get('/search?q=hello')
+    assert r.status_code == 200 and b'<mark>Hello</mark>' in r.data
@@ -0,0 +1,74 @@
+# test_static_export.py - incremental export of the public pages to files
+import io
+import os
+from pathlib import Path
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from conftest import ROOT
+from controllers.app_controller import AppController
+from models.comment_model import CommentModel
+from models.home_model import HomeModel
+from models.page_model import PageModel
+from services.media_service import MediaService
+from services.static_export_service import MANIFEST, StaticExportService
+
+
+@pytest.fixture
+def export(db, tmp_path):
+    """Site with an upload, app serving static/ of the working directory; export(full=False) -> counts."""
+    Path('static/css').mkdir(parents=True)
+    Path('static/css/site.css').write_text('body {}')
+    media, _ = MediaService().save_upload(FileStorage(io.BytesIO(b'png'), 'a.png'), 'a', '.png', 'uploads/t')
+    home = HomeModel(db)
+    home.set_param('title', 'Site')
+    home.set_param('domain', 'example.org')
+    pages = PageModel(db)
+    pages.add('home', 'en', 1, 1, f'<p>home <img src="/static/{media["rel_path"]}"></p>')
+    pages.add('about', 'en', 1, 2, '<p>about</p>')
+    app = Flask('app', root_path=ROOT, static_folder=os.path.abspath('static'))
+    controller = AppController(app)
+    service = StaticExportService(app, controller.page_service)
+    out = tmp_path / 'out'
+    return lambda full=False: service.export(str(out), full), out, media
+
+
+def test_first_export_writes_everything(export):
+    run, out, media = export
+    assert run() == {'rendered': 2, 'unchanged': 0, 'removed': 0, 'files': 2}
+    index = (out / 'index.html').read_text()
+    assert index == (out / 'page/home.html').read_text()
+    # uploads are exported under media/ only, old /static/uploads/ links point there
+    assert f'/media/{media["rel_path"]}' in index and '/static/uploads/' not in index
+    assert (out / 'media' / media['rel_path']).read_bytes() == b'png'
+    assert (out / 'static/css/site.css').read_text() == 'body {}'
+    assert not (out / 'static/uploads').exists()
+    assert (out / MANIFEST).exists()
+
+
+def test_only_changed_pages_are_rendered_again(export):
+    run, out, _ = export
+    run()
+    assert run() == {'rendered': 0, 'unchanged': 2, 'removed': 0, 'files': 0}
+    CommentModel().add('127.0.0.1', 'ann', 'new comment', 'about', 'en')
+    assert run()['rendered'] == 1
+    assert 'new comment' in (out / 'page/about.html').read_text()
+    assert run(full=True)['rendered'] == 2
+
+
+def test_deleted_page_is_removed(export):
+    run, out, media = export
+    run()
+    PageModel().delete_by_name('home')
+    # the menu changed, so the other page is rendered again too
+    assert run() == {'rendered': 1, 'unchanged': 0, 'removed': 1, 'files': 0}
+    assert not (out / 'index.html').exists() and not (out / 'page/home.html').exists()
+    assert not (out / 'media' / media['rel_path']).exists()
+
+
+def test_site_without_title_is_not_exported(app, tmp_path):
+    PageModel().add('home', 'en', 1, 1, '<p>home</p>')
+    result = app.test_cli_runner().invoke(args=['export-static', str(tmp_path / 'out')])
+    assert result.exit_code == 1 and 'no title/domain' in result.output
@@ -0,0 +1,28 @@
+# test_template_cache.py - bytecode cache, precompile and warm-up of the templates
+import os
+
+from services import template_cache
+
+
+def test_precompile_fills_the_bytecode_cache(app, tmp_path):
+    template_cache.install(app, str(tmp_path / 'bytecode'))
+    names = template_cache.precompile(app)
+    assert 'page.html' in names and all(name.endswith('.html') for name in names)
+    assert len(os.listdir(tmp_path / 'bytecode')) == len(names)
+
+
+def test_warm_up_renders_every_template(app, caplog):
+    timings = template_cache.warm_up(app)
+    assert sorted(timings) == sorted(template_cache.precompile(app))
+    assert not [r for r in caplog.records if r.name == 'qcms.templates']
+
+
+def test_no_cache_dir_keeps_templates_in_memory(app):
+    template_cache.install(app, '')
+    assert app.jinja_env.bytecode_cache is None
+
+
+def test_precompile_command(app):
+    result = app.test_cli_runner().invoke(args=['precompile-templates'])
+    assert result.exit_code == 0
+    assert result.output.startswith(f'Compiled {len(template_cache.precompile(app))} templates')
@@ -0,0 +1,94 @@
+# test_transfer.py - NDJSON export/import of the site and the uploads tar
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from conftest import _forget_state
+from models.comment_model import CommentModel
+from models.home_model import HomeModel
+from models.migrations import migrate
+from models.page_model import PageModel
+from models.transfer_model import TransferModel
+from services.media_service import MediaService
+from services.transfer_service import TransferService
+
+
+def _content(db):
+    HomeModel(db).set_param('title', 'Exported "site" – ąę')
+    media, _ = MediaService().save_upload(FileStorage(io.BytesIO(b'image bytes'), 'a.png'), 'a', '.png', 'uploads/t')
+    pages = PageModel(db)
+    pages.add('home', 'en', 1, 0, f'<p>hello [[image:{media["rel_path"]}|pic]]</p>')
+    pages.add('about', 'pl', 1, 0, '<p>o nas</p>')
+    CommentModel(db).add('127.0.0.1', 'ann', 'line\nbreak', 'about', 'pl')
+    return media
+
+
+def _records(db):
+    return [r for r in TransferModel(db).export_records() if r['type'] != 'meta']
+
+
+def _fresh(path, monkeypatch):
+    path.mkdir()
+    monkeypatch.chdir(path)
+    _forget_state()
+    migrate()
+
+
+def test_round_trip(db, tmp_path, monkeypatch):
+    media = _content(db)
+    exported = _records(db)
+    counts = TransferService().export(str(tmp_path / 'site.ndjson.gz'), str(tmp_path / 'files.tar.gz'))
+    assert counts == {'param': len([r for r in exported if r['type'] == 'param']), 'page': 2, 'comment': 1,
+                      'media': 1, 'files': 1}
+
+    _fresh(tmp_path / 'other', monkeypatch)
+    counts = TransferService().import_(str(tmp_path / 'site.ndjson.gz'), str(tmp_path / 'files.tar.gz'))
+    assert counts['page'] == 2 and counts['files'] == 1
+    assert _records('qcms.db') == exported
+    assert Path('static', media['rel_path']).read_bytes() == b'image bytes'
+    pages = PageModel()
+    assert pages.get_pages_list() == ['home', 'about']
+    assert [r['page'] for r in pages.search('hello', 'en')] == ['home']
+    assert MediaService().media_model.used_by(media['rel_path']) == ['home']
+    # triggers are back: the catalog follows new blocks again
+    pages.add('news', 'en', 1, 0, '<p>news</p>')
+    assert pages.get_pages_list()[-1] == 'news'
+
+
+def test_import_needs_an_empty_database_or_replace(db, tmp_path):
+    _content(db)
+    path = str(tmp_path / 'site.ndjson')
+    TransferService().export(path)
+    with pytest.raises(ValueError, match='already has content'):
+        TransferService().import_(path)
+    PageModel(db).add('extra', 'en', 1, 0, '<p>gone after replace</p>')
+    assert TransferService().import_(path, replace=True)['page'] == 2
+    assert PageModel(db).get_pages_list() == ['home', 'about']
+
+
+def test_broken_file_changes_nothing(db, tmp_path):
+    path = tmp_path / 'broken.ndjson'
+    page = {'type': 'page', 'id': 1, 'page': 'home', 'page_order': 0, 'locale': 'en', 'content': 'x', 'position': 1}
+    path.write_text(json.dumps(page) + '\n{"type": "comment", "id": 1\n')
+    with pytest.raises(ValueError, match='line 2'):
+        TransferService().import_(str(path))
+    path.write_text(json.dumps(page) + '\n' + json.dumps({'type': 'page', 'id': 2}) + '\n')
+    with pytest.raises(ValueError, match="missing 'page'"):
+        TransferService().import_(str(path))
+    assert PageModel(db).get_pages_list() == []
+
+
+def test_files_outside_uploads_are_not_unpacked(db, tmp_path):
+    archive = tmp_path / 'files.tar'
+    with tarfile.open(archive, 'w') as tar:
+        for name in ('uploads/ok.png', '../evil.png', 'templates/page.html'):
+            info = tarfile.TarInfo(name)
+            info.size = 2
+            tar.addfile(info, io.BytesIO(b'xx'))
+    assert TransferService()._read_files(str(archive)) == 1
+    assert Path('static/uploads/ok.png').exists() and not (tmp_path / 'evil.png').exists()
+    assert not Path('static/templates').exists()